@@ -1,366 +1,612 @@
-'''Comprehensive ventialtion simulation for 2 storey atrium building'''
-#imports
-from math import sqrt, cos, pi, sin
-from matplotlib import pyplot as plt
-from matplotlib.ticker import MultipleLocator
-
-#user defined variables
-H = [3,3]                       #room height
-H_a = 9                         #height of atrium
-vents = [[1,1],[1,1]]           #vent areas, as [low,high], or equivalently: [in,out]
-vents_a = [4,3]
-h_v = [3,6]                     #vent height above ext. vent, in atrium
-S = [60,60]                     #floor area
-S_a = 36
-n = [30,30]                     #num of people
-w = 100                         #power input per person
-T_day = 20                      #max daytime temp
-T_night = 5                     #min nighttime temp
-people_leave_work = True        #Do people go home outside of 9-5
-peak_solar = [20000,20000]      #peak solar heating, in watts. Try 1000*S.
-sunrise = 6                     #sunrise, time in 24h
-sunset = 18
-
-'''
-Room numbering system:
-                 _______
-                 |
-                 |     |
-  _______________|     |
- |                     |
- |               |     |
- |       1       |     |
-                 |  a  |
- |_______________|     |
- |                     |
- |               |     |
- |       0       |     |
-                 |      
- |_______________|_____|
-'''
-
-#fundamental variables
-c = 0.15                        #plume entrainment constant
-alpha = c                       #conversion to half line plume
-g_real = 9.81
-rho = 1.225
-
-#function definitions
-def get_ext_temp(t):
-    '''t is time in seconds since start of the test. return is Celcius'''
-    return ((T_night-T_day)/2)*cos(2*pi*t/(3600*24))+(T_day+T_night)/2
-def temp_from_g(g):
-    '''returns the temp of air from its effective gravity. mostly for readability'''
-    return T_night+(g/g_real)*(273+T_night)
-def g_from_temp(T):
-    '''returns effective gravity of air by temp, relative to ext air at midnight'''
-    return g_real*(T-T_night)/(273+T_night)
-def get_A_eff(a,b):
-    '''used in setup, calculates effective vent area from real vent areas'''
-    return sqrt(2)*a*b/sqrt(a**2+b**2)
-def get_z(M,Q,B):
-    '''takes momentum flux, volume flux, buoyancy flux, 
-    returns plume vertical origin correct
-    method taken from Hunt and Kaye 2001
-    '''
-    gamma = 5*Q**2*B/(4*alpha*M**(5/2))
-    if gamma > 88:
-        return 0.853*gamma**(-0.2)*5*Q/(6*alpha*M**0.5)
-    L = 2**(-1.5)*alpha**(-0.5)*M**(0.75)/B**0.5
-    return 1.057*L
-def get_dp(d, g_c, g_h, t, h, H):
-    '''get pressure drop across room due to chimney effect
-    ***WARNING***: can be negative
-    '''
-    net = g_c*h + g_h*(H-h) - g_from_temp(get_ext_temp(t))*H #net delta p in chimney
-    if d>h:
-        return g_c*h + g_h*(d-h) - g_from_temp(get_ext_temp(t))*d - net/2
-    return g_c*d - g_from_temp(get_ext_temp(t))*d - net/2
-def sign(n):
-    if n<0:
-        return -1
-    return 1
-def dump(h, g_h, g_c):
-    '''returns some basic info in event of handled exception. For debugging'''
-    print("h:   ", h)
-    print("g_h: ", g_h)
-    print("g_c: ", g_c)
-def w_to_B(watts):
-    '''converts watts to buoyancy input'''
-    return 0.0281*(watts/1000)
-def get_sun(t, rise, fall):
-    '''returns the fraction of the peak solar radiation for a set time'''
-    t = (t%(3600*24))/3600
-    if t<rise or t>fall:
-        return 0
-    return sin(pi*(t-rise)/(fall-rise))
-
-#setup variables
-B = w_to_B(w)                       #buoyancy input per person
-dt = 1                              #timestep in seconds
-steps = 24*3600*2
-A_eff = [get_A_eff(vents[i][0],vents[i][1]) for i in range(2)]      #effective vent area
-A_eff_a = get_A_eff(vents_a[0],vents_a[1])
-
-
-#main function
-def main():
-    #simulation variables
-    h = 0.99*H_a                    #chimney interface height
-    old_h = 0
-    g = [0,0]                       #effective gravity, rooms
-    flow = [1,1,1]                  #for debugging
-    #0: into hot layer, 1: h plume, 2: c plume, 3: inhale from h, 4 inhale from c
-    Q = [0,0]                       #volumetric flow rate, rooms
-    B_out = [0,0]                   #buoyancy flux out of room
-    B_in = [0,0]
-    g_h = 0                         #effective gravity of hot layer, chimney
-    g_c = 0
-    z = 0
-    dp = [0,0]
-    throughflow = 0
-
-    #plotting variables
-    ts = [] # /3600 is to convert to hrs for nice plot
-    Ts = [[],[]]
-    Ths = []
-    Tcs = []
-    flows = [[],[],[]]
-    hs = []
-    dps = [[],[]]
-    qs = [[],[]]
-    deltas = [[],[]]
-    throughflows = []
-    for i in range(steps):
-        #variables that must be reset
-        mixing = True
-        half_mixing = False
-        force_mixing = False
-        B_in_c = 0
-        B_out_c = 0
-        B_in_h = 0
-        B_out_h = 0
-        Q_in_c = 0
-        Q_out_c = 0
-        Q_in_h = 0
-        Q_out_h = 0
-
-        t = i*dt
-        old_h = h
-        g_ext = g_from_temp(get_ext_temp(t))
-
-        for j in range(2):
-            #rooms
-            dp[j] = get_dp(h_v[j], g_c, g_h, t, h, H_a)
-            dps[j].append(dp[j])
-            #dp = 0
-            Q[j] = A_eff[j]*sqrt(abs((g[j]-g_ext)*H[j]-dp[j]/rho)) #absolute value
-            B_out[j] = Q[j]*g[j]
-            if (g[j]-g_ext)*H[j]-dp[j]/rho>0:
-                #correct flow direction
-                B_in[j] = Q[j]*g_ext
-
-                #effect on chimney:
-                Q_in_c -= Q[j]
-                if h_v[j] > h:
-                    #direct into hot layer
-                    flow[j] = 0
-                    Q_in_h += Q[j]
-                    B_in_h += B_out[j]
-
-                else:
-                    #plume physics
-                    if g[j] > g_c:
-                        #hot plume
-                        flow[j] = 1
-                        if B_out[j] > 0:
-                            z = get_z(Q[j]/vents[j][1],Q[j],B_out[j])
-                            Q_in_h += alpha*B_out[j]**(1/3)*((h-h_v[j]+z)**(5/3)-(z)**(5/3))+Q[j]
-                            B_in_h += B_in[j]+g_c*alpha*B_out[j]**(1/3)*((h-h_v[j]+z)**(5/3)-(z)**(5/3))
-                            Q_out_c += alpha*B_out[j]**(1/3)*((h-h_v[j]+z)**(5/3)-(z)**(5/3))
-                            B_out_c += g_c*(alpha*B_out[j]**(1/3)*((h-h_v[j]+z)**(5/3)-(z)**(5/3)))
-                            mixing = False
-                        else:
-                            dump(h, g_h, g_c)
-                            raise ValueError(f"negative B_out: {B_out[j]}")
-                    else:
-                        #cold plume
-                        flow[j] = 2
-                        B_in_c += B_out[j]
-            else:
-                #reverse flow
-                Q_in_c += Q[j]
-                if h_v[j] > h:
-                    #inhaling from hot layer
-                    flow[j] = 3
-                    B_in[j] = Q[j]*g_h
-
-                    #effect on chimney:
-                    B_out_h += B_in[j]
-                    Q_out_h += Q[j]
-                else:
-                    #inhaling from cold layer
-                    flow[j] = 4
-                    B_in[j] = Q[j]*g_c
-
-                    #effect on chimney
-                    B_out_c += B_in[j]
-                    Q_out_c += Q[j]
-
-            if not (people_leave_work and (t%(24*3600) < 9*3600 or  t%(24*3600) > 17*3600)):
-                #if people are in the building, add their heat
-                B_in[j] += B*n[j]
-
-            B_in[j] += get_sun(t,sunrise,sunset)*w_to_B(peak_solar[j])
-            g[j] += dt*(B_in[j]-B_out[j])/(H[j]*S[j])
-            flows[j].append(flow[j]+j/10)
-
-        #chimney
-        if Q_in_h < throughflow and (not mixing) and h/H_a >=0.99:
-            half_mixing = True
-
-        if mixing and g_c >= g_h:
-            force_mixing = True
-            h = 0.99*H_a
-
-        if (h/H_a <0.99 or (not mixing)) and not force_mixing:
-            #displacement case
-            old_g_c = g_c
-            old_h = h
-            throughflow = sign(g_h*(H_a-h)+g_c*h-g_ext*H_a)*A_eff_a*sqrt(abs(g_h*(H_a-h)+g_c*h-g_ext*H_a))
-            if not half_mixing:
-                if throughflow > 0:
-                    #case 1: normal displacement flow
-                    flow[2] = 1
-                    Q_out_h += throughflow
-                    B_out_h += Q_out_h*g_h
-                    Q_in_c += abs(throughflow)
-                else:
-                    #case 2: top vent is backing up
-                    flow[2] = 2
-                    Q_in_c += abs(throughflow)
-                    Q_out_c += abs(throughflow)
-            else:
-                if throughflow > 0:
-                    #case 3: half mixing flow: top layer is very small
-                    #so vent outputs hot plume input, and some cold layer
-                    #distinct from mixing, where plume would mix into room
-                    flow[2] = 3
-                    Q_out_c += throughflow - Q_in_h
-                    Q_in_c += throughflow - Q_in_h
-                    Q_in_h = 0
-                    Q_out_h = 0
-                    B_in_h = 0
-                    B_out_h = 0
-                else:
-                    #edge case 4
-                    #very unlikely to occur at all, equivalent to case 2
-                    flow[2] = 4
-                    Q_in_c += abs(throughflow)
-                    Q_out_c += abs(throughflow)
-                    print("edge case")
-
-            h -= dt*(Q_in_h - Q_out_h)/S_a
-            g_h = (g_h*(H_a - old_h)*S_a + dt*(B_in_h - B_out_h))/((H_a - h)*S_a)
-            if Q_in_c > 0:
-                g_c = (g_c*old_h*S_a + dt*(g_from_temp(get_ext_temp(t))*Q_in_c + B_in_c - B_out_c))/(h*S_a)
-            else:
-                g_c = (g_c*old_h*S_a + dt*(B_in_c - B_out_c - abs(Q_in_c)*g_c))/(h*S_a)
-
-            if half_mixing:
-                g_h = g_c
-            deltas[0].append(t)
-            deltas[1].append(g_c-old_g_c)
-
-            mixing = False
-
-            #error handling
-            if old_g_c-g_c >1e-13 and g_ext>old_g_c and flow[0] != 2 and flow[1] != 2:
-                print("Second law violation: cold layer is cooling on its own!")
-                dump(h, g_h, g_c)
-                break
-            if h<0:
-                print("hot layer flowing out through lower vent, assumptions no longer hold!")
-                dump(h, g_h, g_c)
-                break
-            if h>H_a:
-                print(f"somehow, your hot layer has negative size at time {t}")
-                dump(h, g_h, g_c)
-                break
-
-        if mixing:
-            #mixing case
-            g_h = (g_c*h + g_c*(H_a-h))/H_a #normalise temp
-            g_c = g_h
-            old_g_c = g_c
-            flow[2] = 0
-            h = 0.99*H_a
-            # there has to be a virtual hot/cold layer, so that
-            # when mixing stops, we can go back to displacement
-
-            throughflow = sign((g_c-g_ext)*H_a)*A_eff_a*sqrt(abs(g_c-g_ext)*H_a)
-            Q_out_c = abs(throughflow) - Q_in_h
-            B_out_c = Q_out_c*g_c
-            B_in_c += Q_out_c*g_ext + B_in_h
-
-            g_c += dt*(B_in_c-B_out_c)/(H_a*S_a)
-            g_h = g_c
-            deltas[0].append(t)
-            deltas[1].append(g_c - old_g_c)
-
-        #gather data for graphing
-        ts.append(t/3600)
-        Ts[0].append(temp_from_g(g[0]))
-        Ts[1].append(temp_from_g(g[1]))
-        Ths.append(temp_from_g(g_h))
-        Tcs.append(temp_from_g(g_c))
-        hs.append(h)
-        qs[0].append(Q[0])
-        qs[1].append(Q[1])
-        flows[2].append(flow[2]+0.2)
-        throughflows.append(throughflow)
-
-    #plot graphs
-
-    plt.title("Room temps.")
-    plt.xlabel("Time (hrs)")
-    plt.ylabel("Temp (deg C)")
-    plt.plot(ts,Ts[0], label="Room 0")
-    plt.plot(ts,Ts[1], label="Room 1")
-    plt.plot(ts, [get_ext_temp(i*3600) for i in ts], label="External")
-    plt.gca().xaxis.set_major_locator(MultipleLocator(24)) # makes x-axis tickers every 24 hrs
-    plt.legend()
-    plt.show()
-
-    plt.title("Chimney layer temps.")
-    plt.xlabel("Time (hrs)")
-    plt.ylabel("Temp (deg C)")
-    plt.plot(ts, Ths, label="Hot layer")
-    plt.plot(ts, Tcs, label="Cold layer")
-    plt.plot(ts, [get_ext_temp(i*3600) for i in ts], label="External")
-    plt.gca().xaxis.set_major_locator(MultipleLocator(24))
-    plt.legend()
-    plt.show()
-
-    plt.title("Throughflow")
-    plt.xlabel("Time (hrs)")
-    plt.ylabel("Throughflow (m^3/s)")
-    plt.plot(ts,throughflows, label="chimney")
-    plt.plot(ts,qs[1], label="room 1")
-    plt.plot(ts,qs[0], label="room 0")
-    plt.gca().xaxis.set_major_locator(MultipleLocator(24))
-    plt.legend()
-    plt.show()
-
-    plt.title("Delta p")
-    plt.xlabel("Time (hrs)")
-    plt.ylabel("dp (pa)")
-    plt.plot(ts,dps[1], label="room 1")
-    plt.plot(ts,dps[0], label="room 0")
-    plt.gca().xaxis.set_major_locator(MultipleLocator(24))
-    plt.legend()
-    plt.show()
-
-#using best practices: because I know someone is going to read this code
-if __name__ == "__main__":
-    main()
+'''Comprehensive ventialtion simulation for a multi storey atrium building (2 storeys by default)'''
+#imports
+import ast
+from math import sqrt, cos, pi, sin
+from time import perf_counter
+from results import Results
+import forcing
+import plume
+
+#user defined variables
+H = [3,3]                       #room height
+H_a = 9                         #height of atrium
+vents = [[1,1],[1,1]]           #vent areas, as [low,high], or equivalently: [in,out]
+vents_a = [4,3]
+h_v = [3,6]                     #vent height above ext. vent, in atrium
+S = [60,60]                     #floor area
+S_a = 36
+n = [30,30]                     #num of people
+w = 100                         #power input per person
+T_day = 20                      #max daytime temp
+T_night = 5                     #min nighttime temp
+people_leave_work = True        #Do people go home outside of 9-5
+peak_solar = [20000,20000]      #peak solar heating, in watts. Try 1000*S.
+sunrise = 6                     #sunrise, time in 24h
+sunset = 18
+inlet_temp = None               #temp of precooled inlet air, None for unconditioned ext. air
+weather_file = None             #hourly weather file (csv or epw), None for the cosine between T_day and T_night.
+                                #T_night stays the reference temp, keep it at or below the coldest hour
+weather_start = 0               #hour of the weather file at which the run starts
+
+'''
+Room numbering system:
+                 _______
+                 |
+                 |     |
+  _______________|     |
+ |                     |
+ |               |     |
+ |       1       |     |
+                 |  a  |
+ |_______________|     |
+ |                     |
+ |               |     |
+ |       0       |     |
+                 |      
+ |_______________|_____|
+'''
+
+#fundamental variables
+c = 0.15                        #plume entrainment constant
+alpha = c                       #conversion to half line plume
+g_real = 9.81
+rho = 1.225
+
+#function definitions
+def get_ext_temp(t):
+    '''t is time in seconds since start of the test. return is Celcius'''
+    if weather_file is not None:
+        return get_weather().temp(t)
+    return ((T_night-T_day)/2)*cos(2*pi*t/(3600*24))+(T_day+T_night)/2
+def temp_from_g(g):
+    '''returns the temp of air from its effective gravity. mostly for readability'''
+    return T_night+(g/g_real)*(273+T_night)
+def g_from_temp(T):
+    '''returns effective gravity of air by temp, relative to ext air at midnight'''
+    return g_real*(T-T_night)/(273+T_night)
+def get_A_eff(a,b):
+    '''used in setup, calculates effective vent area from real vent areas'''
+    return sqrt(2)*a*b/sqrt(a**2+b**2)
+def get_z(M,Q,B):
+    '''takes momentum flux, volume flux, buoyancy flux, 
+    returns plume vertical origin correct (see plume.virtual_origin)
+    '''
+    return plume.virtual_origin(M, Q, B, alpha)
+def get_dp(d, g_c, g_h, g_ext, h, H):
+    '''get pressure drop across room due to chimney effect
+    ***WARNING***: can be negative
+    '''
+    net = g_c*h + g_h*(H-h) - g_ext*H #net delta p in chimney
+    if d>h:
+        return g_c*h + g_h*(d-h) - g_ext*d - net/2
+    return g_c*d - g_ext*d - net/2
+def sign(n):
+    if n<0:
+        return -1
+    return 1
+def dump(h, g_h, g_c):
+    '''returns some basic info in event of handled exception. For debugging'''
+    print("h:   ", h)
+    print("g_h: ", g_h)
+    print("g_c: ", g_c)
+def w_to_B(watts):
+    '''converts watts to buoyancy input'''
+    return 0.0281*(watts/1000)
+def get_sun(t, rise, fall):
+    '''returns the fraction of the peak solar radiation for a set time'''
+    t = (t%(3600*24))/3600
+    if t<rise or t>fall:
+        return 0
+    return sin(pi*(t-rise)/(fall-rise))
+
+#setup variables
+B = w_to_B(w)                       #buoyancy input per person
+dt = 1                              #timestep in seconds
+steps = 24*3600*2
+A_eff = [get_A_eff(vents[i][0],vents[i][1]) for i in range(len(vents))]      #effective vent area
+A_eff_a = get_A_eff(vents_a[0],vents_a[1])
+B_sun = [w_to_B(p) for p in peak_solar]    #peak solar buoyancy input
+adaptive = False                    #use adaptive timestepping, see run_adaptive()
+temp_tol = 0.05                     #adaptive: allowed local error in temps, deg C
+h_tol = 0.01                        #adaptive: allowed local error in interface height, m
+dt_max = 3600                       #adaptive: largest allowed timestep
+record_interval = 1                 #seconds between recorded points, e.g. 60 for long runs
+record_channels = None              #channels to keep (see results.channels), None for all
+record_dtype = "float64"            #"float32" halves the memory of the results
+plot_file = None                    #save the plots to this file (.png, .svg), None to show them
+instruments = None                  #instrument.Instruments to fill while running, None for no overhead
+
+#names of the user defined variables, i.e. what makes up a scenario
+user_variables = ["H", "H_a", "vents", "vents_a", "h_v", "S", "S_a", "n", "w", "T_day", "T_night",
+                  "people_leave_work", "peak_solar", "sunrise", "sunset", "inlet_temp",
+                  "weather_file", "weather_start"]
+
+def get_config(**overrides):
+    '''returns the user defined variables as a dict, with any overrides applied'''
+    for key in overrides:
+        if key not in user_variables:
+            raise KeyError(f"unknown user variable: {key}")
+    config = {key: globals()[key] for key in user_variables}
+    config.update(overrides)
+    return config
+
+def configure(**config):
+    '''sets user defined variables (as from get_config) and recomputes the setup variables'''
+    global B, A_eff, A_eff_a, B_sun
+    get_config(**config)                #checks the names
+    globals().update(config)
+    B = w_to_B(w)
+    A_eff = [get_A_eff(vents[i][0],vents[i][1]) for i in range(len(vents))]
+    A_eff_a = get_A_eff(vents_a[0],vents_a[1])
+    B_sun = [w_to_B(p) for p in peak_solar]
+
+def read_config(path):
+    '''reads the user defined variables from a copy of this script, e.g.
+    read_config("Ventilation precooled.py"). only plain literal assignments are read,
+    the file is not executed. anything it does not set is left at the default
+    '''
+    with open(path) as f:
+        tree = ast.parse(f.read())
+    config = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in user_variables:
+                config[name] = ast.literal_eval(node.value)
+    return get_config(**config)
+
+
+#forcing
+_weather = None
+
+def get_weather():
+    '''the weather file as a forcing.Weather, read once for as long as it covers the run'''
+    global _weather
+    if weather_file is None:
+        return None
+    key = (weather_file, weather_start, steps*dt)
+    if _weather is None or _weather[0] != key:
+        _weather = key, forcing.read_weather(weather_file, weather_start, steps*dt/3600 + 1)
+    return _weather[1]
+
+def get_inputs(t):
+    '''forcing at time t: (g_ext, sun fraction, people per room)'''
+    weather = get_weather()
+    sun = None if weather is None else weather.sun(t)
+    if sun is None:
+        sun = get_sun(t,sunrise,sunset)
+    if people_leave_work and (t%(24*3600) < 9*3600 or  t%(24*3600) > 17*3600):
+        people = [0]*len(n)
+    else:
+        people = n
+    return g_from_temp(get_ext_temp(t)), sun, people
+
+def iter_inputs(i0, i1):
+    '''forcing for steps i0 to i1, as get_inputs, read from precomputed tables'''
+    config = get_config()
+    weather = get_weather()
+    absent = [0]*len(n)
+    for k0 in range(i0, i1, forcing.block):
+        k1 = min(k0 + forcing.block, i1)
+        T_ext, sun, occupied = forcing.profiles(config, dt, k0, k1, weather)
+        for g_ext, s, o in zip(g_from_temp(T_ext).tolist(), sun.tolist(), occupied.tolist()):
+            yield g_ext, s, n if o else absent
+
+
+#timestep
+def initial_state():
+    '''state at t=0: (g, g_h, g_c, h, throughflow)'''
+    return [0]*len(H), 0, 0, 0.99*H_a, 0
+
+def step(t, dt, state, inputs=None):
+    '''advances state by one explicit step of length dt, starting at time t.
+    state is (g, g_h, g_c, h, throughflow) and is not modified.
+    inputs is the forcing at t (see get_inputs), worked out from t if not given.
+    returns (new_state, Q, dp, flow, delta, error), where flow holds the regime
+    codes at the start of the step and error is None or a message
+    '''
+    g, g_h, g_c, h, throughflow = state
+    g = list(g)
+    rooms = len(H)
+    flow = [1]*(rooms+1)            #for debugging, last is the chimney
+    #0: into hot layer, 1: h plume, 2: c plume, 3: inhale from h, 4 inhale from c
+    Q = [0]*rooms                   #volumetric flow rate, rooms
+    B_out = [0]*rooms               #buoyancy flux out of room
+    B_in = [0]*rooms
+    dp = [0]*rooms
+    error = None
+
+    #variables that must be reset
+    mixing = True
+    half_mixing = False
+    force_mixing = False
+    B_in_c = 0
+    B_out_c = 0
+    B_in_h = 0
+    B_out_h = 0
+    Q_in_c = 0
+    Q_out_c = 0
+    Q_in_h = 0
+    Q_out_h = 0
+
+    old_h = h
+    if inputs is None:
+        inputs = get_inputs(t)
+    g_ext, sun, people = inputs
+    g_in = g_ext if inlet_temp is None else g_from_temp(inlet_temp)    #air entering the chimney
+
+    if instruments is not None:
+        t_rooms = perf_counter()
+    for j in range(rooms):
+        #rooms
+        dp[j] = get_dp(h_v[j], g_c, g_h, g_ext, h, H_a)
+        #dp = 0
+        Q[j] = A_eff[j]*sqrt(abs((g[j]-g_ext)*H[j]-dp[j]/rho)) #absolute value
+        B_out[j] = Q[j]*g[j]
+        if (g[j]-g_ext)*H[j]-dp[j]/rho>0:
+            #correct flow direction
+            B_in[j] = Q[j]*g_ext
+
+            #effect on chimney:
+            Q_in_c -= Q[j]
+            if h_v[j] > h:
+                #direct into hot layer
+                flow[j] = 0
+                Q_in_h += Q[j]
+                B_in_h += B_out[j]
+
+            else:
+                #plume physics
+                if g[j] > g_c:
+                    #hot plume
+                    flow[j] = 1
+                    if B_out[j] > 0:
+                        z = plume.virtual_origin(Q[j]/vents[j][1],Q[j],B_out[j],alpha)
+                        E, B_E = plume.entrainment(B_out[j],z,h-h_v[j],alpha,g_c)    #from the cold layer
+                        Q_in_h += E+Q[j]
+                        B_in_h += B_in[j]+B_E
+                        Q_out_c += E
+                        B_out_c += g_c*E
+                        mixing = False
+                    else:
+                        dump(h, g_h, g_c)
+                        raise ValueError(f"negative B_out: {B_out[j]}")
+                else:
+                    #cold plume
+                    flow[j] = 2
+                    B_in_c += B_out[j]
+        else:
+            #reverse flow
+            Q_in_c += Q[j]
+            if h_v[j] > h:
+                #inhaling from hot layer
+                flow[j] = 3
+                B_in[j] = Q[j]*g_h
+
+                #effect on chimney:
+                B_out_h += B_in[j]
+                Q_out_h += Q[j]
+            else:
+                #inhaling from cold layer
+                flow[j] = 4
+                B_in[j] = Q[j]*g_c
+
+                #effect on chimney
+                B_out_c += B_in[j]
+                Q_out_c += Q[j]
+
+        if people[j]:
+            #if people are in the building, add their heat
+            B_in[j] += B*people[j]
+
+        B_in[j] += sun*B_sun[j]
+        g[j] += dt*(B_in[j]-B_out[j])/(H[j]*S[j])
+
+    if instruments is not None:
+        t_chimney = perf_counter()
+        instruments.timers["rooms"] += t_chimney - t_rooms
+
+    #chimney
+    if Q_in_h < throughflow and (not mixing) and h/H_a >=0.99:
+        half_mixing = True
+
+    if mixing and g_c >= g_h:
+        force_mixing = True
+        h = 0.99*H_a
+
+    if (h/H_a <0.99 or (not mixing)) and not force_mixing:
+        #displacement case
+        old_g_c = g_c
+        old_h = h
+        throughflow = sign(g_h*(H_a-h)+g_c*h-g_ext*H_a)*A_eff_a*sqrt(abs(g_h*(H_a-h)+g_c*h-g_ext*H_a))
+        if not half_mixing:
+            if throughflow > 0:
+                #case 1: normal displacement flow
+                flow[-1] = 1
+                Q_out_h += throughflow
+                B_out_h += Q_out_h*g_h
+                Q_in_c += abs(throughflow)
+            else:
+                #case 2: top vent is backing up
+                flow[-1] = 2
+                Q_in_c += abs(throughflow)
+                Q_out_c += abs(throughflow)
+        else:
+            if throughflow > 0:
+                #case 3: half mixing flow: top layer is very small
+                #so vent outputs hot plume input, and some cold layer
+                #distinct from mixing, where plume would mix into room
+                flow[-1] = 3
+                Q_out_c += throughflow - Q_in_h
+                Q_in_c += throughflow - Q_in_h
+                Q_in_h = 0
+                Q_out_h = 0
+                B_in_h = 0
+                B_out_h = 0
+            else:
+                #edge case 4
+                #very unlikely to occur at all, equivalent to case 2
+                flow[-1] = 4
+                Q_in_c += abs(throughflow)
+                Q_out_c += abs(throughflow)
+
+        h -= dt*(Q_in_h - Q_out_h)/S_a
+        g_h = (g_h*(H_a - old_h)*S_a + dt*(B_in_h - B_out_h))/((H_a - h)*S_a)
+        if Q_in_c > 0:
+            g_c = (g_c*old_h*S_a + dt*(g_in*Q_in_c + B_in_c - B_out_c))/(h*S_a)
+        else:
+            g_c = (g_c*old_h*S_a + dt*(B_in_c - B_out_c - abs(Q_in_c)*g_c))/(h*S_a)
+
+        if half_mixing:
+            g_h = g_c
+
+        mixing = False
+
+        #error handling, precooled inlet air can legitimately cool the cold layer
+        if inlet_temp is None and old_g_c-g_c >1e-13 and g_ext>old_g_c and 2 not in flow[:-1]:
+            error = "Second law violation: cold layer is cooling on its own!"
+        elif h<0:
+            error = "hot layer flowing out through lower vent, assumptions no longer hold!"
+        elif h>H_a:
+            error = f"somehow, your hot layer has negative size at time {t}"
+
+    if mixing:
+        #mixing case
+        g_h = (g_c*h + g_c*(H_a-h))/H_a #normalise temp
+        g_c = g_h
+        old_g_c = g_c
+        flow[-1] = 0
+        h = 0.99*H_a
+        # there has to be a virtual hot/cold layer, so that
+        # when mixing stops, we can go back to displacement
+
+        throughflow = sign((g_c-g_ext)*H_a)*A_eff_a*sqrt(abs(g_c-g_ext)*H_a)
+        Q_out_c = abs(throughflow) - Q_in_h
+        B_out_c = Q_out_c*g_c
+        B_in_c += Q_out_c*g_in + B_in_h
+
+        g_c += dt*(B_in_c-B_out_c)/(H_a*S_a)
+        g_h = g_c
+
+    if instruments is not None:
+        instruments.timers["chimney"] += perf_counter() - t_chimney
+    return (g, g_h, g_c, h, throughflow), Q, dp, flow, g_c - old_g_c, error
+
+
+#fixed step integration
+def new_results(capacity):
+    '''empty result store using the record_* setup variables'''
+    return Results(capacity, len(H), record_interval, record_channels, record_dtype)
+
+def record(res, t, state, Q, dp, flow, delta):
+    '''adds the state after a step starting at t to the result store'''
+    g, g_h, g_c, h, throughflow = state
+    res.record(t/3600, [temp_from_g(x) for x in g], temp_from_g(g_h), temp_from_g(g_c), h,
+               dp, Q, flow, delta, throughflow)
+
+def run(res=None, state=None, start=0, stop=None):
+    '''runs the fixed step model from step start to stop (default: steps), starting
+    from state (default: initial_state()), recording every record_interval seconds.
+    returns the result store (res, or a new one from new_results), res.state is
+    the state the run ended on and res.flow the flow codes of its last step
+    '''
+    stop = steps if stop is None else stop
+    every = max(1, round(record_interval/dt))
+    if res is None:
+        res = new_results((stop-start-1)//every + 1)
+    if state is None:
+        state = initial_state()
+    last_flow = None
+    for i, inputs in enumerate(iter_inputs(start, stop), start):
+        t = i*dt
+        new_state, Q, dp, flow, delta, error = step(t, dt, state, inputs)
+        if flow[-1] == 4:
+            print("edge case")
+        if error is not None:
+            print(error)
+            g, g_h, g_c, h, throughflow = new_state
+            dump(h, g_h, g_c)
+            res.error = error
+            break
+        if instruments is not None:
+            instruments.observe(t, dt, state, flow)
+        state = new_state
+        last_flow = flow
+        res.steps += 1
+
+        #gather data for graphing
+        if i % every == 0:
+            if instruments is not None:
+                t0 = perf_counter()
+            record(res, t, state, Q, dp, flow, delta)
+            if instruments is not None:
+                instruments.timers["record"] += perf_counter() - t0
+    res.state = state
+    res.flow = last_flow
+    return res
+
+
+#adaptive integration
+def next_breakpoint(t):
+    '''returns the next time after t at which the forcing jumps or kinks
+    (occupancy at 9 and 17h, sunrise and sunset), or the next midnight
+    '''
+    day = 24*3600
+    start = (t//day)*day
+    hours = [sunrise, sunset, 24]
+    if people_leave_work:
+        hours += [9, 17]
+    if weather_file is not None:
+        hours = range(25)               #hourly records
+    return min(start + hr*3600 for hr in hours if start + hr*3600 > t + 1e-9)
+
+def error_norm(a, b):
+    '''scaled difference between two states, 1 is the tolerance'''
+    k = (273+T_night)/g_real         #converts effective gravity to deg C
+    err = abs(a[3]-b[3])/h_tol
+    for x, y in zip([a[1], a[2]] + a[0], [b[1], b[2]] + b[0]):
+        err = max(err, k*abs(x-y)/temp_tol)
+    return err
+
+def get_regime(t, state):
+    '''flow codes [room 0, room 1, chimney] that a step from state would take'''
+    return step(t, 0, state)[3]
+
+def locate_switch(t, tau, state, regime):
+    '''bisects for the first time in (t, t+tau] at which a single step from state
+    leaves regime, to within the fixed timestep dt
+    '''
+    lo, hi = 0, tau
+    while hi - lo > dt:
+        mid = (lo+hi)/2
+        if get_regime(t+mid, step(t, mid, state)[0]) != regime:
+            hi = mid
+        else:
+            lo = mid
+    return hi
+
+def run_adaptive(res=None):
+    '''runs the model with step doubling error control.
+    steps stop at forcing breakpoints, and steps that would cross a change in flow
+    regime are cut back so that they end on the switch (to within dt)
+    accepted steps are recorded at most every record_interval seconds, at the end
+    of the step. returns the result store, its steps are the accepted steps
+    the error in a switch time is not controlled, so h, which jumps at a switch,
+    can be far from the fixed step run's near a switch, see compare_adaptive()
+    '''
+    state = initial_state()
+    t_end = steps*dt
+    t = 0
+    t_record = 0
+    tau_next = dt
+    if res is None:
+        res = new_results(1024)
+    while t < t_end - 1e-9:
+        tau = min(tau_next, dt_max, next_breakpoint(t) - t, t_end - t)
+        full = step(t, tau, state)
+        half = step(t, tau/2, state)
+        two = step(t + tau/2, tau/2, half[0])
+        regime = full[3]
+        if tau > dt and (full[5] or half[5] or two[5]):
+            tau_next = tau/2
+            continue
+        err = error_norm(full[0], two[0])
+        if tau > dt and err > 1:
+            tau_next = max(dt, tau*max(0.2, 0.9*err**-0.5))
+            continue
+        if tau > dt and (two[3] != regime or get_regime(t+tau, two[0]) != regime):
+            #regime switch inside the step: end the step on it
+            tau = locate_switch(t, tau, state, regime)
+            full = step(t, tau, state)
+            half = step(t, tau/2, state)
+            two = step(t + tau/2, tau/2, half[0])
+            err = error_norm(full[0], two[0])
+            if tau > dt and err > 1:
+                tau_next = max(dt, tau*max(0.2, 0.9*err**-0.5))
+                continue
+        error = two[5] or half[5]
+        new_state, Q, dp, flow, delta = two[0], two[1], two[2], two[3], half[4] + two[4]
+        if error is not None:
+            print(error)
+            g, g_h, g_c, h, throughflow = new_state
+            dump(h, g_h, g_c)
+            res.error = error
+            break
+        if flow[-1] == 4:
+            print("edge case")
+        if instruments is not None:
+            instruments.observe(t, tau, state, flow)
+        state = new_state
+        t += tau
+        res.steps += 1
+        tau_next = tau*min(2, 0.9*max(err, 1e-6)**-0.5)
+
+        if t >= t_record - 1e-9:
+            if instruments is not None:
+                t0 = perf_counter()
+            record(res, t, state, Q, dp, flow, delta)
+            if instruments is not None:
+                instruments.timers["record"] += perf_counter() - t0
+            t_record = t + record_interval
+    res.state = state
+    return res
+
+def compare_adaptive():
+    '''runs the fixed step and adaptive models and prints them side by side.
+    returns the adaptive result store
+    h is not error controlled across a regime switch: the tolerances bound the
+    error within a step, so over a day the adaptive run reaches a switch some
+    seconds before or after the fixed one, and h jumps by up to the atrium height
+    at a switch (in the default building the two runs are about 6 m apart for
+    about 25 s at 24.4 hrs). the max dev of h is over every record, switches included
+    '''
+    import numpy as np
+    from time import perf_counter
+
+    start = perf_counter()
+    fixed = run()
+    fixed_time = perf_counter() - start
+    start = perf_counter()
+    adapt = run_adaptive()
+    adapt_time = perf_counter() - start
+
+    #fixed step records at t hold the state at t+dt
+    t_fixed = fixed["t"] + dt/3600
+    def dev(a, b):
+        return np.max(np.abs(np.interp(adapt["t"], t_fixed, a) - b))
+    print(f"{'':24}{'fixed':>12}{'adaptive':>12}")
+    print(f"{'steps':24}{fixed.steps:>12}{adapt.steps:>12}")
+    print(f"{'wall time (s)':24}{fixed_time:>12.2f}{adapt_time:>12.2f}")
+    rows = [("room %d (deg C)" % j, "T", j) for j in range(len(H))]
+    rows += [("hot layer (deg C)", "T_h", None), ("cold layer (deg C)", "T_c", None),
+             ("interface height (m)", "h", None)]
+    for name, channel, j in rows:
+        if channel not in fixed:
+            continue
+        a, b = fixed[channel], adapt[channel]
+        if j is not None:
+            a, b = a[:,j], b[:,j]
+        print(f"{name:24}{'final':>8}{a[-1]:>12.3f}{b[-1]:>12.3f}   max dev {dev(a, b):.3f}")
+    if "h" in fixed:
+        print("the interface height is not error controlled across regime switches")
+    return adapt
+
+
+#main function
+def main():
+    if adaptive:
+        res = compare_adaptive()
+    else:
+        res = run()
+
+    #plot graphs, plotting is only imported here so batch runs never load matplotlib
+    import plotting
+    ext = lambda hrs: forcing.ext_temp(get_config(), hrs*3600, get_weather())
+    if plot_file is None:
+        plotting.show(res, ext)
+    else:
+        plotting.save(res, plot_file, ext)
+
+#using best practices: because I know someone is going to read this code
+if __name__ == "__main__":
+    main()
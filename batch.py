@@ -0,0 +1,181 @@
+'''Batch runs of many scenarios from one TOML or JSON file, summarised in one table.
+
+Every scenario is a set of overrides of the user defined variables (keys as in
+optimise.py, so "vents_a[0]" sets one entry), on top of the file's defaults
+and optionally of a copy of the script ("script", read with
+Ventilation.read_config). A precooled inlet is just inlet_temp, so a
+precooled variant of any scenario is that scenario plus inlet_temp = 20. Imports and the
+compiled kernel are paid once per process: scenarios run one after the other
+with kernel.run() in this process, or spread over a process pool whose
+workers compile once each.
+
+    [run]                           #all optional, the command line wins
+    hours = 48
+    dt = 1
+    record_every = 60               #steps between the records the KPIs are taken over
+    workers = 1                     #1 runs in this process
+
+    [defaults]                      #applied to every scenario
+    T_day = 30
+
+    [[scenarios]]
+    name = "design"
+
+    [[scenarios]]
+    name = "precooled"
+    inlet_temp = 20
+
+    [[scenarios]]
+    name = "old copy"
+    script = "Ventilation precooled.py"     #relative to the scenario file
+
+The same as JSON is {"run": {...}, "defaults": {...}, "scenarios": [{...}, ...]}.
+
+    python batch.py scenarios.toml -o summary.csv       #or .json, --workers 4
+'''
+#imports
+import argparse
+import csv
+import json
+import os
+import tomllib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import kernel
+import kpi
+import optimise
+import parallel
+import Ventilation as V
+
+#per room KPIs in the table, and how the rooms are reduced to the worst one
+room_kpis = {"hours_above_25": np.max, "hours_above_28": np.max, "comfort_hours": np.max,
+             "mean_ach": np.min}
+columns = ["name", "steps_run", "error"] + parallel.metrics + list(room_kpis) + ["mean_chimney_ach",
+                                                                              "max_stratification"]
+run_options = {"hours": None, "dt": None, "record_every": 60, "workers": 1}      #None: from Ventilation when run
+
+
+def read(path):
+    '''the run options and [(name, config)] of a scenario file'''
+    with open(path, "rb") as f:
+        spec = json.load(f) if path.endswith(".json") else tomllib.load(f)
+    unknown = set(spec) - {"run", "defaults", "scenarios"}
+    if unknown:
+        raise ValueError(f"{path}: unknown sections {sorted(unknown)}")
+    options = dict(run_options, **spec.get("run", {}))
+    defaults = spec.get("defaults", {})
+    here = os.path.dirname(os.path.abspath(path))
+    scenarios = []
+    for k, s in enumerate(spec.get("scenarios", [])):
+        s = dict(s)
+        name = str(s.pop("name", k))
+        script = s.pop("script", None)
+        if script is None:
+            base = V.get_config()
+        else:
+            base = V.read_config(script if os.path.isabs(script) else os.path.join(here, script))
+        try:
+            config = V.get_config(**optimise.apply(optimise.apply(base, defaults), s))
+        except (KeyError, IndexError, TypeError) as e:
+            raise ValueError(f"{path}: scenario {name}: {e}") from None
+        scenarios.append((name, config))
+    if not scenarios:
+        raise ValueError(f"{path}: no scenarios")
+    return options, scenarios
+
+def summarise(metrics, res, config):
+    '''one row of the table for a run, without its name, from its summary metrics and
+    its records
+    '''
+    k = kpi.compute(res, config)
+    row = dict(zip(parallel.metrics, map(float, metrics)))
+    row.update({key: float(reduce(k[key])) for key, reduce in room_kpis.items()})
+    row["mean_chimney_ach"] = float(k["mean_chimney_ach"])
+    row["max_stratification"] = float(k["max_stratification"])
+    row["steps_run"] = res.steps
+    row["error"] = res.error or ""
+    return row
+
+def run_one(config, dt, steps, record_every):
+    '''runs one config with parallel.run_legs(), leaving Ventilation as it was: the summary
+    metrics over every step, the KPIs over every record_every-th. returns its row
+    '''
+    saved = V.get_config(), V.steps
+    try:
+        V.configure(**config)
+        V.steps = steps
+        metrics, res, _, _ = parallel.run_legs(dt, steps, record_every, ["T", "T_h", "T_c", "Q", "throughflow"])
+        return summarise(metrics, res, config)
+    finally:
+        config, V.steps = saved
+        V.configure(**config)
+
+def _init():
+    '''runs once in each worker: compiles the kernel'''
+    V.steps = 2
+    kernel.run()
+
+def _row(args):
+    return run_one(*args)
+
+def run(scenarios, hours=None, dt=None, record_every=60, workers=1):
+    '''runs [(name, config)], in this process if workers is 1, else over a process pool
+    (None for one worker per core), for hours (default: Ventilation's steps) at dt
+    (default: Ventilation's). returns the rows of the table, as dicts of columns
+    '''
+    hours = V.steps*V.dt/3600 if hours is None else hours
+    dt = V.dt if dt is None else dt
+    steps = round(hours*3600/dt)
+    jobs = [(config, dt, steps, record_every) for _, config in scenarios]
+    if workers == 1:
+        rows = [_row(job) for job in jobs]
+    else:
+        workers = min(workers or os.cpu_count(), len(jobs))
+        with ProcessPoolExecutor(workers, initializer=_init) as pool:
+            rows = list(pool.map(_row, jobs, chunksize=max(1, len(jobs)//(4*workers))))
+    return [{"name": name, **row} for (name, _), row in zip(scenarios, rows)]
+
+def write(rows, path):
+    '''writes the table to path, as JSON (nan as null) if it ends in .json, else CSV'''
+    if path.endswith(".json"):
+        with open(path, "w") as f:
+            nan_to_none = lambda x: None if isinstance(x, float) and np.isnan(x) else x
+            json.dump([{c: nan_to_none(row[c]) for c in columns} for row in rows], f, indent=1)
+        return path
+    with open(path, "w", newline="") as f:
+        out = csv.DictWriter(f, columns, extrasaction="ignore")
+        out.writeheader()
+        out.writerows(rows)
+    return path
+
+def show(rows):
+    '''prints the table'''
+    width = max(12, max(len(row["name"]) for row in rows) + 2)
+    numbers = columns[3:]
+    print(f"{'scenario':>{width}}" + "".join(f"{c:>20}" for c in numbers))
+    for row in rows:
+        print(f"{row['name']:>{width}}" + "".join(f"{row[c]:>20.3f}" for c in numbers))
+        if row["error"]:
+            print(f"{'':>{width}}  failed after {row['steps_run']} steps: {row['error']}")
+
+def main():
+    parser = argparse.ArgumentParser(description="runs every scenario in a TOML or JSON file")
+    parser.add_argument("scenarios", help="scenario file, .toml or .json")
+    parser.add_argument("-o", "--output", help="table to write, .csv or .json")
+    parser.add_argument("--workers", type=int, help="processes, 1 runs in this one, 0 one per core")
+    parser.add_argument("--hours", type=float)
+    parser.add_argument("--dt", type=float)
+    parser.add_argument("--record-every", type=int)
+    args = parser.parse_args()
+    options, scenarios = read(args.scenarios)
+    for key in ("workers", "hours", "dt", "record_every"):
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+    rows = run(scenarios, options["hours"], options["dt"], options["record_every"],
+               options["workers"] or None)
+    show(rows)
+    if args.output:
+        print(write(rows, args.output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+'''Benchmarks of the model engines, checked against golden trajectories.
+
+Each reference scenario (the two scripts as they are, two days at dt=1) has a
+golden trajectory in golden/, recorded every minute by the fixed step model:
+room temps, hot and cold layer temps, h and throughflow. bench() runs every
+engine on every scenario in a fresh process, timing it and reading the peak
+memory of the process, and compares its trajectory with the golden one within
+the engine's tolerances. With the ensemble engine, a batch with a failing
+member is also checked to be scored over the time that member ran
+(check_failure). The results go to a JSON file, tagged with the commit,
+so runs on different commits can be compared.
+
+    python bench.py                         #all engines, writes bench.json
+    python bench.py --hours 6 -e scalar ensemble
+    python bench.py --compare old.json      #steps/s against an earlier run
+    python bench.py --golden                #regenerate golden/ (only if the physics changed)
+'''
+#imports
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+import numpy as np
+import Ventilation as V
+
+here = os.path.dirname(os.path.abspath(__file__))
+golden_dir = os.path.join(here, "golden")
+scenarios = {"default": "Ventilation.py", "precooled": "Ventilation precooled.py"}
+dt = 1
+hours = 48
+record_every = 60                   #steps between golden records
+golden_channels = ["T", "T_h", "T_c", "h", "throughflow"]
+
+
+#engines: each runs the configured model (V.configure, V.dt, V.steps) and returns
+#(trajectory dict of golden_channels plus "t", steps taken)
+def run_scalar():
+    res = V.run()
+    return {name: res[name] for name in ["t"] + golden_channels}, res.steps
+
+def run_adaptive():
+    res = V.run_adaptive()
+    return {name: res[name] for name in ["t"] + golden_channels}, res.steps
+
+def run_ensemble():
+    import ensemble
+    res = ensemble.run([V.get_config()], V.dt, V.steps, record_every)
+    return {name: res[name][:,0] if name != "t" else res[name] for name in ["t"] + golden_channels}, V.steps
+
+def run_kernel():
+    import kernel
+    res = kernel.run()
+    return {name: res[name] for name in ["t"] + golden_channels}, res.steps
+
+def run_tower():
+    import tower
+    res = tower.run(V.get_config(), V.dt, V.steps)
+    return {name: res[name] for name in ["t"] + golden_channels}, res.steps
+
+#name: (engine, tolerances). a tolerance bounds the abs deviation from golden of
+#temps (deg C), h (m) and throughflow (m^3/s), taken over the records at quantile:
+#1 is the max, the adaptive model is allowed to place regime switches slightly
+#off the fixed step ones, which moves h and throughflow a lot for a record or two.
+#the ensemble engine rounds differently, which the regime chatter in the default
+#building amplifies to a few mK by the second day
+exact = {"temp": 1e-9, "h": 1e-9, "throughflow": 1e-9, "quantile": 1}
+array = {"temp": 0.01, "h": 0.01, "throughflow": 0.01, "quantile": 1}
+engines = {
+    "scalar": (run_scalar, exact),
+    "kernel": (run_kernel, exact),
+    "adaptive": (run_adaptive, {"temp": 0.1, "h": 0.1, "throughflow": 1.0, "quantile": 0.99}),
+    "ensemble": (run_ensemble, array),
+    "tower": (run_tower, exact),
+}
+
+#a config that fails about 6.4 hrs into the default scenario, for check_failure()
+failing = {"vents_a": [0.2, 0.2]}
+
+
+def golden_path(scenario):
+    return os.path.join(golden_dir, scenario + ".npz")
+
+def setup(scenario, run_hours=hours):
+    '''configures Ventilation for a reference scenario, recording every minute'''
+    V.configure(**V.read_config(os.path.join(here, scenarios[scenario])))
+    V.dt = dt
+    V.steps = round(run_hours*3600/dt)
+    V.adaptive = False
+    V.record_interval = record_every*dt
+    V.record_channels = golden_channels
+
+def make_golden():
+    '''records the golden trajectories with the fixed step model'''
+    os.makedirs(golden_dir, exist_ok=True)
+    for scenario in scenarios:
+        setup(scenario)
+        traj, steps = run_scalar()
+        np.savez_compressed(golden_path(scenario), config=json.dumps(V.get_config()),
+                            dt=dt, steps=steps, **traj)
+        print(f"{golden_path(scenario)}: {steps} steps, {len(traj['t'])} records")
+
+def load_golden(scenario):
+    with np.load(golden_path(scenario)) as f:
+        return {name: f[name] for name in ["t"] + golden_channels}
+
+def deviation(traj, golden, quantile=1):
+    '''abs deviation per channel at quantile (1 for the max) over the golden records
+    the trajectory covers, taking the worst room of each record. trajectories
+    recorded at other times (adaptive) are interpolated onto the golden ones
+    '''
+    t = golden["t"]
+    same = len(traj["t"]) >= len(t) and np.array_equal(traj["t"][:len(t)], t)
+    if not same:
+        t = t[t <= traj["t"][-1]] if len(traj["t"]) else t[:0]
+    n = len(t)
+    dev = {}
+    for name in golden_channels:
+        ref = golden[name][:n]
+        if same:
+            got = traj[name][:n]
+        elif ref.ndim == 2:
+            got = np.stack([np.interp(t, traj["t"], traj[name][:,j]) for j in range(ref.shape[1])], axis=1)
+        else:
+            got = np.interp(t, traj["t"], traj[name])
+        d = np.abs(got - ref)
+        if d.ndim == 2:
+            d = d.max(axis=1)
+        dev[name] = float(np.quantile(d, quantile)) if n else float("nan")
+    return dev, n
+
+def _job(engine, scenario, run_hours):
+    '''one timed run in a fresh process'''
+    setup(scenario, run_hours)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.perf_counter()
+    traj, steps = engines[engine][0]()
+    wall = time.perf_counter() - t0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    scale = 1 if sys.platform == "darwin" else 1024     #ru_maxrss is in kB on linux
+    return traj, steps, wall, rss*scale/2**20, (rss - rss_before)*scale/2**20
+
+def _failure_job(run_hours):
+    '''KPIs of a failing ensemble member and of the same config run alone'''
+    import ensemble
+    import kpi
+    setup("default", run_hours)
+    base = V.get_config()
+    res = ensemble.run([base, dict(base, **failing)], V.dt, V.steps, record_every)
+    V.configure(**failing)
+    alone = V.run()
+    return float(res["fail_time"][1]), kpi.compute(res), kpi.compute(alone)
+
+def check_failure(run_hours=24):
+    '''checks that a failed ensemble member is scored over the time it ran (its
+    room_hours is its fail_time, to a record) and as the same config run alone.
+    returns a dict of the check, "passed" False if it does not hold
+    '''
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+        fail_time, batch, alone = pool.submit(_failure_job, run_hours).result()
+    hours = batch["room_hours"][1]
+    ok = bool(fail_time < run_hours*3600
+              and np.all(np.abs(hours - fail_time/3600) <= record_every*dt/3600)
+              and np.allclose(hours, alone["room_hours"])
+              and np.all(np.abs(batch["mean_T"][1] - alone["mean_T"]) <= array["temp"]))
+    print(f"failed member: fails at {fail_time:.0f} s, room hours {hours.max():.3f} "
+          f"(alone {alone['room_hours'].max():.3f}), mean T {batch['mean_T'][1].max():.3f} "
+          f"(alone {alone['mean_T'].max():.3f})   {'yes' if ok else 'NO'}")
+    return {"fail_time": fail_time, "room_hours": hours.tolist(), "alone_room_hours": alone["room_hours"].tolist(),
+            "mean_T": batch["mean_T"][1].tolist(), "alone_mean_T": alone["mean_T"].tolist(), "passed": ok}
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=here, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def bench(names=None, run_hours=hours, path="bench.json"):
+    '''times and checks the engines on every scenario, writes the results to path.
+    returns the results dict, with "passed" False if any engine is out of tolerance
+    '''
+    names = list(engines) if names is None else names
+    out = {"commit": git_commit(), "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+           "python": platform.python_version(), "numpy": np.__version__,
+           "hours": run_hours, "runs": [], "passed": True}
+    print(f"{'engine':<10}{'scenario':<11}{'steps':>8}{'wall (s)':>10}{'steps/s':>10}"
+          f"{'peak MB':>9}{'dev T':>11}{'h':>10}   ok")
+    for scenario in scenarios:
+        golden = load_golden(scenario)
+        for engine in names:
+            with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                traj, steps, wall, peak, grown = pool.submit(_job, engine, scenario, run_hours).result()
+            tol = engines[engine][1]
+            dev, n = deviation(traj, golden, tol["quantile"])
+            tols = {"T": tol["temp"], "T_h": tol["temp"], "T_c": tol["temp"], "h": tol["h"],
+                    "throughflow": tol["throughflow"]}
+            ok = n > 0 and all(dev[name] <= tols[name] for name in golden_channels)
+            out["passed"] &= ok
+            out["runs"].append({"engine": engine, "scenario": scenario, "steps": steps, "wall": wall,
+                                "steps_per_sec": steps/wall, "peak_rss_mb": peak, "run_rss_mb": grown,
+                                "records_checked": n, "quantile": tol["quantile"], "deviation": dev,
+                                "tolerance": tols, "passed": ok})
+            T_dev = max(dev["T"], dev["T_h"], dev["T_c"])
+            print(f"{engine:<10}{scenario:<11}{steps:>8}{wall:>10.2f}{steps/wall:>10.0f}"
+                  f"{peak:>9.1f}{T_dev:>11.2e}{dev['h']:>10.2e}   {'yes' if ok else 'NO'}")
+    if "ensemble" in names:
+        out["failure_check"] = check_failure()
+        out["passed"] &= out["failure_check"]["passed"]
+    with open(path, "w") as f:
+        json.dump(out, f, indent=1)
+    return out
+
+def compare(old_path, new_path="bench.json"):
+    '''prints steps/s of two bench results side by side'''
+    with open(old_path) as f:
+        old = {(r["engine"], r["scenario"]): r for r in json.load(f)["runs"]}
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{'engine':<10}{'scenario':<11}{'old steps/s':>12}{'new steps/s':>12}{'ratio':>8}")
+    for r in new["runs"]:
+        o = old.get((r["engine"], r["scenario"]))
+        if o is None:
+            continue
+        print(f"{r['engine']:<10}{r['scenario']:<11}{o['steps_per_sec']:>12.0f}"
+              f"{r['steps_per_sec']:>12.0f}{r['steps_per_sec']/o['steps_per_sec']:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the model engines against golden trajectories")
+    parser.add_argument("-e", "--engines", nargs="+", choices=list(engines), help="engines to run (default: all)")
+    parser.add_argument("--hours", type=float, default=hours, help="simulated hours per run")
+    parser.add_argument("-o", "--output", default="bench.json", help="results file")
+    parser.add_argument("--compare", metavar="OLD", help="compare the results with an earlier results file")
+    parser.add_argument("--golden", action="store_true", help="regenerate the golden trajectories")
+    args = parser.parse_args()
+    if args.golden:
+        make_golden()
+        return
+    out = bench(args.engines, args.hours, args.output)
+    if args.compare:
+        compare(args.compare, args.output)
+    if not out["passed"]:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
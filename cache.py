@@ -0,0 +1,169 @@
+'''On-disk cache of model runs, keyed by everything that goes into a run.
+
+The key is a hash of the user defined variables, the physical constants, dt,
+steps, the record settings, the contents of the weather file and the source of
+the modules the results depend on (for summaries also the compiled model and
+its reduction, summary_modules), so editing the model invalidates every
+entry. Entries are .npz files in cache_dir. The cache is kept under max_bytes
+by deleting the least recently used entries (a hit touches its file).
+
+    import cache
+    res = cache.run()       #Ventilation.run(), or the stored result of an identical run
+'''
+#imports
+import hashlib
+import importlib
+import json
+import os
+from functools import lru_cache
+import numpy as np
+import forcing
+import plume
+import results
+import Ventilation as V
+
+cache_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".run_cache")
+max_bytes = 2**30                   #size budget of the cache
+code_modules = [V, plume, forcing, results]
+summary_modules = ["kernel", "parallel"]    #also run by summary entries, imported when needed
+
+
+@lru_cache(maxsize=None)
+def _file_hash(path, mtime, size):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(2**20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+def file_hash(path):
+    '''hash of a file's contents, worked out again only if it was modified'''
+    stat = os.stat(path)
+    return _file_hash(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+def code_hash(modules=None):
+    '''hash of the source of the modules a run depends on (default code_modules)'''
+    modules = code_modules if modules is None else modules
+    return hashlib.sha256("".join(file_hash(m.__file__) for m in modules).encode()).hexdigest()
+
+def inputs(adaptive=False, modules=None):
+    '''everything the result of a run depends on, as a dict'''
+    return {"config": V.get_config(), "c": V.c, "alpha": V.alpha, "g_real": V.g_real, "rho": V.rho,
+            "dt": V.dt, "steps": V.steps, "variant": "plain" if V.inlet_temp is None else "precooled",
+            "adaptive": adaptive and {"temp_tol": V.temp_tol, "h_tol": V.h_tol, "dt_max": V.dt_max},
+            "record": [V.record_interval, V.record_channels, V.record_dtype],
+            "weather": None if V.weather_file is None else file_hash(V.weather_file),
+            "code": code_hash(modules)}
+
+def key(adaptive=False):
+    '''cache key of a run of the current config'''
+    text = json.dumps(inputs(adaptive), sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:32]
+
+def path_of(k):
+    return os.path.join(cache_dir, k + ".npz")
+
+def save(k, res):
+    '''stores a result store under key k, replacing any entry atomically'''
+    os.makedirs(cache_dir, exist_ok=True)
+    meta = {"rooms": res.rooms, "interval": res.interval, "names": res.names, "dtype": res.dtype,
+            "steps": res.steps, "error": res.error, "flow": res.flow,
+            "state": None if res.state is None else [list(res.state[0])] + list(res.state[1:])}
+    tmp = path_of(k) + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, meta=json.dumps(meta), **{name: res[name] for name in res.names})
+    os.replace(tmp, path_of(k))
+
+def load(k):
+    '''the result store under key k, None if there is none'''
+    path = path_of(k)
+    try:
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            res = results.Results(len(f["t"]), meta["rooms"], meta["interval"], meta["names"], meta["dtype"])
+            res.extend(*[f[name] if name in res.names else None for name in results.record_order])
+    except (OSError, KeyError, ValueError):
+        return None
+    res.steps = meta["steps"]
+    res.error = meta["error"]
+    res.flow = meta["flow"]
+    if meta["state"] is not None:
+        res.state = (meta["state"][0],) + tuple(meta["state"][1:])
+    os.utime(path)                      #most recently used
+    return res
+
+def entries():
+    '''(last used, bytes, path) of every entry, least recently used first'''
+    if not os.path.isdir(cache_dir):
+        return []
+    found = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npz"):
+            stat = os.stat(os.path.join(cache_dir, name))
+            found.append((stat.st_mtime, stat.st_size, os.path.join(cache_dir, name)))
+    return sorted(found)
+
+def evict(budget=None):
+    '''deletes least recently used entries until the cache fits in budget bytes'''
+    budget = max_bytes if budget is None else budget
+    found = entries()
+    total = sum(size for _, size, _ in found)
+    for _, size, path in found:
+        if total <= budget:
+            break
+        os.remove(path)
+        total -= size
+
+def clear():
+    evict(0)
+
+def run(adaptive=False):
+    '''Ventilation.run() (or run_adaptive()) of the current config, from the cache if
+    an identical run is stored. runs that end on a failure are stored too
+    '''
+    k = key(adaptive)
+    res = load(k)
+    if res is not None:
+        return res
+    res = V.run_adaptive() if adaptive else V.run()
+    save(k, res)
+    evict()
+    return res
+
+def summary(compute, name="summary"):
+    '''compute() -> (values, steps, error), a summary of a run of the current config,
+    or the stored one of an identical run. the entry is keyed as for run() with the
+    record settings replaced by name, so only the values are kept, and the source of
+    summary_modules hashed too
+    '''
+    modules = code_modules + [importlib.import_module(m) for m in summary_modules]
+    text = json.dumps(dict(inputs(modules=modules), record=name), sort_keys=True)
+    k = hashlib.sha256(text.encode()).hexdigest()[:32]
+    path = path_of(k)
+    try:
+        with np.load(path) as f:
+            meta = json.loads(str(f["meta"]))
+            values = f["values"]
+        os.utime(path)
+        return values, meta["steps"], meta["error"]
+    except (OSError, KeyError, ValueError):
+        pass
+    values, steps, error = compute()
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, values=np.asarray(values, dtype=float), meta=json.dumps({"steps": steps, "error": error}))
+    os.replace(tmp, path)
+    evict()
+    return values, steps, error
+
+def main():
+    import time
+    for attempt in ("first", "repeat"):
+        t0 = time.perf_counter()
+        res = run()
+        print(f"{attempt} run: {time.perf_counter() - t0:.3f} s, {len(res)} records")
+    print(f"{len(entries())} entries, {sum(size for _, size, _ in entries())/2**20:.1f} MB in {cache_dir}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+'''Checkpoints: restart a long run, or warm-start a new scenario from an old one.
+
+run() is Ventilation.run() in legs of a fixed simulated time, writing the state
+at the end of each leg to a small .npz file in a directory: g, g_h, g_c, h,
+throughflow, the flow codes of the last step, the step index and a hash of the
+config. If the run fails or is killed, calling run() again with the same
+directory and config picks up at the last checkpoint instead of t=0.
+
+warm_start() runs whatever is configured now from an earlier checkpoint, which
+may come from another config, e.g. a what-if that changes occupancy on day 3
+reuses days 1-2 of a base run:
+
+    import Ventilation as V, checkpoint
+    V.steps = 3*24*3600
+    base = checkpoint.run("base")
+    V.configure(n=[15, 15])
+    what_if = checkpoint.warm_start("base", at=48)     #hrs
+'''
+#imports
+import hashlib
+import json
+import os
+import time
+import numpy as np
+import Ventilation as V
+
+name_format = "step_{:010d}.npz"
+
+
+def config_hash(config=None):
+    '''hash of a config (default: the current one) and the timestep.
+    weather files are hashed by name only
+    '''
+    config = V.get_config() if config is None else config
+    text = json.dumps({"config": config, "dt": V.dt}, sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+def save(path, step, state, flow=None):
+    '''writes the state before step index step, with the flow codes of the step
+    before it, to path. the file is replaced atomically
+    '''
+    g, g_h, g_c, h, throughflow = state
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, g=np.array(g, dtype=float), g_h=g_h, g_c=g_c, h=h, throughflow=throughflow,
+                 flow=np.array(flow if flow is not None else [], dtype=np.int8),
+                 step=step, dt=V.dt, hash=config_hash(),
+                 config=json.dumps(V.get_config()))
+    os.replace(tmp, path)
+    return path
+
+def load(path):
+    '''reads a checkpoint: dict of step, t (s), state, flow, hash and config'''
+    with np.load(path) as f:
+        state = ([float(x) for x in f["g"]], float(f["g_h"]), float(f["g_c"]), float(f["h"]),
+                 float(f["throughflow"]))
+        flow = [int(x) for x in f["flow"]] or None
+        step = int(f["step"])
+        return {"step": step, "t": step*float(f["dt"]), "state": state, "flow": flow,
+                "hash": str(f["hash"]), "config": json.loads(str(f["config"]))}
+
+def checkpoints(directory):
+    '''(step, path) of every checkpoint in directory, oldest first'''
+    if not os.path.isdir(directory):
+        return []
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith("step_") and name.endswith(".npz"):
+            found.append((int(name[5:-4]), os.path.join(directory, name)))
+    return sorted(found)
+
+def latest(directory, at=None):
+    '''path of the last checkpoint in directory, or the last at or before at hrs, None if none'''
+    found = checkpoints(directory)
+    if at is not None:
+        found = [(i, path) for i, path in found if i*V.dt <= at*3600 + 1e-9]
+    return found[-1][1] if found else None
+
+def run(directory, every=3600, resume=True, keep=None, res=None):
+    '''runs the fixed step model to steps, checkpointing every every seconds of
+    simulated time into directory, and at the end of the run or on a failure.
+    with resume, continues from the last checkpoint in directory, which has to
+    be from the same config. keep is the number of checkpoints to keep, None
+    for all (warm_start needs the old ones).
+    returns the result store, with the records from where this call started
+    '''
+    os.makedirs(directory, exist_ok=True)
+    start, state, flow = 0, None, None
+    path = latest(directory) if resume else None
+    if path is not None:
+        cp = load(path)
+        if cp["hash"] != config_hash():
+            raise ValueError(f"{path} is from a different config, use warm_start to continue from it")
+        start, state, flow = cp["step"], cp["state"], cp["flow"]
+    return _run_legs(directory, start, state, flow, every, keep, res)
+
+def warm_start(directory, at=None, res=None, every=None, keep=None):
+    '''runs the current config to steps from the last checkpoint in directory at
+    or before at hrs (default: the last one), whatever config it came from.
+    with every, checkpoints of the new run go into directory + "_warm"
+    returns the result store, starting from the checkpoint
+    '''
+    path = latest(directory, at)
+    if path is None:
+        raise FileNotFoundError(f"no checkpoint in {directory}" + (f" at or before {at} hrs" if at is not None else ""))
+    cp = load(path)
+    if every is None:
+        return V.run(res, cp["state"], cp["step"])
+    return _run_legs(directory + "_warm", cp["step"], cp["state"], cp["flow"], every, keep, res)
+
+def _run_legs(directory, start, state, flow, every, keep, res):
+    os.makedirs(directory, exist_ok=True)
+    leg = max(1, round(every/V.dt))
+    if res is None:
+        res = V.new_results(max(1, (V.steps - start - 1)//max(1, round(V.record_interval/V.dt)) + 1))
+    i = start
+    while i < V.steps:
+        stop = min(i + leg, V.steps)
+        steps_before = res.steps
+        V.run(res, state, i, stop)
+        i += res.steps - steps_before
+        state = res.state
+        flow = res.flow if res.flow is not None else flow
+        save(os.path.join(directory, name_format.format(i)), i, state, flow)
+        if keep is not None:
+            for _, old in checkpoints(directory)[:-keep]:
+                os.remove(old)
+        if res.error is not None:
+            break
+    res.state = state
+    res.flow = flow
+    return res
+
+def main():
+    '''three days, then the same with half the occupants on day 3 warm-started from day 2'''
+    V.steps = 3*24*3600
+    t0 = time.perf_counter()
+    base = run("checkpoints", resume=False)
+    t_base = time.perf_counter() - t0
+    V.configure(n=[x/2 for x in V.n])
+    t0 = time.perf_counter()
+    what_if = warm_start("checkpoints", at=48)
+    t_warm = time.perf_counter() - t0
+    day_3 = base["t"] >= 48
+    print(f"base: {t_base:.1f} s, peak day 3 room temp {base['T'][day_3].max():.2f} deg C")
+    print(f"half occupancy from day 3: {t_warm:.1f} s, peak {what_if['T'].max():.2f} deg C")
+
+if __name__ == "__main__":
+    main()
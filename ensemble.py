@@ -0,0 +1,266 @@
+'''Vectorised ensemble engine: runs N building configurations together.
+
+Same physics as Ventilation.step(), but every quantity is an array over the
+ensemble, shape (N,) for the atrium or (N, rooms) for the rooms, and the flow
+regime branches are masks. Configurations are dicts of user defined variables,
+anything missing is taken from Ventilation.py (see Ventilation.get_config).
+
+    import ensemble
+    res = ensemble.run([{"vents_a": [a, 3]} for a in (2, 3, 4)])
+    res["T"][-1]        #room temps at the last record, shape (N, rooms)
+'''
+#imports
+import numpy as np
+import forcing
+import plume
+import Ventilation as V
+
+#failure codes, same checks (and messages) as the scalar model
+errors = [None,
+          "Second law violation: cold layer is cooling on its own!",
+          "hot layer flowing out through lower vent, assumptions no longer hold!",
+          "somehow, your hot layer has negative size",
+          "negative B_out"]
+
+
+def get_params(configs, hours=None):
+    '''stacks a list of configuration dicts into arrays.
+    weather files are read once per file, hours is how much of them to read
+    '''
+    configs = [V.get_config(**c) for c in configs]
+    rooms = len(configs[0]["H"])
+    for c in configs:
+        if len(c["H"]) != rooms:
+            raise ValueError("all configurations need the same number of rooms")
+    def col(key):
+        return np.array([c[key] for c in configs], dtype=float)
+    vents = col("vents")                #(N, rooms, 2)
+    vents_a = col("vents_a")
+    p = {key: col(key) for key in ["H", "H_a", "h_v", "S", "S_a", "n", "T_day", "T_night",
+                                    "peak_solar", "sunrise", "sunset"]}
+    p["leave"] = np.array([c["people_leave_work"] for c in configs], dtype=bool)
+    p["precooled"] = np.array([c["inlet_temp"] is not None for c in configs])
+    p["inlet_temp"] = np.array([np.nan if c["inlet_temp"] is None else c["inlet_temp"] for c in configs])
+    p["B"] = V.w_to_B(col("w"))
+    p["A_eff"] = np.sqrt(2)*vents[...,0]*vents[...,1]/np.sqrt(vents[...,0]**2+vents[...,1]**2)
+    p["A_eff_a"] = np.sqrt(2)*vents_a[:,0]*vents_a[:,1]/np.sqrt(vents_a[:,0]**2+vents_a[:,1]**2)
+    p["vent_out"] = vents[...,1]
+    p["B_sun"] = V.w_to_B(p["peak_solar"])
+    #(members, weather) for each weather file in the ensemble
+    groups = {}
+    for k, c in enumerate(configs):
+        if c["weather_file"] is not None:
+            groups.setdefault((c["weather_file"], c["weather_start"]), []).append(k)
+    p["weather"] = [(np.array(members), forcing.read_weather(path, start, hours))
+                    for (path, start), members in groups.items()]
+    #(N, rooms) arrays are kept column major, so sums over rooms and broadcasts
+    #against (N, 1) columns run over contiguous memory
+    for key, val in p.items():
+        if isinstance(val, np.ndarray) and val.ndim == 2:
+            p[key] = np.asfortranarray(val)
+    return p
+
+def initial_state(p):
+    '''state at t=0 for every member: (g, g_h, g_c, h, throughflow)'''
+    N, rooms = p["H"].shape
+    return np.zeros((N, rooms), order="F"), np.zeros(N), np.zeros(N), 0.99*p["H_a"], np.zeros(N)
+
+def step(p, t, dt, state):
+    '''advances every member by one explicit step from time t.
+    returns (new_state, Q, dp, flow, error), with error a failure code per member
+    '''
+    g, g_h, g_c, h, throughflow = state
+    H_a, S_a, H, h_v = p["H_a"], p["S_a"], p["H"], p["h_v"]
+    alpha, rho = V.alpha, V.rho
+    hc = h[:,None]
+    g_cc = g_c[:,None]
+
+    T_night = p["T_night"]
+    T_ext = ((T_night-p["T_day"])/2)*np.cos(2*np.pi*t/(3600*24))+(p["T_day"]+T_night)/2
+    for members, weather in p["weather"]:
+        T_ext[members] = weather.temp(t)
+    g_ext = V.g_real*(T_ext-T_night)/(273+T_night)
+    g_extc = g_ext[:,None]
+    g_in = np.where(p["precooled"], V.g_real*(p["inlet_temp"]-T_night)/(273+T_night), g_ext)
+
+    #rooms
+    net = g_c*h + g_h*(H_a-h) - g_ext*H_a
+    above = h_v > hc
+    dp = g_cc*np.minimum(h_v, hc) + g_h[:,None]*np.maximum(h_v-hc, 0) - g_extc*h_v - net[:,None]/2
+    drive = (g-g_extc)*H-dp/rho
+    Q = p["A_eff"]*np.sqrt(np.abs(drive))
+    B_out = Q*g
+    fwd = drive > 0
+    plumes = fwd & ~above
+    hot = plumes & (g > g_cc)
+    cold = plumes & ~hot
+    into_h = fwd & above
+    from_h = ~fwd & above
+    from_c = ~fwd & ~above
+    flow = np.where(fwd, np.where(above, 0, np.where(hot, 1, 2)), np.where(above, 3, 4))
+    B_in = Q*np.where(fwd, g_extc, np.where(above, g_h[:,None], g_cc))
+
+    #hot plume entrainment, only worked out for the hot plumes
+    E = np.zeros_like(Q)
+    B_E = np.zeros_like(Q)
+    if hot.any():
+        Q_p, B_p = Q[hot], B_out[hot]
+        with np.errstate(all="ignore"):
+            z = plume.virtual_origin_array(Q_p/p["vent_out"][hot], Q_p, B_p, alpha)
+            E[hot], B_E[hot] = plume.entrainment(B_p, z, (hc-h_v)[hot], alpha,
+                                                 np.broadcast_to(g_cc, Q.shape)[hot])
+    error = 4*(hot & ~(B_out > 0)).any(axis=1)
+
+    Q_in_c = (Q - 2*Q*fwd).sum(axis=1)
+    Q_in_h = (Q*into_h + (E+Q)*hot).sum(axis=1)
+    B_in_h = (B_out*into_h + (B_in+B_E)*hot).sum(axis=1)
+    Q_out_c = (E + Q*from_c).sum(axis=1)
+    B_out_c = (g_cc*E + B_in*from_c).sum(axis=1)
+    B_in_c = (B_out*cold).sum(axis=1)
+    B_out_h = (B_in*from_h).sum(axis=1)
+    Q_out_h = (Q*from_h).sum(axis=1)
+    mixing = ~hot.any(axis=1)
+
+    tod = t%(24*3600)
+    present = ~(p["leave"] & ((tod < 9*3600) | (tod > 17*3600)))
+    hr = tod/3600
+    sun = np.where((hr < p["sunrise"]) | (hr > p["sunset"]), 0,
+                   np.sin(np.pi*(hr-p["sunrise"])/(p["sunset"]-p["sunrise"])))
+    for members, weather in p["weather"]:
+        if weather.solar is not None:
+            sun[members] = weather.sun(t)
+    B_in = B_in + (present*p["B"])[:,None]*p["n"] + sun[:,None]*p["B_sun"]
+    g = g + dt*(B_in-B_out)/(H*p["S"])
+
+    #chimney
+    half_mixing = (Q_in_h < throughflow) & ~mixing & (h/H_a >= 0.99)
+    force_mixing = mixing & (g_c >= g_h)
+    h = np.where(force_mixing, 0.99*H_a, h)
+    disp = ((h/H_a < 0.99) | ~mixing) & ~force_mixing
+
+    #displacement case
+    old_h = h
+    P = g_h*(H_a-h)+g_c*h-g_ext*H_a
+    tf = np.copysign(p["A_eff_a"]*np.sqrt(np.abs(P)), P)
+    up = tf > 0
+    case1 = ~half_mixing & up
+    case3 = half_mixing & up
+    back = ~up                          #cases 2 and 4
+    d_Q_out_h = np.where(case1, Q_out_h + tf, np.where(case3, 0, Q_out_h))
+    d_B_out_h = np.where(case1, B_out_h + d_Q_out_h*g_h, np.where(case3, 0, B_out_h))
+    d_Q_in_h = np.where(case3, 0, Q_in_h)
+    d_B_in_h = np.where(case3, 0, B_in_h)
+    d_Q_in_c = Q_in_c + np.where(case3, tf - Q_in_h, np.abs(tf))
+    d_Q_out_c = Q_out_c + np.where(case3, tf - Q_in_h, np.where(back, np.abs(tf), 0))
+    d_h = h - dt*(d_Q_in_h - d_Q_out_h)/S_a
+    with np.errstate(all="ignore"):
+        d_g_h = (g_h*(H_a - old_h)*S_a + dt*(d_B_in_h - d_B_out_h))/((H_a - d_h)*S_a)
+        d_g_c = np.where(d_Q_in_c > 0,
+                         (g_c*old_h*S_a + dt*(g_in*d_Q_in_c + B_in_c - B_out_c))/(d_h*S_a),
+                         (g_c*old_h*S_a + dt*(B_in_c - B_out_c - np.abs(d_Q_in_c)*g_c))/(d_h*S_a))
+    d_g_h = np.where(half_mixing, d_g_c, d_g_h)
+    d_flow = np.where(half_mixing, np.where(up, 3, 4), np.where(up, 1, 2))
+
+    #error handling
+    second_law = ~p["precooled"] & (g_c-d_g_c > 1e-13) & (g_ext > g_c) & ~cold.any(axis=1)
+    d_error = np.where(second_law, 1, np.where(d_h < 0, 2, np.where(d_h > H_a, 3, 0)))
+    error = np.where(disp & (error == 0), d_error, error)
+
+    #mixing case
+    m_g_c = (g_c*h + g_c*(H_a-h))/H_a
+    m_tf = np.copysign(p["A_eff_a"]*np.sqrt(np.abs(m_g_c-g_ext)*H_a), m_g_c-g_ext)
+    m_Q_out_c = np.abs(m_tf) - Q_in_h
+    m_B_in_c = B_in_c + m_Q_out_c*g_in + B_in_h
+    m_g_c = m_g_c + dt*(m_B_in_c-m_Q_out_c*m_g_c)/(H_a*S_a)
+
+    g_h = np.where(disp, d_g_h, m_g_c)
+    g_c = np.where(disp, d_g_c, m_g_c)
+    h = np.where(disp, d_h, 0.99*H_a)
+    throughflow = np.where(disp, tf, m_tf)
+    flow = np.concatenate([flow, np.where(disp, d_flow, 0)[:,None]], axis=1)
+    return (g, g_h, g_c, h, throughflow), Q, dp, flow, error
+
+def run(configs, dt=None, steps=None, record_every=60):
+    '''runs every configuration for steps timesteps of dt.
+    records every record_every steps (same rows as Ventilation.run()[...][::record_every])
+    members that hit one of the model's failure checks are frozen at their last
+    good state, see "error" and "fail_time" in the result, and their records
+    after fail_time are nan (flow -1), as a failed run stops recording
+    returns a dict of arrays: t (hrs), T (rooms), T_h, T_c, h, throughflow, Q, flow,
+    and "configs", the full config of every member
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    p = get_params(configs, steps*dt/3600 + 1)
+    N, rooms = p["H"].shape
+    state = initial_state(p)
+    alive = np.ones(N, dtype=bool)
+    error = np.zeros(N, dtype=int)
+    fail_time = np.full(N, np.nan)
+
+    K = (steps-1)//record_every + 1
+    k = (273+p["T_night"])/V.g_real
+    res = {"t": np.zeros(K), "T": np.zeros((K, N, rooms)), "T_h": np.zeros((K, N)),
+           "T_c": np.zeros((K, N)), "h": np.zeros((K, N)), "throughflow": np.zeros((K, N)),
+           "Q": np.zeros((K, N, rooms)), "flow": np.zeros((K, N, rooms+1), dtype=np.int8)}
+    for i in range(steps):
+        t = i*dt
+        new_state, Q, dp, flow, err = step(p, t, dt, state)
+        failed = alive & (err != 0)
+        if failed.any():
+            error[failed] = err[failed]
+            fail_time[failed] = t
+            alive &= ~failed
+        if not alive.all():
+            dead = ~alive
+            for new, old in zip(new_state, state):
+                new[dead] = old[dead]
+        state = new_state
+
+        #gather data
+        if i % record_every == 0:
+            r = i//record_every
+            g, g_h, g_c, h, throughflow = state
+            res["t"][r] = t/3600
+            res["T"][r] = p["T_night"][:,None] + g*k[:,None]
+            res["T_h"][r] = p["T_night"] + g_h*k
+            res["T_c"][r] = p["T_night"] + g_c*k
+            res["h"][r] = h
+            res["throughflow"][r] = throughflow
+            res["Q"][r] = Q
+            res["flow"][r] = flow
+    #blank the frozen members from the failure on
+    after = res["t"][:,None]*3600 > fail_time
+    for name in ("T", "T_h", "T_c", "h", "throughflow", "Q", "flow"):
+        mask = after if res[name].ndim == 2 else after[...,None]
+        res[name] = np.where(mask, -1 if name == "flow" else np.nan, res[name])
+    res["error"] = error
+    res["fail_time"] = fail_time
+    res["configs"] = [V.get_config(**c) for c in configs]
+    return res
+
+def summary(res):
+    '''per member summary metrics from a run() result, over the records up to a
+    member's failure (the nan ones after it are left out)
+    '''
+    after = res["t"][:,None]*3600 > res["fail_time"]
+    T = np.where(after[...,None], np.nan, res["T"])
+    T_h = np.where(after, np.nan, res["T_h"])
+    throughflow = np.where(after, np.nan, res["throughflow"])
+    return {"peak_room_temp": np.nanmax(T, axis=(0, 2)),
+            "mean_room_temp": np.nanmean(T, axis=(0, 2)),
+            "peak_hot_layer_temp": np.nanmax(T_h, axis=0),
+            "mean_throughflow": np.nanmean(throughflow, axis=0),
+            "error": res["error"]}
+
+def main():
+    '''example sweep over the atrium vent areas'''
+    configs = [{"vents_a": [a, b]} for a in (2, 3, 4, 5) for b in (2, 3, 4, 5)]
+    stats = summary(run(configs))
+    print(f"{'vents_a':>10}{'peak room':>12}{'mean room':>12}{'throughflow':>13}")
+    for c, peak, mean, q, err in zip(configs, stats["peak_room_temp"], stats["mean_room_temp"],
+                                     stats["mean_throughflow"], stats["error"]):
+        print(f"{str(c['vents_a']):>10}{peak:>12.2f}{mean:>12.2f}{q:>13.3f}", errors[err] or "")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+'''Forcing tables: external temperature, sun and occupancy.
+
+Everything that drives the model but only depends on time is computed here as
+arrays, a block of steps at a time, instead of inside every timestep. Tables
+are cached, so runs in a sweep that share the forcing reuse them.
+
+External temperatures are either the cosine between T_day and T_night, or an
+hourly weather file interpolated linearly (see read_weather). Weather files are
+plain csv, columns: hours since the start, dry bulb temp in deg C and
+optionally global horizontal irradiance in W/m^2, or EnergyPlus .epw files.
+'''
+#imports
+import csv
+from bisect import bisect_right
+from functools import lru_cache
+from math import pi
+import numpy as np
+
+peak_irradiance = 1000              #W/m^2 of global horizontal irradiance taken as full sun
+block = 24*3600                     #steps per table, bounds memory on long runs
+
+
+class Weather:
+    '''hourly weather, hours counted from the start of the run'''
+    def __init__(self, path, hours, temps, solar=None):
+        self.path = path
+        self.hours = np.array(hours, dtype=float)
+        self.temps = np.array(temps, dtype=float)
+        self.solar = None if solar is None else np.clip(np.array(solar, dtype=float)/peak_irradiance, 0, None)
+        self._hours = self.hours.tolist()
+        if len(self._hours) < 2:
+            raise ValueError(f"{path}: need at least two weather records")
+
+    def _interp(self, t, values):
+        '''linear interpolation for one time, same arithmetic as np.interp'''
+        x = t/3600
+        k = min(max(bisect_right(self._hours, x) - 1, 0), len(self._hours) - 2)
+        if x <= self._hours[0]:
+            return float(values[0])
+        if x >= self._hours[-1]:
+            return float(values[-1])
+        slope = (values[k+1] - values[k])/(self._hours[k+1] - self._hours[k])
+        return float(slope*(x - self._hours[k]) + values[k])
+
+    def temp(self, t):
+        '''external temp at t seconds'''
+        return self._interp(t, self.temps)
+
+    def sun(self, t):
+        '''fraction of peak solar at t seconds, None if the file has no irradiance'''
+        if self.solar is None:
+            return None
+        return self._interp(t, self.solar)
+
+    def temp_table(self, t):
+        return np.interp(t/3600, self.hours, self.temps)
+
+    def sun_table(self, t):
+        return np.interp(t/3600, self.hours, self.solar)
+
+def read_weather(path, start=0, hours=None):
+    '''streams an hourly weather file, keeping only the records from hour start
+    of the file to start+hours (plus one either side for interpolation).
+    epw hours are hour ending, so record k of the file is at hour k+1
+    '''
+    end = float("inf") if hours is None else start + hours
+    times, temps, solar = [], [], []
+    epw = path.lower().endswith(".epw")
+    with open(path, newline="") as f:
+        rows = csv.reader(f)
+        k = 0
+        for row in rows:
+            if epw:
+                if len(row) < 14 or not row[0].strip().lstrip("-").isdigit():
+                    continue            #the 8 header lines
+                time, temp, ghi = k + 1, row[6], row[13]
+                k += 1
+            else:
+                if not row or row[0].strip().startswith("#"):
+                    continue
+                try:
+                    time, temp = float(row[0]), row[1]
+                except ValueError:
+                    continue            #header
+                ghi = row[2] if len(row) > 2 and row[2].strip() else None
+            if time < start - 1:
+                continue
+            times.append(time - start)
+            temps.append(float(temp))
+            solar.append(None if ghi is None else float(ghi))
+            if time > end + 1:
+                break
+    if None in solar:
+        solar = None
+    return Weather(path, times, temps, solar)
+
+def ext_temp(config, t, weather=None):
+    '''external temp (deg C) at an array of times t in seconds, as Ventilation.get_ext_temp()'''
+    t = np.asarray(t, dtype=float)
+    if weather is not None:
+        return weather.temp_table(t)
+    T_day, T_night = config["T_day"], config["T_night"]
+    return ((T_night-T_day)/2)*np.cos(2*pi*t/(3600*24))+(T_day+T_night)/2
+
+def tables(config, dt, i0, i1, weather=None):
+    '''forcing for steps i0 to i1 of a run, as arrays:
+    T_ext (deg C), sun (fraction of peak solar) and people (per room).
+    people is worked out from the cached occupancy on every call, so the cache
+    does not grow with the number of rooms
+    '''
+    T_ext, sun, occupied = profiles(config, dt, i0, i1, weather)
+    return T_ext, sun, occupied[:,None]*np.array(config["n"], dtype=float)
+
+def profiles(config, dt, i0, i1, weather=None):
+    '''T_ext (deg C), sun (fraction of peak solar) and occupied (True while people
+    are in) for steps i0 to i1, each one value a step
+    '''
+    c = config
+    return _tables(c["T_day"], c["T_night"], c["sunrise"], c["sunset"], c["people_leave_work"],
+                   dt, i0, i1, weather)
+
+@lru_cache(maxsize=8)
+def _tables(T_day, T_night, sunrise, sunset, people_leave_work, dt, i0, i1, weather):
+    t = np.arange(i0, i1)*dt
+    if weather is None:
+        T_ext = ((T_night-T_day)/2)*np.cos(2*pi*t/(3600*24))+(T_day+T_night)/2
+    else:
+        T_ext = weather.temp_table(t)
+    if weather is None or weather.solar is None:
+        hr = (t%(3600*24))/3600
+        sun = np.where((hr < sunrise) | (hr > sunset), 0, np.sin(pi*(hr-sunrise)/(sunset-sunrise)))
+    else:
+        sun = weather.sun_table(t)
+    tod = t%(24*3600)
+    occupied = ~(people_leave_work & ((tod < 9*3600) | (tod > 17*3600)))
+    for table in (T_ext, sun, occupied):
+        table.flags.writeable = False   #shared between runs
+    return T_ext, sun, occupied
@@ -0,0 +1,126 @@
+'''Opt-in instrumentation of the main loop: regimes, transitions and timers.
+
+Set Ventilation.instruments to an Instruments and every accepted step of run()
+or run_adaptive() is counted by the flow code of each room and the chimney
+case, regime changes are logged with their time, and the room update, chimney
+update and recording are timed separately. With Ventilation.instruments left
+at None the loop only pays for a few "is None" checks.
+
+    import instrument
+    res, inst = instrument.run()
+    inst.report()
+'''
+#imports
+from collections import Counter
+from time import perf_counter
+import numpy as np
+import Ventilation as V
+
+room_codes = ["into hot layer", "hot plume", "cold plume", "inhale from hot", "inhale from cold"]
+#chimney cases: flow[-1], plus force mixing (mixing entered because g_c >= g_h)
+chimney_cases = ["mixing", "case 1: displacement", "case 2: top vent backing up",
+                 "case 3: half mixing", "case 4: edge case", "force mixing"]
+force_mixing = 5
+event_dtype = np.dtype([("t", np.float64), ("unit", np.int16), ("old", np.int8), ("new", np.int8)])
+
+
+class Instruments:
+    '''counts and timings of one or more runs of a building with rooms rooms.
+    unit j < rooms is room j, unit rooms is the chimney. counts[j][code] is the
+    steps spent with that code, seconds[j][code] the simulated time. events are
+    (t, unit, old code, new code), at most max_events of them are kept
+    '''
+    def __init__(self, rooms, max_events=100000):
+        self.rooms = rooms
+        self.counts = [[0]*len(chimney_cases) for _ in range(rooms+1)]
+        self.seconds = [[0.0]*len(chimney_cases) for _ in range(rooms+1)]
+        self.events = []
+        self.max_events = max_events
+        self.dropped = 0
+        self.timers = {"rooms": 0.0, "chimney": 0.0, "record": 0.0}
+        self.steps = 0
+        self.wall = 0.0
+        self._last = None
+
+    def observe(self, t, dt, state, flow):
+        '''one accepted step of length dt from t, state is the state it started from'''
+        codes = list(flow)
+        if codes[-1] == 0 and state[2] >= state[1]:
+            codes[-1] = force_mixing     #same test as the force_mixing flag in Ventilation.step()
+        for j, code in enumerate(codes):
+            self.counts[j][code] += 1
+            self.seconds[j][code] += dt
+        last = self._last
+        if last is not None and codes != last:
+            for j, (old, new) in enumerate(zip(last, codes)):
+                if old != new:
+                    if len(self.events) < self.max_events:
+                        self.events.append((t, j, old, new))
+                    else:
+                        self.dropped += 1
+        self._last = codes
+        self.steps += 1
+
+    def event_array(self):
+        '''the transition log as a structured array: t (s), unit, old, new'''
+        return np.array(self.events, dtype=event_dtype)
+
+    def transitions(self, top=10):
+        '''most frequent (unit, old, new) transitions with their counts'''
+        return Counter((unit, old, new) for _, unit, old, new in self.events).most_common(top)
+
+    def chatter(self, window=3600, top=5):
+        '''windows of window seconds with the most transitions, as (start time in hrs, count).
+        a regime flipping back and forth every few steps shows up here
+        '''
+        if not self.events:
+            return []
+        bins = Counter(int(t//window) for t, *_ in self.events)
+        return [(k*window/3600, n) for k, n in bins.most_common(top)]
+
+    def unit_name(self, j):
+        return "chimney" if j == self.rooms else f"room {j}"
+
+    def code_name(self, j, code):
+        return chimney_cases[code] if j == self.rooms else room_codes[code]
+
+    def report(self):
+        '''prints the regime counts, timers and the busiest transitions'''
+        print(f"{self.steps} steps")
+        for j in range(self.rooms+1):
+            total = sum(self.counts[j]) or 1
+            spent = ", ".join(f"{self.code_name(j, c)} {n/total:.1%}"
+                              for c, n in enumerate(self.counts[j]) if n)
+            print(f"  {self.unit_name(j)}: {spent}")
+        timed = sum(self.timers.values())
+        print("time: " + ", ".join(f"{name} {secs:.2f} s ({secs/self.steps*1e6:.1f} us/step)"
+                                   for name, secs in self.timers.items()), end="")
+        if self.wall:
+            print(f", rest of the loop {self.wall - timed:.2f} s", end="")
+        print()
+        print(f"{len(self.events)} transitions" + (f" ({self.dropped} not logged)" if self.dropped else ""))
+        for (j, old, new), n in self.transitions(5):
+            print(f"  {n:>6}  {self.unit_name(j)}: {self.code_name(j, old)} -> {self.code_name(j, new)}")
+        for start, n in self.chatter(top=3):
+            print(f"  {n:>6}  in the hour from {start:.0f} hrs")
+
+def run(adaptive=False, max_events=100000):
+    '''runs the model as configured with instruments attached.
+    returns (result store, Instruments)
+    '''
+    inst = Instruments(len(V.H), max_events)
+    V.instruments = inst
+    try:
+        t0 = perf_counter()
+        res = V.run_adaptive() if adaptive else V.run()
+        inst.wall = perf_counter() - t0
+    finally:
+        V.instruments = None
+    return res, inst
+
+def main():
+    res, inst = run()
+    inst.report()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,359 @@
+'''Compiled timestep kernel, used when Numba is installed.
+
+Ventilation.step() is scalar float arithmetic with branches, which CPython runs
+slowly. _step() below is the same step written over float arrays so that Numba
+can compile it, and _run_block() is the fixed step loop around it, so a whole
+block of steps runs without returning to the interpreter. The pressure drop
+and sign helpers and the plume entrainment are the model's own functions,
+compiled. The plume origin is a copy of plume.virtual_origin() with its
+exponents passed in at run time: compiled with
+constant exponents, x**0.5 and x**2 become sqrt(x) and x*x, which can differ
+from CPython's pow() in the last bit, and the model amplifies that.
+
+run() takes the same arguments and gives the same result store as
+Ventilation.run(). Without Numba it is Ventilation.run(), so code can always
+call kernel.run(). Both paths produce identical numbers (see bench.py).
+Numba's cache only notices changes to this file, so a hash of the source of the
+functions compiled from Ventilation.py and plume.py is kept beside it, and the
+cache is emptied when that source changes.
+
+    import kernel
+    res = kernel.run()
+'''
+#imports
+import contextlib
+import hashlib
+import inspect
+import io
+import os
+import numpy as np
+import forcing
+import plume
+import results
+import Ventilation as V
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+#error codes of the kernel, messages as in Ventilation.step()
+errors = [None,
+          "Second law violation: cold layer is cooling on its own!",
+          "hot layer flowing out through lower vent, assumptions no longer hold!",
+          "somehow, your hot layer has negative size at time {t}",
+          "negative B_out: {B_out}"]
+
+#exponents of plume.virtual_origin(), an argument so that the compiler can't specialise them
+z_powers = np.array([2, 5/2, -0.2, 0.5, -1.5, -0.5, 0.75])
+
+
+def _get_z(M, Q, B, alpha, p):
+    '''plume.virtual_origin(), p is z_powers'''
+    gamma = 5*Q**p[0]*B/(4*alpha*M**p[1])
+    if gamma > 88:
+        return 0.853*gamma**p[2]*5*Q/(6*alpha*M**p[3])
+    L = 2.0**p[4]*alpha**p[5]*M**p[6]/B**p[3]
+    return 1.057*L
+
+def _step(t, dt, g, g_h, g_c, h, throughflow, g_ext, sun, people,
+          H, H_a, vent_out, h_v, S, S_a, A_eff, A_eff_a, B, B_sun, inlet, g_inlet,
+          alpha, rho, z_powers, new_g, Q, dp, flow):
+    '''one step of Ventilation.step(): writes new_g, Q, dp and flow, returns
+    (g_h, g_c, h, throughflow, delta, error code, bad B_out)
+    '''
+    rooms = len(H)
+    error = 0
+    mixing = True
+    half_mixing = False
+    force_mixing = False
+    B_in_c = 0.0
+    B_out_c = 0.0
+    B_in_h = 0.0
+    B_out_h = 0.0
+    Q_in_c = 0.0
+    Q_out_c = 0.0
+    Q_in_h = 0.0
+    Q_out_h = 0.0
+    old_h = h
+    old_g_c = g_c
+    g_in = g_inlet if inlet else g_ext
+    for j in range(rooms + 1):
+        flow[j] = 1
+
+    for j in range(rooms):
+        #rooms
+        dp[j] = get_dp(h_v[j], g_c, g_h, g_ext, h, H_a)
+        Q[j] = A_eff[j]*np.sqrt(abs((g[j]-g_ext)*H[j]-dp[j]/rho))
+        B_out = Q[j]*g[j]
+        if (g[j]-g_ext)*H[j]-dp[j]/rho > 0:
+            #correct flow direction
+            B_in = Q[j]*g_ext
+            Q_in_c -= Q[j]
+            if h_v[j] > h:
+                #direct into hot layer
+                flow[j] = 0
+                Q_in_h += Q[j]
+                B_in_h += B_out
+            else:
+                if g[j] > g_c:
+                    #hot plume
+                    flow[j] = 1
+                    if B_out > 0:
+                        z = _get_z(Q[j]/vent_out[j], Q[j], B_out, alpha, z_powers)
+                        E, B_E = entrainment(B_out, z, h-h_v[j], alpha, g_c)
+                        Q_in_h += E+Q[j]
+                        B_in_h += B_in+B_E
+                        Q_out_c += E
+                        B_out_c += g_c*E
+                        mixing = False
+                    else:
+                        return g_h, g_c, h, throughflow, 0.0, 4, B_out
+                else:
+                    #cold plume
+                    flow[j] = 2
+                    B_in_c += B_out
+        else:
+            #reverse flow
+            Q_in_c += Q[j]
+            if h_v[j] > h:
+                #inhaling from hot layer
+                flow[j] = 3
+                B_in = Q[j]*g_h
+                B_out_h += B_in
+                Q_out_h += Q[j]
+            else:
+                #inhaling from cold layer
+                flow[j] = 4
+                B_in = Q[j]*g_c
+                B_out_c += B_in
+                Q_out_c += Q[j]
+
+        if people[j]:
+            B_in += B*people[j]
+        B_in += sun*B_sun[j]
+        new_g[j] = g[j] + dt*(B_in-B_out)/(H[j]*S[j])
+
+    #chimney
+    if Q_in_h < throughflow and (not mixing) and h/H_a >= 0.99:
+        half_mixing = True
+
+    if mixing and g_c >= g_h:
+        force_mixing = True
+        h = 0.99*H_a
+
+    if (h/H_a < 0.99 or (not mixing)) and not force_mixing:
+        #displacement case
+        old_g_c = g_c
+        old_h = h
+        throughflow = sign(g_h*(H_a-h)+g_c*h-g_ext*H_a)*A_eff_a*np.sqrt(abs(g_h*(H_a-h)+g_c*h-g_ext*H_a))
+        if not half_mixing:
+            if throughflow > 0:
+                flow[rooms] = 1
+                Q_out_h += throughflow
+                B_out_h += Q_out_h*g_h
+                Q_in_c += abs(throughflow)
+            else:
+                flow[rooms] = 2
+                Q_in_c += abs(throughflow)
+                Q_out_c += abs(throughflow)
+        else:
+            if throughflow > 0:
+                flow[rooms] = 3
+                Q_out_c += throughflow - Q_in_h
+                Q_in_c += throughflow - Q_in_h
+                Q_in_h = 0.0
+                Q_out_h = 0.0
+                B_in_h = 0.0
+                B_out_h = 0.0
+            else:
+                flow[rooms] = 4
+                Q_in_c += abs(throughflow)
+                Q_out_c += abs(throughflow)
+
+        h -= dt*(Q_in_h - Q_out_h)/S_a
+        g_h = (g_h*(H_a - old_h)*S_a + dt*(B_in_h - B_out_h))/((H_a - h)*S_a)
+        if Q_in_c > 0:
+            g_c = (g_c*old_h*S_a + dt*(g_in*Q_in_c + B_in_c - B_out_c))/(h*S_a)
+        else:
+            g_c = (g_c*old_h*S_a + dt*(B_in_c - B_out_c - abs(Q_in_c)*g_c))/(h*S_a)
+
+        if half_mixing:
+            g_h = g_c
+
+        mixing = False
+
+        has_cold_plume = False
+        for j in range(rooms):
+            if flow[j] == 2:
+                has_cold_plume = True
+        if (not inlet) and old_g_c-g_c > 1e-13 and g_ext > old_g_c and not has_cold_plume:
+            error = 1
+        elif h < 0:
+            error = 2
+        elif h > H_a:
+            error = 3
+
+    if mixing:
+        #mixing case
+        g_h = (g_c*h + g_c*(H_a-h))/H_a
+        g_c = g_h
+        old_g_c = g_c
+        flow[rooms] = 0
+        h = 0.99*H_a
+        throughflow = sign((g_c-g_ext)*H_a)*A_eff_a*np.sqrt(abs(g_c-g_ext)*H_a)
+        Q_out_c = abs(throughflow) - Q_in_h
+        B_out_c = Q_out_c*g_c
+        B_in_c += Q_out_c*g_in + B_in_h
+        g_c += dt*(B_in_c-B_out_c)/(H_a*S_a)
+        g_h = g_c
+
+    return g_h, g_c, h, throughflow, g_c - old_g_c, error, 0.0
+
+def _run_block(i0, i1, dt, every, g, chimney, g_ext, sun, people,
+               H, H_a, vent_out, h_v, S, S_a, A_eff, A_eff_a, B, B_sun, inlet, g_inlet,
+               alpha, rho, z_powers, g_real, T_night,
+               r_t, r_T, r_T_h, r_T_c, r_h, r_dp, r_Q, r_flow, r_delta, r_throughflow, last_flow, quiet):
+    '''steps i0 to i1 from state (g, chimney = [g_h, g_c, h, throughflow]), both
+    updated in place. g_ext, sun and people are the forcing from step i0.
+    records every every steps into the r_ arrays. quiet leaves out the "edge case" prints
+    returns (steps taken, records written, error code, fail values (h, g_h, g_c, bad B_out))
+    '''
+    rooms = len(H)
+    new_g = np.empty(rooms)
+    Q = np.empty(rooms)
+    dp = np.empty(rooms)
+    flow = np.empty(rooms + 1, dtype=np.int8)
+    g_h, g_c, h, throughflow = chimney[0], chimney[1], chimney[2], chimney[3]
+    k = 0
+    for i in range(i0, i1):
+        t = i*dt
+        n = i - i0
+        new_g_h, new_g_c, new_h, new_throughflow, delta, error, bad = _step(
+            t, dt, g, g_h, g_c, h, throughflow, g_ext[n], sun[n], people[n],
+            H, H_a, vent_out, h_v, S, S_a, A_eff, A_eff_a, B, B_sun, inlet, g_inlet,
+            alpha, rho, z_powers, new_g, Q, dp, flow)
+        if flow[rooms] == 4 and not quiet:
+            print("edge case")
+        if error:
+            chimney[0], chimney[1], chimney[2], chimney[3] = g_h, g_c, h, throughflow
+            return n, k, error, (new_h, new_g_h, new_g_c, bad)
+        g[:] = new_g
+        g_h, g_c, h, throughflow = new_g_h, new_g_c, new_h, new_throughflow
+        last_flow[:] = flow
+
+        #gather data
+        if i % every == 0:
+            r_t[k] = t/3600
+            for j in range(rooms):
+                r_T[k, j] = T_night+(g[j]/g_real)*(273+T_night)
+                r_dp[k, j] = dp[j]
+                r_Q[k, j] = Q[j]
+            r_flow[k] = flow
+            r_T_h[k] = T_night+(g_h/g_real)*(273+T_night)
+            r_T_c[k] = T_night+(g_c/g_real)*(273+T_night)
+            r_h[k] = h
+            r_delta[k] = delta
+            r_throughflow[k] = throughflow
+            k += 1
+    chimney[0], chimney[1], chimney[2], chimney[3] = g_h, g_c, h, throughflow
+    return i1 - i0, k, 0, (h, g_h, g_c, 0.0)
+
+def _check_cache(dispatchers, imported):
+    '''empties Numba's cache of dispatchers if the source of the imported functions
+    has changed since it was written
+    '''
+    digest = hashlib.sha256("".join(inspect.getsource(f) for f in imported).encode()).hexdigest()
+    path = os.path.join(dispatchers[0]._cache._cache_path, "kernel.imported")
+    try:
+        with open(path) as f:
+            if f.read() == digest:
+                return
+    except OSError:
+        pass
+    for d in dispatchers:
+        d._cache.flush()
+    try:
+        with open(path, "w") as f:
+            f.write(digest)
+    except OSError:
+        pass
+
+entrainment = plume.entrainment
+get_dp = V.get_dp
+sign = V.sign
+if njit is not None:
+    _get_z = njit(cache=True)(_get_z)
+    entrainment = njit(cache=True)(entrainment)
+    get_dp = njit(cache=True)(get_dp)
+    sign = njit(cache=True)(sign)
+    _step = njit(cache=True)(_step)
+    _run_block = njit(cache=True)(_run_block)
+    _check_cache([_get_z, entrainment, get_dp, sign, _step, _run_block],
+                 [plume.entrainment, V.get_dp, V.sign])
+
+def run(res=None, state=None, start=0, stop=None, quiet=False):
+    '''Ventilation.run(), compiled when Numba is installed. quiet leaves out the
+    "edge case" line printed for every step in chimney case 4 (without Numba, every print)
+    '''
+    if njit is None:
+        if quiet:
+            with contextlib.redirect_stdout(io.StringIO()):
+                return V.run(res, state, start, stop)
+        return V.run(res, state, start, stop)
+    stop = V.steps if stop is None else stop
+    every = max(1, round(V.record_interval/V.dt))
+    if res is None:
+        res = V.new_results((stop-start-1)//every + 1)
+    if state is None:
+        state = V.initial_state()
+    rooms = len(V.H)
+    g = np.array(state[0], dtype=float)
+    chimney = np.array(state[1:], dtype=float)
+    last_flow = np.ones(rooms + 1, dtype=np.int8)
+    params = (np.array(V.H, dtype=float), float(V.H_a), np.array([v[1] for v in V.vents], dtype=float),
+              np.array(V.h_v, dtype=float), np.array(V.S, dtype=float), float(V.S_a),
+              np.array(V.A_eff, dtype=float), float(V.A_eff_a), float(V.B), np.array(V.B_sun, dtype=float),
+              V.inlet_temp is not None, float(V.g_from_temp(V.inlet_temp)) if V.inlet_temp is not None else 0.0,
+              float(V.alpha), float(V.rho), z_powers, float(V.g_real), float(V.T_night))
+    config = V.get_config()
+    weather = V.get_weather()
+    stepped = False
+
+    for k0 in range(start, stop, forcing.block):
+        k1 = min(k0 + forcing.block, stop)
+        T_ext, sun, people = forcing.tables(config, V.dt, k0, k1, weather)
+        n = len(range(-(-k0//every)*every, k1, every))     #records in the block
+        rec = {"t": np.empty(n), "T": np.empty((n, rooms)), "T_h": np.empty(n), "T_c": np.empty(n),
+               "h": np.empty(n), "dp": np.empty((n, rooms)), "Q": np.empty((n, rooms)),
+               "flow": np.empty((n, rooms + 1), dtype=np.int8), "delta": np.empty(n),
+               "throughflow": np.empty(n)}
+        taken, k, error, fail = _run_block(k0, k1, float(V.dt), every, g, chimney,
+                                           V.g_from_temp(T_ext), np.ascontiguousarray(sun, dtype=float),
+                                           np.ascontiguousarray(people, dtype=float), *params,
+                                           *[rec[name] for name in results.record_order], last_flow, quiet)
+        res.steps += taken
+        stepped = stepped or taken > 0
+        res.extend(*[rec[name][:k] for name in results.record_order])
+        if error:
+            h, g_h, g_c, bad = fail
+            if error == 4:
+                V.dump(h, g_h, g_c)
+                raise ValueError(errors[4].format(B_out=bad))
+            res.error = errors[error].format(t=(k0 + taken)*V.dt)
+            print(res.error)
+            V.dump(h, g_h, g_c)
+            break
+    res.state = (g.tolist(),) + tuple(chimney.tolist())
+    res.flow = last_flow.tolist() if stepped else None
+    return res
+
+def main():
+    import time
+    run(stop=10)                #compile
+    t0 = time.perf_counter()
+    res = run()
+    print(f"{res.steps} steps in {time.perf_counter() - t0:.3f} s"
+          + ("" if njit is not None else " (Numba not installed, interpreted)"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+'''Comfort and ventilation KPIs of a run, or of a batch of runs at once.
+
+Everything is a NumPy reduction over the time axis of the recorded channels,
+which are read a block of records at a time, so a run on disk
+(stream.StoredResults) is never loaded whole. Records are weighted by the time
+since the record before them, so adaptive runs and failed batch members (nan
+from the failure on) are handled too.
+
+A result is anything indexed by channel name with time along the first axis:
+a results.Results or stream.StoredResults (shapes (records, rooms)), a dict from
+ensemble.run() (shapes (records, members, rooms)), or parallel.run_scenarios()
+output through batch_view(). KPIs come back with the trailing shape, e.g.
+"peak_T" is (rooms,) for one run and (members, rooms) for a batch.
+
+    import kpi
+    k = kpi.compute(res)                    #config defaults to the one in Ventilation
+    k["hours_above_25"]                     #per room
+    kpi.report(k)
+
+Adaptive comfort follows EN 16798-1: the running mean outdoor temp is
+T_rm = (1 - comfort_alpha)*T_yesterday + comfort_alpha*T_rm(yesterday), from
+daily means of the external temp, the comfort temp is 0.33*T_rm + 18.8 and a
+room exceeds the category limit when it is more than comfort_band above it.
+'''
+#imports
+import numpy as np
+import forcing
+import Ventilation as V
+
+thresholds = (25, 28)               #deg C, for hours_above_*
+comfort_alpha = 0.8
+comfort_band = 3                    #deg C above the comfort temp, category II
+block = 2**16                       #records read at a time
+flow_codes = 5
+
+
+def batch_view(res):
+    '''parallel.run_scenarios() output as channels with time first, without copying'''
+    data = res["data"]
+    rooms = len(res["channels"]) - 4
+    view = {"t": res["t"], "T": data[:, :rooms].transpose(2, 0, 1)}
+    for c, name in enumerate(["T_h", "T_c", "h", "throughflow"]):
+        view[name] = data[:, rooms + c].T
+    view["configs"] = res["configs"]
+    return view
+
+def get_configs(res, config=None):
+    '''the full config (dict) or configs (list, one per member) a result was run with.
+    config may give only overrides, as in ensemble.run()
+    '''
+    if config is None:
+        if isinstance(res, dict) and "configs" in res:
+            config = res["configs"]
+        else:
+            config = getattr(res, "header", {}).get("meta", {}).get("config", {})
+    if isinstance(config, list):
+        return [V.get_config(**c) for c in config]
+    return V.get_config(**config)
+
+def _geometry(configs, key):
+    '''a user defined variable as an array, with a leading axis over members for a batch'''
+    if isinstance(configs, list):
+        return np.array([c[key] for c in configs], dtype=float)
+    return np.array(configs[key], dtype=float)
+
+class _Comfort:
+    '''comfort temps of one config or a batch, a day at a time'''
+    def __init__(self, configs):
+        self.configs = configs if isinstance(configs, list) else [configs]
+        self.weather = [None if c["weather_file"] is None
+                        else forcing.read_weather(c["weather_file"], c["weather_start"])
+                        for c in self.configs]
+        self.running = []               #running mean outdoor temp per day, (members,)
+
+    def ext(self, hrs):
+        '''external temps at hrs, shape (len(hrs), members)'''
+        return np.stack([forcing.ext_temp(c, hrs*3600, w) for c, w in zip(self.configs, self.weather)],
+                        axis=-1)
+
+    def limit(self, hrs):
+        '''upper comfort limit at hrs, shape (len(hrs), members)'''
+        days = (np.asarray(hrs)//24).astype(int)
+        last = days.max(initial=-1)
+        while len(self.running) <= last:
+            d = len(self.running)
+            if d == 0:
+                #no history before the run: start from the first day's mean
+                self.running.append(self.ext(np.arange(24) + 0.5).mean(axis=0))
+            else:
+                yesterday = self.ext(24*(d-1) + np.arange(24) + 0.5).mean(axis=0)
+                self.running.append((1 - comfort_alpha)*yesterday + comfort_alpha*self.running[-1])
+        return 0.33*np.array(self.running)[days] + 18.8 + comfort_band
+
+class _Reducer:
+    '''running sums, extremes and counts, fed a block of records at a time'''
+    def __init__(self, configs, batch, comfort):
+        self.configs = configs
+        self.batch = batch
+        self.comfort = _Comfort(configs) if comfort else None
+        self.last_t = None
+        self.out = {}
+
+    def weights(self, t):
+        '''hours each record stands for: the time since the record before it'''
+        t = np.asarray(t, dtype=float)
+        if self.last_t is None:
+            first = t[1] - t[0] if len(t) > 1 else 0.0
+            w = np.diff(t, prepend=t[0] - first)
+        else:
+            w = np.diff(t, prepend=self.last_t)
+        self.last_t = t[-1]
+        return w
+
+    def add(self, key, value, how):
+        if key not in self.out:
+            self.out[key] = value
+        elif how == "sum":
+            self.out[key] = self.out[key] + value
+        elif how == "max":
+            self.out[key] = np.fmax(self.out[key], value)
+        else:
+            self.out[key] = np.fmin(self.out[key], value)
+
+    def feed(self, chunk):
+        t = chunk["t"]
+        w = self.weights(t)
+        shape = lambda x: w.reshape((-1,) + (1,)*(np.ndim(x) - 1))  #weights against a channel
+        self.add("hours", w.sum(), "sum")
+
+        if "T" in chunk:
+            T = np.asarray(chunk["T"], dtype=float)
+            valid = np.isfinite(T)
+            W = shape(T)*valid
+            self.add("room_hours", W.sum(axis=0), "sum")
+            self.add("peak_T", np.where(valid, T, -np.inf).max(axis=0), "max")
+            self.add("_sum_T", (np.where(valid, T, 0)*W).sum(axis=0), "sum")
+            for thr in thresholds:
+                self.add(f"hours_above_{thr:g}", (W*(T > thr)).sum(axis=0), "sum")
+            if self.comfort is not None:
+                limit = self.comfort.limit(t)       #(records, members)
+                limit = limit[...,None] if self.batch else limit[:,0,None]
+                excess = np.where(valid, T - limit, -np.inf)
+                self.add("comfort_hours", (W*(excess > 0)).sum(axis=0), "sum")
+                self.add("comfort_degree_hours", (W*np.clip(excess, 0, None)).sum(axis=0), "sum")
+                self.add("comfort_max_excess", excess.max(axis=0), "max")
+
+        if "Q" in chunk:
+            volume = _geometry(self.configs, "H")*_geometry(self.configs, "S")
+            ach = np.asarray(chunk["Q"], dtype=float)*3600/volume
+            valid = np.isfinite(ach)
+            W = shape(ach)*valid
+            self.add("_sum_ach", (np.where(valid, ach, 0)*W).sum(axis=0), "sum")
+            self.add("_ach_hours", W.sum(axis=0), "sum")
+            self.add("min_ach", np.where(valid, ach, np.inf).min(axis=0), "min")
+
+        if "throughflow" in chunk:
+            volume = _geometry(self.configs, "H_a")*_geometry(self.configs, "S_a")
+            ach = np.abs(np.asarray(chunk["throughflow"], dtype=float))*3600/volume
+            valid = np.isfinite(ach)
+            W = shape(ach)*valid
+            self.add("_sum_chimney_ach", (np.where(valid, ach, 0)*W).sum(axis=0), "sum")
+            self.add("_chimney_hours", W.sum(axis=0), "sum")
+
+        if "T_h" in chunk and "T_c" in chunk:
+            strat = np.asarray(chunk["T_h"], dtype=float) - np.asarray(chunk["T_c"], dtype=float)
+            valid = np.isfinite(strat)
+            W = shape(strat)*valid
+            self.add("_sum_strat", (np.where(valid, strat, 0)*W).sum(axis=0), "sum")
+            self.add("_strat_hours", W.sum(axis=0), "sum")
+            self.add("max_stratification", np.where(valid, strat, -np.inf).max(axis=0), "max")
+
+        if "flow" in chunk:
+            codes = np.asarray(chunk["flow"])
+            self.add("regime_hours", np.stack([np.tensordot(w, codes == c, axes=1)
+                                               for c in range(flow_codes)], axis=-1), "sum")
+
+    def result(self):
+        out = dict(self.out)
+        with np.errstate(all="ignore"):
+            if "_sum_T" in out:
+                out["mean_T"] = out.pop("_sum_T")/out["room_hours"]
+            if "_sum_ach" in out:
+                out["mean_ach"] = out.pop("_sum_ach")/out.pop("_ach_hours")
+            if "_sum_chimney_ach" in out:
+                out["mean_chimney_ach"] = out.pop("_sum_chimney_ach")/out.pop("_chimney_hours")
+            if "_sum_strat" in out:
+                out["mean_stratification"] = out.pop("_sum_strat")/out.pop("_strat_hours")
+        for key in ("peak_T", "comfort_max_excess", "max_stratification", "min_ach"):
+            if key in out:
+                out[key] = np.where(np.isinf(out[key]), np.nan, out[key])
+        return out
+
+def compute(res, config=None, comfort=True):
+    '''KPIs of a result (see the module docstring), reading block records at a time.
+    config is the config of the run, or a list of configs for a batch (default:
+    from the result if it has one, else Ventilation's for a single run; a batch
+    without configs is an error). returns a dict:
+      hours                 hours covered by the records
+      room_hours            hours each room has a value for (less after a failure)
+      peak_T, mean_T        room temps, deg C
+      hours_above_<thr>     hours each room is above thr deg C, for thr in thresholds
+      comfort_hours         hours above the adaptive comfort limit
+      comfort_degree_hours  deg C hours above it
+      comfort_max_excess    largest excess over it (negative if never above), deg C
+      mean_ach, min_ach     room air changes per hour (needs Q)
+      mean_chimney_ach      atrium air changes per hour (needs throughflow)
+      mean_stratification, max_stratification     hot layer less cold layer temp
+      regime_hours          hours in each flow code, per room and the chimney (needs flow),
+                            shape (..., rooms+1, 5)
+    '''
+    n = len(res["t"])
+    members = np.shape(res["T_h"] if "T_h" in res else res["T"][...,0])[1:]
+    if members and config is None and not (isinstance(res, dict) and "configs" in res):
+        raise ValueError("a batch result needs its configs, in res[\"configs\"] or as config")
+    configs = get_configs(res, config)
+    if members and not isinstance(configs, list):
+        configs = [configs]*members[0]
+    batch = isinstance(configs, list)
+    reducer = _Reducer(configs, batch, comfort and ("T" in res))
+    names = [name for name in ("t", "T", "T_h", "T_c", "Q", "throughflow", "flow") if name in res]
+    for k0 in range(0, n, block):
+        reducer.feed({name: res[name][k0:k0+block] for name in names})
+    return reducer.result()
+
+def report(k, rooms=None):
+    '''prints the KPIs of one run'''
+    rooms = range(len(k["peak_T"])) if rooms is None else rooms
+    print(f"{k['hours']:.1f} hrs")
+    for j in rooms:
+        line = f"  room {j}: peak {k['peak_T'][j]:.2f}, mean {k['mean_T'][j]:.2f} deg C"
+        line += "".join(f", {k[f'hours_above_{thr:g}'][j]:.1f} hrs above {thr:g}" for thr in thresholds)
+        if "comfort_hours" in k:
+            line += f", {k['comfort_hours'][j]:.1f} hrs above adaptive limit"
+        if "mean_ach" in k:
+            line += f", {k['mean_ach'][j]:.2f} ach"
+        print(line)
+    if "mean_chimney_ach" in k:
+        print(f"  atrium: {k['mean_chimney_ach']:.2f} ach")
+    if "mean_stratification" in k:
+        print(f"  stratification: mean {k['mean_stratification']:.2f}, max {k['max_stratification']:.2f} deg C")
+    if "regime_hours" in k:
+        import instrument
+        units = len(k["regime_hours"])
+        for j, hours in enumerate(k["regime_hours"]):
+            chimney = j == units - 1
+            unit = "chimney" if chimney else f"room {j}"
+            names = instrument.chimney_cases if chimney else instrument.room_codes
+            spent = ", ".join(f"{names[c]} {h:.1f}" for c, h in enumerate(hours) if h)
+            print(f"  {unit} regimes (hrs): {spent}")
+
+def main():
+    '''KPIs of the configured run, then of a batch over the atrium vent areas'''
+    import parallel
+    V.record_interval = 60
+    report(compute(V.run()))
+    configs = [{"vents_a": [a, a]} for a in (2, 3, 4, 6, 8)]
+    k = compute(batch_view(parallel.run_scenarios(configs)))
+    print(f"{'vents_a':>10}{'peak':>8}{'hrs>25':>8}{'comfort':>9}{'atrium ach':>12}")
+    for c, peak, hot, comf, atrium in zip(configs, k["peak_T"].max(axis=1), k["hours_above_25"].max(axis=1),
+                                         k["comfort_hours"].max(axis=1), k["mean_chimney_ach"]):
+        print(f"{str(c['vents_a']):>10}{peak:>8.2f}{hot:>8.1f}{comf:>9.1f}{atrium:>12.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+'''Monte Carlo uncertainty runs with streaming statistics.
+
+Scenarios are drawn from distributions of user defined variables, keyed as in
+optimise.py ("n[0]", "vents_a[1]", "w", ...), each given as the name and
+arguments of a numpy random Generator method, e.g. ("uniform", 20, 40) or
+("normal", 100, 10), or as a function of (rng, size). Members are run a batch
+at a time and folded into the statistics, which are kept per channel and
+record: mean and variance by Welford's update (merged a batch at a time),
+quantiles by P-square sketches (Jain and Chlamtac 1985). Memory grows with the
+number of records, not with the number of members.
+
+With sobol=True the members are laid out for Saltelli's scheme and first order
+and total Sobol indices of each scalar output are worked out as well. That
+needs members*(parameters + 2) runs, and the outputs (one float per run).
+
+    import montecarlo
+    res = montecarlo.run({"n[0]": ("uniform", 20, 40), "T_day": ("normal", 20, 2)}, members=500)
+    res["quantiles"][-1, res["channels"].index("T0")]     #95th percentile of room 0, per record
+'''
+#imports
+import warnings
+import numpy as np
+import ensemble
+import kernel
+import optimise
+import parallel
+import Ventilation as V
+
+#scalar outputs of a run, for the sensitivity indices. functions of a run as in optimise.py
+outputs = {"peak_room_temp": optimise.peak_room_temp, "hours_above_25": optimise.hours_above(25)}
+
+
+class Moments:
+    '''running count, mean and variance of every element of an array of shape shape.
+    nan (a failed member) is skipped
+    '''
+    def __init__(self, shape):
+        self.count = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, x):
+        '''folds in a batch x of shape (members,) + shape'''
+        valid = ~np.isnan(x)
+        n_b = valid.sum(axis=0)
+        x = np.where(valid, x, 0)
+        with np.errstate(all="ignore"):
+            mean_b = np.where(n_b > 0, x.sum(axis=0)/n_b, 0)
+            m2_b = (np.where(valid, x - mean_b, 0)**2).sum(axis=0)
+            n = self.count + n_b
+            delta = mean_b - self.mean
+            self.mean = np.where(n > 0, self.mean + delta*n_b/n, 0)
+            self.m2 = np.where(n > 0, self.m2 + m2_b + delta**2*self.count*n_b/n, 0)
+        self.count = n
+
+    def var(self):
+        '''sample variance, nan with fewer than two values'''
+        with np.errstate(all="ignore"):
+            return np.where(self.count > 1, self.m2/(self.count - 1), np.nan)
+
+class Quantiles:
+    '''P-square estimates of the probs quantiles of every element of an array of
+    shape shape: five markers per quantile and element, whatever the number of
+    values. nan is skipped. exact up to five values
+    '''
+    def __init__(self, shape, probs=(0.05, 0.5, 0.95)):
+        self.shape = tuple(shape)
+        self.probs = np.asarray(probs, dtype=float)
+        size = int(np.prod(self.shape))
+        self.count = np.zeros(size, dtype=int)
+        self.q = np.zeros((len(self.probs), 5, size))   #marker heights
+        self.n = np.zeros((len(self.probs), 5, size))   #marker positions, from 0
+        p = self.probs[:,None]
+        self.f = np.hstack([0*p, p/2, p, (1+p)/2, 0*p + 1])[:,:,None]   #desired position/(count-1)
+
+    def update(self, x):
+        '''folds in one value per element, x of shape shape'''
+        x = np.ravel(x)
+        valid = ~np.isnan(x)
+        main = np.nonzero(valid & (self.count >= 5))[0]
+        #the first five values of an element are its markers
+        early = np.nonzero(valid & (self.count < 5))[0]
+        if len(early):
+            self.q[:, self.count[early], early] = x[early]
+            self.count[early] += 1
+            full = early[self.count[early] == 5]
+            self.q[:,:,full] = np.sort(self.q[:,:,full], axis=1)
+            self.n[:,:,full] = np.arange(5)[None,:,None]
+        if len(main):
+            self.count[main] += 1
+            self._update(x[main], main)
+
+    def _update(self, x, m):
+        q, n = self.q[:,:,m], self.n[:,:,m]
+        q[:,0] = np.minimum(q[:,0], x)
+        q[:,4] = np.maximum(q[:,4], x)
+        cell = np.clip((q[:,1:4] <= x).sum(axis=1), 0, 3)  #x falls between markers cell and cell+1
+        n += np.arange(5)[None,:,None] > cell[:,None,:]
+        desired = self.f*(self.count[m] - 1)
+        with np.errstate(all="ignore"):
+            for i in (1, 2, 3):
+                d = desired[:,i] - n[:,i]
+                s = np.sign(d)
+                move = ((d >= 1) & (n[:,i+1] - n[:,i] > 1)) | ((d <= -1) & (n[:,i-1] - n[:,i] < -1))
+                #piecewise parabolic prediction, linear where that leaves the neighbours' range
+                parabolic = q[:,i] + s/(n[:,i+1] - n[:,i-1])*(
+                    (n[:,i] - n[:,i-1] + s)*(q[:,i+1] - q[:,i])/(n[:,i+1] - n[:,i])
+                    + (n[:,i+1] - n[:,i] - s)*(q[:,i] - q[:,i-1])/(n[:,i] - n[:,i-1]))
+                right = s > 0
+                q_s = np.where(right, q[:,i+1], q[:,i-1])
+                n_s = np.where(right, n[:,i+1], n[:,i-1])
+                linear = q[:,i] + s*(q_s - q[:,i])/(n_s - n[:,i])
+                ok = (q[:,i-1] < parabolic) & (parabolic < q[:,i+1])
+                q[:,i] = np.where(move, np.where(ok, parabolic, linear), q[:,i])
+                n[:,i] = np.where(move, n[:,i] + s, n[:,i])
+        self.q[:,:,m], self.n[:,:,m] = q, n
+
+    def value(self):
+        '''the estimates, shape (len(probs),) + shape. nan where there are no values'''
+        out = self.q[:,2].copy()
+        few = np.nonzero(self.count < 5)[0]
+        if len(few):
+            held = np.where(np.arange(5)[:,None] < self.count[few], self.q[0][:,few], np.nan)
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", RuntimeWarning)     #all nan: no values yet
+                out[:,few] = np.nanquantile(held, self.probs, axis=0)
+        return out.reshape((len(self.probs),) + self.shape)
+
+
+def sample(distributions, size, rng):
+    '''(size, parameters) array of draws, one column per distribution'''
+    columns = []
+    for spec in distributions.values():
+        if callable(spec):
+            columns.append(np.asarray(spec(rng, size), dtype=float))
+        else:
+            name, *args = spec
+            columns.append(getattr(rng, name)(*args, size=size))
+    return np.column_stack(columns) if columns else np.zeros((size, 0))
+
+def run_batch(configs, engine, record_every, workers, dt, steps):
+    '''runs a batch of configs, returns (data of shape (members, channels, records),
+    runs in the format of optimise.py, one per member)
+    '''
+    rooms = len(configs[0]["H"])
+    if engine == "kernel":
+        data, steps_run = _run_kernel(configs, record_every, dt, steps)
+        t = np.arange(data.shape[2])*record_every*dt/3600
+    elif engine == "parallel":
+        res = parallel.run_scenarios(configs, record_every, workers, dt, steps)
+        data, steps_run = res["data"], res["steps_run"]
+        t = res["t"]
+    else:
+        res = ensemble.run(configs, dt, steps, record_every)
+        t = res["t"]
+        data = np.concatenate([res["T"].transpose(1, 2, 0)] + [res[c].T[:,None] for c in
+                              ["T_h", "T_c", "h", "throughflow"]], axis=1)
+        steps_run = np.where(np.isnan(res["fail_time"]), steps, res["fail_time"]//dt).astype(int)
+    runs = [{"t": t, "T": d[:rooms].T, "T_h": d[rooms], "T_c": d[rooms+1], "h": d[rooms+2],
+             "throughflow": d[rooms+3], "steps_run": int(n), "steps": steps}
+            for d, n in zip(data, steps_run)]
+    return data, runs
+
+def _run_kernel(configs, record_every, dt, steps):
+    '''runs configs one after the other with kernel.run(), leaving Ventilation as it was'''
+    saved = V.get_config(), V.dt, V.steps, V.record_interval, V.record_channels
+    records = (steps - 1)//record_every + 1
+    data = np.full((len(configs), len(parallel.get_channels(len(configs[0]["H"]))), records), np.nan)
+    steps_run = np.zeros(len(configs), dtype=int)
+    try:
+        V.dt, V.steps = dt, steps
+        V.record_interval = record_every*dt
+        V.record_channels = ["T", "T_h", "T_c", "h", "throughflow"]
+        for k, c in enumerate(configs):
+            V.configure(**c)
+            res = kernel.run()
+            n = len(res)
+            data[k,:,:n] = np.column_stack([res["T"], res["T_h"], res["T_c"], res["h"],
+                                            res["throughflow"]]).T
+            steps_run[k] = res.steps
+    finally:
+        config, V.dt, V.steps, V.record_interval, V.record_channels = saved
+        V.configure(**config)
+    return data, steps_run
+
+def sobol_indices(f_a, f_b, f_ab):
+    '''first order and total indices from outputs of the A and B samples (members,)
+    and of A with each column from B (parameters, members). Saltelli 2010 for the
+    first order, Jansen for the total. returns (first, total), one per parameter, nan
+    if the output does not vary (e.g. hours above a threshold no run reaches)
+    '''
+    both = np.concatenate([f_a, f_b])
+    f_a, f_b, f_ab = f_a - both.mean(), f_b - both.mean(), f_ab - both.mean()  #less noise, same estimates
+    var = np.var(both)
+    if not var > 0:
+        nan = np.full(len(f_ab), np.nan)
+        return nan, nan.copy()
+    with np.errstate(all="ignore"):
+        first = np.mean(f_b*(f_ab - f_a), axis=1)/var
+        total = 0.5*np.mean((f_a - f_ab)**2, axis=1)/var
+    return first, total
+
+def run(distributions, members=1000, base=None, batch=64, probs=(0.05, 0.5, 0.95), seed=0,
+        sobol=False, engine="kernel", record_every=60, workers=None, dt=None, steps=None):
+    '''runs members scenarios drawn from distributions ({key: spec}) around base (a
+    scenario as for parallel.get_scenario, default the current config), batch at a time.
+    engine is "kernel" (kernel.run() one member after the other), "parallel" (a process
+    pool of Ventilation.run()) or "ensemble" (the vectorised engine, within its tolerance).
+    returns a dict with "t" (hrs), "channels", "count", "mean", "std" of shape
+    (channels, records), "quantiles" of shape (len(probs), channels, records), "probs",
+    "members" and "failed". with sobol, also "sobol": {output: {"first": {key: index},
+    "total": {key: index}}} for each output in outputs
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    base = parallel.get_scenario(V.get_config() if base is None else base)
+    keys = list(distributions)
+    rng = np.random.default_rng(seed)
+    a = sample(distributions, members, rng)
+    if sobol:
+        b = sample(distributions, members, rng)
+        #A, B, then A with column j from B for each j
+        designs = np.concatenate([a, b] + [np.where(np.arange(len(keys)) == j, b, a)
+                                           for j in range(len(keys))])
+    else:
+        designs = a
+    streamed = 2*members if sobol else members      #members that go into the statistics
+
+    channels = parallel.get_channels(len(base["H"]))
+    records = (steps - 1)//record_every + 1
+    moments = Moments((len(channels), records))
+    quantiles = Quantiles((len(channels), records), probs)
+    scores = {name: np.zeros(len(designs)) for name in outputs} if sobol else {}
+    failed = 0
+    t = None
+    for k0 in range(0, len(designs), batch):
+        configs = [optimise.apply(base, dict(zip(keys, map(float, d)))) for d in designs[k0:k0+batch]]
+        data, runs = run_batch(configs, engine, record_every, workers, dt, steps)
+        t = runs[0]["t"]
+        for name, f in scores.items():
+            f[k0:k0+len(runs)] = [outputs[name](r) for r in runs]
+        stream = data[:max(0, streamed - k0)]
+        if len(stream):
+            moments.update(stream)
+            for d in stream:
+                quantiles.update(d)
+            failed += sum(r["steps_run"] < steps for r in runs[:len(stream)])
+
+    res = {"t": t, "channels": channels, "count": moments.count, "mean": moments.mean,
+           "std": np.sqrt(moments.var()), "quantiles": quantiles.value(), "probs": list(probs),
+           "members": streamed, "failed": failed}
+    if sobol:
+        res["sobol"] = {}
+        for name, f in scores.items():
+            f_ab = f[2*members:].reshape(len(keys), members)
+            first, total = sobol_indices(f[:members], f[members:2*members], f_ab)
+            res["sobol"][name] = {"first": dict(zip(keys, first.tolist())),
+                                  "total": dict(zip(keys, total.tolist()))}
+    return res
+
+def main():
+    '''a day of the default building with uncertain occupancy, gains, weather and vents'''
+    distributions = {"n[0]": ("uniform", 20, 40), "n[1]": ("uniform", 20, 40),
+                     "w": ("normal", 100, 10), "peak_solar[0]": ("uniform", 10000, 30000),
+                     "peak_solar[1]": ("uniform", 10000, 30000), "T_day": ("normal", 20, 2),
+                     "T_night": ("uniform", 3, 7), "vents_a[0]": ("uniform", 3, 5),
+                     "vents_a[1]": ("uniform", 2, 4)}
+    res = run(distributions, members=64, sobol=True, steps=24*3600)
+    print(f"{res['members']} members, {res['failed']} failed")
+    last = len(res["t"]) - 1
+    for c in ["T0", "T1", "T_h", "T_c"]:
+        j = res["channels"].index(c)
+        peak = np.nanargmax(res["mean"][j])
+        band = "  ".join(f"p{100*p:g} {q:.2f}" for p, q in zip(res["probs"], res["quantiles"][:,j,peak]))
+        print(f"{c:>4} at {res['t'][peak]:5.1f} hrs: mean {res['mean'][j,peak]:.2f} "
+              f"std {res['std'][j,peak]:.2f}  {band}  (final mean {res['mean'][j,last]:.2f})")
+    for name, ind in res["sobol"].items():
+        print(f"sobol indices of {name}:")
+        for key in ind["first"]:
+            print(f"  {key:>14}  first {ind['first'][key]:6.3f}  total {ind['total'][key]:6.3f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,301 @@
+'''Multi-zone airflow network: zones joined by openings, pressures solved together.
+
+Ventilation.py resolves each room against one atrium in turn. Here a building
+is any graph of well mixed zones (rooms, corridors, atria) and openings, each
+opening joining two zones or a zone and outside. Every step the pressure of
+every zone is found at once by Newton iteration, then the buoyancy of every
+zone is advanced explicitly with the flows, as the rooms are in
+Ventilation.step().
+
+Pressures are kinematic (divided by density) and relative to the outside air at
+ground level, so a zone with buoyancy g (the model's effective gravity) and
+pressure P has P + g*z at height z, and an opening at height z between zones
+a and b carries
+
+    Q = A*sqrt(2*|d|)*sign(d),   d = P_a - P_b + (g_a - g_b)*z
+
+from a to b: the model's orifice relation, where two openings of areas a and b
+in series give Ventilation.get_A_eff(a, b)*sqrt(|stack|). Near d = 0 the root
+is smoothed over eps into a laminar, linear law, so that the Jacobian stays
+finite and Newton does not crawl out of still air. The Jacobian is a
+weighted graph Laplacian, symmetric positive definite once every zone has a
+path outside, and is solved by conjugate gradients preconditioned by its
+diagonal, with matrix products as sums over the openings, so a Newton
+iteration costs a few passes over the openings.
+
+A building is a dict, e.g.
+
+    {"zones": [{"name": "room 0", "volume": 180, "n": 30,
+                "peak_solar": 20000}, ...],
+     "openings": [{"from": "room 0", "to": "atrium", "area": 1, "height": 3},
+                  {"from": "atrium", "to": "outside", "area": 3, "height": 9}, ...]}
+
+    import network
+    net = network.Network(network.example(atria=2, storeys=4))
+    res = network.run(net, steps=24*3600)
+'''
+#imports
+import numpy as np
+import forcing
+import Ventilation as V
+
+outside = "outside"
+eps = 1e-4                          #m^2/s^2, below about this the flow tends to laminar (linear in d)
+newton_tol = 1e-10                  #m^3/s, largest net flow into a zone when solved
+newton_max = 50
+cg_tol = 1e-12                      #relative residual of the linear solves
+
+
+class Network:
+    '''a building as arrays: zone i of zones, opening k joins zone a[k] to zone b[k]
+    at height z[k] with area A[k]. outside is node zones (the last one) in a and b
+    '''
+    def __init__(self, spec, config=None):
+        self.spec = spec
+        self.config = V.get_config(**(config or {}))
+        c = self.config
+        self._weather = None if c["weather_file"] is None else forcing.read_weather(c["weather_file"], c["weather_start"])
+        zones = spec["zones"]
+        self.names = [z["name"] for z in zones]
+        index = {name: i for i, name in enumerate(self.names)}
+        if len(index) != len(zones) or outside in index:
+            raise ValueError(f"zone names must be unique and not {outside!r}")
+        index[outside] = len(zones)
+        self.zones = len(zones)
+        self.volume = np.array([z["volume"] for z in zones], dtype=float)
+        self.people = [z.get("n", 0) for z in zones]
+        self.B_sun = V.w_to_B(np.array([z.get("peak_solar", 0) for z in zones], dtype=float))
+        self.B_heat = V.w_to_B(np.array([z.get("heat", 0) for z in zones], dtype=float))
+        openings = spec["openings"]
+        try:
+            self.a = np.array([index[o["from"]] for o in openings], dtype=np.intp)
+            self.b = np.array([index[o["to"]] for o in openings], dtype=np.intp)
+        except KeyError as e:
+            raise ValueError(f"opening to an unknown zone: {e}") from None
+        self.A = np.array([o["area"] for o in openings], dtype=float)
+        self.z = np.array([o["height"] for o in openings], dtype=float)
+        self._check_connected()
+
+    def _check_connected(self):
+        '''every zone needs a path outside, or its pressure is not defined'''
+        reached = np.zeros(self.zones + 1, dtype=bool)
+        reached[self.zones] = True
+        while True:
+            step = reached[self.a] | reached[self.b]
+            new = reached.copy()
+            new[self.a[step]] = True
+            new[self.b[step]] = True
+            if (new == reached).all():
+                break
+            reached = new
+        if not reached.all():
+            stranded = [self.names[i] for i in np.nonzero(~reached[:-1])[0]]
+            raise ValueError(f"zones with no path outside: {stranded}")
+
+    @property
+    def openings(self):
+        return len(self.A)
+
+    #flows
+    def flows(self, P, g):
+        '''flow through every opening from a to b and its derivative by the pressure
+        difference, for node pressures P and buoyancies g (outside last)
+        '''
+        d = P[self.a] - P[self.b] + (g[self.a] - g[self.b])*self.z
+        root = np.sqrt(2*(np.abs(d) + eps))
+        Q = self.A*2*d/root                 #A*sqrt(2|d|)*sign(d), smoothed at 0
+        dQ = self.A*2*(np.abs(d) + 2*eps)/root**3
+        return Q, dQ
+
+    def net_out(self, Q):
+        '''net flow out of every zone'''
+        n = self.zones + 1
+        return (np.bincount(self.a, Q, n) - np.bincount(self.b, Q, n))[:-1]
+
+    def _laplacian(self, c, x):
+        '''the Jacobian times x: a graph Laplacian weighted by c, outside held at 0'''
+        full = np.append(x, 0.0)
+        diff = c*(full[self.a] - full[self.b])
+        n = self.zones + 1
+        return (np.bincount(self.a, diff, n) - np.bincount(self.b, diff, n))[:-1]
+
+    def _solve(self, c, rhs):
+        '''conjugate gradients on the Jacobian, preconditioned by its diagonal'''
+        n = self.zones + 1
+        diag = (np.bincount(self.a, c, n) + np.bincount(self.b, c, n))[:-1]
+        x = np.zeros(self.zones)
+        r = rhs.copy()
+        y = r/diag
+        p = y.copy()
+        ry = r @ y
+        stop = cg_tol**2*(rhs @ rhs)
+        for _ in range(10*self.zones + 10):
+            Ap = self._laplacian(c, p)
+            alpha = ry/(p @ Ap)
+            x += alpha*p
+            r -= alpha*Ap
+            if r @ r <= stop:
+                break
+            y = r/diag
+            ry, ry_old = r @ y, ry
+            p = y + ry/ry_old*p
+        return x
+
+    def solve(self, g, P=None):
+        '''zone pressures balancing the flows for buoyancies g (zones, then outside),
+        by Newton iteration from P (default 0). returns (P with outside appended, flows,
+        iterations)
+        '''
+        P = np.zeros(self.zones + 1) if P is None else P.copy()
+        Q, dQ = self.flows(P, g)
+        F = self.net_out(Q)
+        norm = np.abs(F).max(initial=0)
+        for k in range(newton_max):
+            if norm <= newton_tol:
+                return P, Q, k
+            dP = self._solve(dQ, F)
+            #damped: halve the step until the imbalance falls
+            scale = 1.0
+            while True:
+                trial = P.copy()
+                trial[:-1] -= scale*dP
+                Q_t, dQ_t = self.flows(trial, g)
+                F_t = self.net_out(Q_t)
+                norm_t = np.abs(F_t).max(initial=0)
+                if norm_t < norm or scale < 1e-3:
+                    break
+                scale /= 2
+            P, Q, dQ, F, norm = trial, Q_t, dQ_t, F_t, norm_t
+        return P, Q, newton_max
+
+    #timestep
+    def tables(self, dt, i0, i1):
+        '''(g_ext, sun, people per zone) for steps i0 to i1, from the config's weather'''
+        c = dict(self.config, n=self.people)
+        T_ext, sun, people = forcing.tables(c, dt, i0, i1, self._weather)
+        g_ext = V.g_real*(T_ext - c["T_night"])/(273 + c["T_night"])
+        return g_ext, sun, people
+
+    def step(self, dt, g, g_ext, sun, people, P=None):
+        '''advances zone buoyancies g by dt. returns (new g, P, Q, Newton iterations)'''
+        nodes = np.append(g, g_ext)
+        P, Q, its = self.solve(nodes, P)
+        #upwind: each opening carries the buoyancy of the zone it comes from
+        up = np.where(Q > 0, self.a, self.b)
+        down = np.where(Q > 0, self.b, self.a)
+        flux = np.abs(Q)*nodes[up]
+        n = self.zones + 1
+        B_in = np.bincount(down, flux, n)[:-1] + people*V.w_to_B(self.config["w"]) + sun*self.B_sun + self.B_heat
+        B_out = np.bincount(up, np.abs(Q), n)[:-1]*g
+        return g + dt*(B_in - B_out)/self.volume, P, Q, its
+
+def run(net, dt=None, steps=None, record_every=60):
+    '''runs a Network from still air at the night temp.
+    returns a dict: t (hrs), T (records, zones), P (records, zones), Q (records, openings),
+    "iterations", the Newton iterations of every step, steps_run and error, None or
+    why the run stopped early
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    T_night = net.config["T_night"]
+    g = np.zeros(net.zones)
+    P = None
+    K = (steps - 1)//record_every + 1
+    res = {"t": np.zeros(K), "T": np.zeros((K, net.zones)), "P": np.zeros((K, net.zones)),
+           "Q": np.zeros((K, net.openings)), "iterations": np.zeros(steps, dtype=np.int16),
+           "steps_run": steps, "error": None}
+    for k0 in range(0, steps, forcing.block):
+        k1 = min(k0 + forcing.block, steps)
+        g_ext, sun, people = net.tables(dt, k0, k1)
+        for i in range(k0, k1):
+            g, P, Q, its = net.step(dt, g, g_ext[i-k0], sun[i-k0], people[i-k0], P)
+            res["iterations"][i] = its
+            if its == newton_max or not np.isfinite(g).all():
+                #usually dt too long for the smallest zone: dt*Q/volume must stay below 1
+                res["error"] = f"pressure solve diverged at time {i*dt}, try a shorter dt"
+                res["steps_run"] = i
+                print(res["error"])
+                return res
+            if i % record_every == 0:
+                r = i//record_every
+                res["t"][r] = i*dt/3600
+                res["T"][r] = T_night + g/V.g_real*(273 + T_night)
+                res["P"][r] = P[:-1]
+                res["Q"][r] = Q
+    return res
+
+def from_config(config=None):
+    '''the building of a Ventilation config as a network: each room a zone with its
+    low vent to outside at the floor and its high vent into a well mixed atrium at
+    h_v, the atrium with its vents at the bottom and top
+    '''
+    c = V.get_config(**(config or {}))
+    zones = [{"name": f"room {j}", "volume": c["H"][j]*c["S"][j], "n": c["n"][j],
+              "peak_solar": c["peak_solar"][j]} for j in range(len(c["H"]))]
+    zones.append({"name": "atrium", "volume": c["H_a"]*c["S_a"]})
+    floors = np.cumsum([0] + list(c["H"][:-1]))
+    openings = []
+    for j in range(len(c["H"])):
+        openings.append({"from": outside, "to": f"room {j}", "area": c["vents"][j][0], "height": float(floors[j])})
+        openings.append({"from": f"room {j}", "to": "atrium", "area": c["vents"][j][1], "height": c["h_v"][j]})
+    openings.append({"from": outside, "to": "atrium", "area": c["vents_a"][0], "height": 0})
+    openings.append({"from": "atrium", "to": outside, "area": c["vents_a"][1], "height": c["H_a"]})
+    return {"zones": zones, "openings": openings}
+
+def example(atria=2, storeys=4, rooms=4, storey_height=3, room_area=60, atrium_area=36,
+            vent=1, atrium_vent=3, people=20, solar=10000):
+    '''atria side by side, each with rooms on every storey, the rooms of a storey
+    joined by a corridor that opens into every atrium
+    '''
+    H_a = storeys*storey_height + 3
+    zones = [{"name": f"atrium {k}", "volume": H_a*atrium_area} for k in range(atria)]
+    openings = []
+    for k in range(atria):
+        openings.append({"from": outside, "to": f"atrium {k}", "area": atrium_vent, "height": 0})
+        openings.append({"from": f"atrium {k}", "to": outside, "area": atrium_vent, "height": H_a})
+    for s in range(storeys):
+        floor = s*storey_height
+        corridor = f"corridor {s}"
+        zones.append({"name": corridor, "volume": storey_height*atria*20})
+        for k in range(atria):
+            openings.append({"from": corridor, "to": f"atrium {k}", "area": 2*vent, "height": floor + 2})
+            for r in range(rooms):
+                room = f"room {s}.{k}.{r}"
+                zones.append({"name": room, "volume": storey_height*room_area, "n": people,
+                              "peak_solar": solar})
+                openings.append({"from": outside, "to": room, "area": vent, "height": floor + 0.5})
+                openings.append({"from": room, "to": corridor, "area": vent, "height": floor + 1})
+                openings.append({"from": room, "to": f"atrium {k}", "area": vent, "height": floor + 2.5})
+    return {"zones": zones, "openings": openings}
+
+def main():
+    '''a two opening check against the model's relation, then the cost per step as the network grows'''
+    import time
+    #one warm zone, two openings: the flow must be Ventilation's A_eff*sqrt(stack)
+    net = Network({"zones": [{"name": "room", "volume": 180}],
+                   "openings": [{"from": outside, "to": "room", "area": 1, "height": 0},
+                                {"from": "room", "to": outside, "area": 2, "height": 3}]})
+    g = np.array([0.2, 0.0])
+    P, Q, its = net.solve(g)
+    print(f"two openings: {Q[0]:.6f} m^3/s in {its} iterations, "
+          f"A_eff*sqrt(g*H) {V.get_A_eff(1, 2)*np.sqrt(0.2*3):.6f}")
+
+    #the first twelve hours of the two atrium example, every zone's peak
+    net = Network(example(2, 4))
+    res = run(net, steps=12*3600)
+    peak = res["T"].max(axis=0)
+    for kind in ("atrium", "corridor", "room"):
+        zones = [i for i, name in enumerate(net.names) if name.startswith(kind)]
+        print(f"{kind:>9}s: peak {peak[zones].min():.2f} to {peak[zones].max():.2f} deg C")
+
+    for atria, storeys in [(1, 2), (2, 5), (4, 10), (8, 20), (16, 40)]:
+        net = Network(example(atria, storeys))
+        t0 = time.perf_counter()
+        res = run(net, steps=300, record_every=300)
+        per_step = (time.perf_counter() - t0)/300
+        print(f"{net.zones:>5} zones {net.openings:>6} openings: {per_step*1e6:8.0f} us/step, "
+              f"{res['iterations'].mean():.1f} Newton iterations/step, "
+              f"{per_step/net.openings*1e9:6.0f} ns/opening")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+'''Vent sizing: search the vent areas and heights for the best design.
+
+A design is a value for each entry of the user defined variables being sized,
+given as bounds keyed by the entry, e.g. "vents_a[0]" or "vents[1][1]" or
+"h_v[0]". Each generation a batch of designs is run in parallel (see
+parallel.py), every design is scored by the objective and checked against the
+constraints, and the next batch is drawn around the best feasible designs so
+far (a cross-entropy search). Designs are snapped to a grid of resolution, and
+designs already run are taken from a cache instead of being run again.
+
+    import optimise
+    res = optimise.optimise({"vents_a[0]": (1, 6), "vents_a[1]": (1, 6), "h_v[1]": (4, 8)},
+                            objective=optimise.hours_above(25))
+    res["best"][0]      #(score, design)
+'''
+#imports
+import copy
+import os
+import re
+import numpy as np
+import parallel
+import Ventilation as V
+
+
+#objectives and constraints take one run: a dict of "t" (hrs), "T" (records, rooms),
+#"T_h", "T_c", "h", "throughflow", "steps_run" and "steps"
+def peak_room_temp(run):
+    '''highest room temp, deg C'''
+    return float(np.nanmax(run["T"]))
+
+def hours_above(threshold):
+    '''objective: hours with any room above threshold deg C'''
+    def objective(run):
+        t = run["t"]
+        step = t[1] - t[0] if len(t) > 1 else 0
+        return float((run["T"] > threshold).any(axis=1).sum()*step)    #nan after a failure counts as not above
+    objective.__name__ = f"hours_above_{threshold}"
+    return objective
+
+def no_failure(run):
+    '''constraint: the run did not stop on one of the model's failure checks (h<0 etc)'''
+    return run["steps_run"] == run["steps"]
+
+def max_temp(limit):
+    '''constraint: no room above limit deg C'''
+    def constraint(run):
+        return peak_room_temp(run) <= limit
+    constraint.__name__ = f"max_temp_{limit}"
+    return constraint
+
+objectives = {"peak_room_temp": peak_room_temp}
+
+
+def parse_key(key):
+    '''"vents[1][0]" -> ("vents", [1, 0])'''
+    match = re.fullmatch(r"(\w+)((?:\[\d+\])*)", key.replace(" ", ""))
+    if match is None or match.group(1) not in V.user_variables:
+        raise KeyError(f"not a user defined variable: {key}")
+    return match.group(1), [int(i) for i in re.findall(r"\d+", match.group(2))]
+
+def apply(base, design):
+    '''config with the entries of design (key: value) set on a copy of base'''
+    config = copy.deepcopy(base)
+    for key, value in design.items():
+        name, index = parse_key(key)
+        if not index:
+            config[name] = value
+            continue
+        target = config[name]
+        for i in index[:-1]:
+            target = target[i]
+        target[index[-1]] = value
+    return config
+
+def latin_hypercube(n, lo, hi, rng):
+    '''n points in the box lo..hi (arrays), one in each of n slices of every axis'''
+    u = (rng.permuted(np.tile(np.arange(n), (len(lo), 1)), axis=1).T + rng.random((n, len(lo))))/n
+    return lo + u*(hi - lo)
+
+def evaluate(configs, objective, constraints, record_every, workers, dt, steps):
+    '''runs a batch of configs in parallel, returns [(score, feasible, failed constraints)]'''
+    res = parallel.run_scenarios(configs, record_every, workers, dt, steps)
+    rooms = len(configs[0]["H"])
+    out = []
+    for k in range(len(configs)):
+        data = res["data"][k]
+        run = {"t": res["t"], "T": data[:rooms].T, "T_h": data[rooms], "T_c": data[rooms+1],
+               "h": data[rooms+2], "throughflow": data[rooms+3],
+               "steps_run": int(res["steps_run"][k]), "steps": steps}
+        failed = [c.__name__ for c in constraints if not c(run)]
+        out.append((objective(run), not failed, failed))
+    return out
+
+def optimise(bounds, objective=peak_room_temp, constraints=(no_failure,), base=None,
+             batch=None, generations=6, elite=4, resolution=0.01, seed=0,
+             record_every=60, workers=None, dt=None, steps=None):
+    '''minimises objective over the designs within bounds ({key: (lo, hi)}), starting
+    from base (a scenario as for parallel.get_scenario, default the current config).
+    objective is a function of a run or a name in objectives, constraints are
+    functions of a run that are True when it is acceptable.
+    batch designs are run per generation (default: two per core), the next batch
+    is drawn around the elite best feasible designs.
+    returns a dict: "best" [(score, design)] best first, feasible only, and
+    "history" [{"design", "score", "feasible", "failed", "generation"}] in run order
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    if isinstance(objective, str):
+        objective = objectives[objective]
+    base = parallel.get_scenario(V.get_config() if base is None else base)
+    keys = list(bounds)
+    lo = np.array([bounds[k][0] for k in keys], dtype=float)
+    hi = np.array([bounds[k][1] for k in keys], dtype=float)
+    batch = batch or 2*(workers or os.cpu_count())
+    rng = np.random.default_rng(seed)
+    cache = {}                          #design tuple -> history entry
+    history = []
+
+    def snap(x):
+        return tuple(np.round(np.clip(x, lo, hi)/resolution)*resolution)
+
+    for generation in range(generations):
+        feasible = sorted((e for e in cache.values() if e["feasible"]), key=lambda e: e["score"])
+        if generation == 0 or not feasible:
+            candidates = latin_hypercube(batch, lo, hi, rng)
+        else:
+            top = np.array([[e["design"][k] for k in keys] for e in feasible[:elite]])
+            spread = np.maximum(top.std(axis=0), 0.05*(hi - lo)/(generation + 1))
+            candidates = rng.normal(top.mean(axis=0), spread, (4*batch, len(keys)))
+
+        designs = []
+        for x in candidates:
+            key = snap(x)
+            if key not in cache and key not in designs:
+                designs.append(key)
+            if len(designs) == batch:
+                break
+        if not designs:
+            continue
+        configs = [apply(base, dict(zip(keys, map(float, d)))) for d in designs]
+        for d, (score, ok, failed) in zip(designs, evaluate(configs, objective, constraints,
+                                                           record_every, workers, dt, steps)):
+            entry = {"design": dict(zip(keys, map(float, d))), "score": score, "feasible": ok,
+                     "failed": failed, "generation": generation}
+            cache[d] = entry
+            history.append(entry)
+        best = min((e["score"] for e in history if e["feasible"]), default=float("nan"))
+        print(f"generation {generation}: {len(designs)} designs run, "
+              f"{sum(e['feasible'] for e in history)}/{len(history)} feasible, best {best:.3f}")
+
+    feasible = sorted((e for e in history if e["feasible"]), key=lambda e: e["score"])
+    return {"best": [(e["score"], e["design"]) for e in feasible], "history": history}
+
+def main():
+    '''atrium vents and the upper vent height, for the fewest hours above 25 deg C'''
+    bounds = {"vents_a[0]": (1, 6), "vents_a[1]": (1, 6), "h_v[1]": (4, 8)}
+    res = optimise(bounds, hours_above(25), batch=8, generations=4, steps=24*3600)
+    print(f"{len(res['history'])} designs run")
+    for score, design in res["best"][:5]:
+        print(f"{score:8.2f} hrs  " + "  ".join(f"{k}={v:.2f}" for k, v in design.items()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+'''Process pool scenario runner.
+
+Spreads scenarios over all cores. Each scenario is a full set of user defined
+variables (see Ventilation.get_config), or a path to a copy of the script to
+read them from, e.g. "Ventilation precooled.py". Workers write straight into a
+shared memory block allocated by the parent, so only an index and a step count
+are pickled back per scenario. With cached=True each worker goes through
+cache.run(), so scenarios already run with the same inputs are read from disk.
+Summary metrics are taken over every step, a leg of steps at a time (see
+run_legs()), so a summary needs memory for one leg however long the run.
+
+    import parallel
+    res = parallel.run_scenarios(["Ventilation.py", "Ventilation precooled.py"])
+    res["data"][1, res["channels"].index("T_c")]    #precooled cold layer temps
+'''
+#imports
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import numpy as np
+import cache
+import results
+import Ventilation as V
+
+#summary metrics, one row per scenario
+metrics = ["peak_room_temp", "mean_room_temp", "peak_hot_layer_temp", "mean_throughflow", "fail_time"]
+leg = 3600                          #steps recorded at a time for the summary, bounds its memory
+
+
+def get_channels(rooms):
+    '''names of the recorded channels for a building with this many rooms'''
+    return [f"T{j}" for j in range(rooms)] + ["T_h", "T_c", "h", "throughflow"]
+
+def get_scenario(scenario):
+    '''full config dict from a dict of overrides or a path to a script'''
+    if isinstance(scenario, str):
+        return V.read_config(scenario)
+    return V.get_config(**scenario)
+
+class Summary:
+    '''the summary metrics, reduced from result stores of T, T_h and throughflow a
+    block of records at a time
+    '''
+    def __init__(self):
+        self.peak_T = self.peak_T_h = -np.inf
+        self.sum_T = self.sum_throughflow = 0.0
+        self.count_T = self.count = 0
+
+    def add(self, res):
+        if len(res):
+            T = res["T"]
+            self.peak_T = max(self.peak_T, float(T.max()))
+            self.peak_T_h = max(self.peak_T_h, float(res["T_h"].max()))
+            self.sum_T += float(T.sum())
+            self.sum_throughflow += float(res["throughflow"].sum())
+            self.count_T += T.size
+            self.count += len(res)
+        return self
+
+    def metrics(self, error, steps, dt):
+        if not self.count:
+            return [np.nan]*4 + [np.nan if error is None else steps*dt]
+        return [self.peak_T, self.sum_T/self.count_T, self.peak_T_h, self.sum_throughflow/self.count,
+                np.nan if error is None else steps*dt]
+
+def summarise(res, dt):
+    '''the summary metrics of a result store that recorded T, T_h and throughflow every step'''
+    return Summary().add(res).metrics(res.error, res.steps, dt)
+
+def run_legs(dt, steps, record_every=0, channels=None, legs=leg, on_leg=None):
+    '''runs the configured model with kernel.run(), legs steps at a time. each leg is
+    recorded every step only to be reduced into the summary metrics, and every
+    record_every-th step of it is kept (of channels, default T, T_h, T_c, h and
+    throughflow). on_leg(steps run) is called after every leg.
+    returns (summary metrics, results.Results of the kept records or None if
+    record_every is 0, steps run, error)
+    '''
+    import kernel
+    channels = channels or ["T", "T_h", "T_c", "h", "throughflow"]
+    saved = V.dt, V.record_interval, V.record_channels
+    V.dt = dt
+    V.record_interval = dt
+    V.record_channels = list(dict.fromkeys(channels + ["T", "T_h", "throughflow"]))
+    summary = Summary()
+    kept = None
+    if record_every:
+        kept = results.Results((steps-1)//record_every + 1, len(V.H), record_every*dt, channels)
+    state = None
+    i = 0
+    error = None
+    try:
+        while i < steps:
+            res = kernel.run(None, state, i, min(i + legs, steps))
+            summary.add(res)
+            if kept is not None:
+                first = -i % record_every
+                kept.extend(*[res[name][first::record_every] if name in res.names else None
+                              for name in results.record_order])
+            i += res.steps
+            state = res.state
+            error = res.error
+            if error is not None:
+                break
+            if on_leg is not None:
+                on_leg(i)
+    finally:
+        V.dt, V.record_interval, V.record_channels = saved
+    if kept is not None:
+        kept.steps = i
+        kept.state = state
+        kept.error = error
+    return summary.metrics(error, i, dt), kept, i, error
+
+def _worker(index, config, shm_name, shape, record_every, dt, steps, cached):
+    '''runs one scenario and writes its row of the shared block'''
+    V.configure(**config)
+    V.dt = dt
+    V.steps = steps
+    if record_every:
+        V.record_interval = record_every*dt
+        V.record_channels = ["T", "T_h", "T_c", "h", "throughflow"]
+        res = cache.run() if cached else V.run()
+        steps_run = res.steps
+    else:
+        def legs():
+            values, _, steps_run, error = run_legs(dt, steps, channels=["T", "T_h", "throughflow"])
+            return values, steps_run, error
+        values, steps_run, _ = cache.summary(legs) if cached else legs()
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(shape, dtype=float, buffer=shm.buf)[index]
+        if record_every:
+            k = len(res)
+            out[:-4, :k] = res["T"].T
+            for c, name in enumerate(["T_h", "T_c", "h", "throughflow"]):
+                out[c-4, :k] = res[name]
+        else:
+            out[:] = values
+    finally:
+        shm.close()
+    return index, steps_run
+
+def _run(scenarios, record_every, workers, dt, steps, cached):
+    configs = [get_scenario(s) for s in scenarios]
+    rooms = len(configs[0]["H"])
+    if any(len(c["H"]) != rooms for c in configs):
+        raise ValueError("all scenarios need the same number of rooms")
+    if record_every:
+        shape = (len(configs), len(get_channels(rooms)), (steps-1)//record_every + 1)
+    else:
+        shape = (len(configs), len(metrics))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(8, 8*int(np.prod(shape))))
+    try:
+        data = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        data[:] = np.nan                #rows of failed runs stop early
+        steps_run = np.zeros(len(configs), dtype=int)
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            futures = [pool.submit(_worker, i, c, shm.name, shape, record_every, dt, steps, cached)
+                       for i, c in enumerate(configs)]
+            for f in futures:
+                i, n_run = f.result()
+                steps_run[i] = n_run
+        data = data.copy()
+    finally:
+        shm.close()
+        shm.unlink()
+    return configs, data, steps_run
+
+def run_scenarios(scenarios, record_every=60, workers=None, dt=None, steps=None, cached=False):
+    '''runs every scenario in parallel, recording every record_every steps.
+    returns a dict with "t" (hrs), "channels", "data" of shape (scenarios, channels, records),
+    "steps_run" (less than steps if the run failed) and the full "configs"
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    configs, data, steps_run = _run(scenarios, record_every, workers, dt, steps, cached)
+    return {"t": np.arange(0, steps, record_every)*dt/3600,
+            "channels": get_channels(len(configs[0]["H"])),
+            "data": data, "steps_run": steps_run, "configs": configs}
+
+def run_summaries(scenarios, workers=None, dt=None, steps=None, cached=False):
+    '''runs every scenario in parallel, keeping only the summary metrics.
+    returns a dict of metric name -> array over scenarios, plus "steps_run" and "configs"
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    configs, data, steps_run = _run(scenarios, 0, workers, dt, steps, cached)
+    res = {m: data[:,k] for k, m in enumerate(metrics)}
+    res["steps_run"] = steps_run
+    res["configs"] = configs
+    return res
+
+def main():
+    '''both scripts plus a sweep of the atrium vents, one core each'''
+    scenarios = ["Ventilation.py", "Ventilation precooled.py"]
+    scenarios += [{"vents_a": [a, 3]} for a in (1, 2, 3, 5, 6)]
+    res = run_summaries(scenarios)
+    names = [str(s) if isinstance(s, str) else str(s["vents_a"]) for s in scenarios]
+    print(f"{'scenario':>26}" + "".join(f"{m:>20}" for m in metrics))
+    for k, name in enumerate(names):
+        print(f"{name:>26}" + "".join(f"{res[m][k]:>20.3f}" for m in metrics))
+
+if __name__ == "__main__":
+    main()
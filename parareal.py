@@ -0,0 +1,238 @@
+'''Parallel in time runs (Parareal, Lions, Maday and Turinici 2001) of one long simulation.
+
+The run is cut into slices. The coarse propagator G is the same compiled
+model (kernel.run) with a long timestep, coarse_dt, which is about a
+hundredth of the cost of the fine propagator F, the model at the run's dt.
+Every iteration runs F over all slices not yet exact at once on a process
+pool, then sweeps G through the slices in order, correcting each slice's
+start with the last fine result:
+
+    U[n+1] = G(U[n]) + F(U_old[n]) - G(U_old[n])
+
+until no slice start moves by more than tol (deg C for temps, m for the
+interface height, m^3/s for throughflow). After k iterations the first k
+slices are exact, so it always ends in at most as many iterations as slices,
+but it only pays if it converges in a few. The trajectory is made of the last
+fine runs, recorded every record_every steps.
+
+The speedup is reported twice: measured on this machine, and ideal, with a
+core per slice, from the longest fine slice of every iteration plus the coarse
+sweeps. With compare=True the serial run is made too and the largest
+deviation of the parallel trajectory from it is reported.
+
+    import parareal, Ventilation as V
+    V.steps = 365*24*3600
+    out = parareal.run(slices=32, compare=True)
+    parareal.report(out)
+    out["res"]["T"]
+'''
+#imports
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import kernel
+import results
+import Ventilation as V
+
+coarse_dt = 60                      #s, timestep of the coarse propagator
+tol = 1e-3                          #largest change of a slice start when converged
+channels = ["T", "T_h", "T_c", "h", "throughflow"]
+
+
+def pack(state):
+    '''a state (g, g_h, g_c, h, throughflow) as one array'''
+    return np.array(list(state[0]) + list(state[1:]), dtype=float)
+
+def unpack(x, rooms):
+    return list(x[:rooms]), *x[rooms:].tolist()
+
+def scale(config):
+    '''per entry of a packed state, what one unit of tol is: g in deg C, h in m, throughflow in m^3/s'''
+    rooms = len(config["H"])
+    s = np.ones(rooms + 4)
+    s[:rooms+2] = (273 + config["T_night"])/V.g_real
+    return s
+
+def _propagate(x, i0, i1, dt, every, quiet=False):
+    '''kernel.run() from packed state x over steps i0 to i1 of dt, recording every
+    every steps (quiet as for kernel.run). returns (packed end state, records or None,
+    error or None, seconds)
+    '''
+    t0 = time.perf_counter()
+    V.dt = dt
+    V.record_interval = every*dt
+    try:
+        res = kernel.run(state=unpack(x, len(V.H)), start=i0, stop=i1, quiet=quiet)
+    except ValueError as e:             #negative B_out is raised, not returned
+        return x, None, str(e), time.perf_counter() - t0
+    records = {name: res[name] for name in ["t"] + channels}
+    return pack(res.state), records, res.error, time.perf_counter() - t0
+
+def _init(config, record_channels):
+    '''runs once in each worker: the config, and compiles the kernel'''
+    V.configure(**config)
+    V.record_channels = record_channels
+    V.steps = 2
+    kernel.run()
+
+class _Propagators:
+    '''fine slices on a pool (or here if workers is 1) and coarse slices here'''
+    def __init__(self, config, dt, record_every, ratio, workers):
+        self.dt = dt
+        self.record_every = record_every
+        self.ratio = ratio
+        self.pool = None
+        if workers != 1:
+            self.pool = ProcessPoolExecutor(workers or os.cpu_count(), initializer=_init,
+                                            initargs=(config, channels))
+
+    def fine(self, jobs):
+        '''[(x, i0, i1)] -> [_propagate() results]'''
+        args = [(x, i0, i1, self.dt, self.record_every) for x, i0, i1 in jobs]
+        if self.pool is None:
+            return [_propagate(*a) for a in args]
+        return [f.result() for f in [self.pool.submit(_propagate, *a) for a in args]]
+
+    def coarse(self, x, i0, i1):
+        '''packed end state of the coarse run over fine steps i0 to i1, x itself if it fails.
+        the long step often reaches chimney case 4, so its "edge case" lines are left out
+        '''
+        end, _, error, _ = _propagate(x, i0//self.ratio, i1//self.ratio, self.dt*self.ratio, 2**62, True)
+        return x if error else end
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+def run(slices=None, workers=None, record_every=60, compare=False, max_iterations=None):
+    '''the configured run (Ventilation's config, dt and steps) by Parareal over slices
+    slices (default: one per worker). returns a dict:
+      res           results.Results of T, T_h, T_c, h and throughflow every record_every steps
+      iterations    Parareal iterations (fine passes) taken
+      converged     False if max_iterations ran out, or a fine slice from an exact start failed
+      changes       largest change of a slice start in each iteration, in units of tol
+      error         the model's failure message, if the run fails
+      time, ideal_time, serial_time, speedup, ideal_speedup     s, s, s (if compare or estimated
+                    from the fine slice times), measured and with a core per slice
+      deviation     largest difference from the serial run of each channel (if compare)
+    '''
+    workers = workers or os.cpu_count()
+    slices = slices or workers
+    config = V.get_config()
+    dt, steps = V.dt, V.steps
+    rooms = len(config["H"])
+    ratio = max(1, round(coarse_dt/dt))
+    #slice ends on multiples of both the coarse step and the record interval
+    unit = np.lcm(ratio, record_every)
+    edges = np.unique(np.round(np.linspace(0, steps/unit, slices + 1)).astype(int)*unit)
+    edges[-1] = steps
+    slices = len(edges) - 1
+    units = scale(config)
+    saved = V.dt, V.steps, V.record_interval, V.record_channels
+    V.record_channels = channels
+    prop = _Propagators(config, dt, record_every, ratio, workers)
+    out = {"changes": [], "error": None, "converged": True}
+    t0 = time.perf_counter()
+    try:
+        #initial guess: the coarse run through every slice
+        t_coarse = time.perf_counter()
+        U = [pack(V.initial_state())]
+        G_old = []
+        for n in range(slices):
+            G_old.append(prop.coarse(U[n], edges[n], edges[n+1]))
+            U.append(G_old[n])
+        ideal = time.perf_counter() - t_coarse
+        fine = [None]*slices                #(start it ran from, result) per slice
+        first_pass = 0.0
+        for k in range(1, (max_iterations or slices) + 1):
+            todo = [n for n in range(slices) if fine[n] is None or not np.array_equal(fine[n][0], U[n])]
+            done = prop.fine([(U[n], edges[n], edges[n+1]) for n in todo])
+            for n, r in zip(todo, done):
+                fine[n] = (U[n], r)
+            longest = max(r[3] for r in done)
+            first_pass = first_pass or sum(r[3] for r in done)
+            out["iterations"] = k
+            #a failure from an exact start is the model failing, as it would serially
+            failed = [n for n in todo if fine[n][1][2] is not None]
+            if failed and failed[0] < k:
+                out["error"] = fine[failed[0]][1][2]
+                out["converged"] = False
+                ideal += longest
+                break
+            #coarse sweep with the fine correction
+            t_coarse = time.perf_counter()
+            new = [U[0]]
+            change = 0.0
+            for n in range(slices):
+                g_new = G_old[n] if n < k else prop.coarse(new[n], edges[n], edges[n+1])
+                #a fine slice that failed from an inexact start gives no correction
+                F = G_old[n] if fine[n][1][2] is not None else fine[n][1][0]
+                #exactly F where G did not move, i.e. the slices already exact
+                new.append(F + (g_new - G_old[n]))
+                G_old[n] = g_new
+                change = max(change, float(np.abs((new[n+1] - U[n+1])*units).max()))
+            U = new
+            ideal += longest + time.perf_counter() - t_coarse
+            out["changes"].append(change/tol)
+            if change <= tol:
+                break
+        else:
+            out["converged"] = out["iterations"] >= slices      #every slice exact
+    finally:
+        prop.close()
+        V.dt, V.steps, V.record_interval, V.record_channels = saved
+    out["time"] = time.perf_counter() - t0
+
+    #the trajectory from the last fine run of every slice
+    res = results.Results(steps//record_every + 1, rooms, record_every*dt, channels)
+    for n in range(slices):
+        records = fine[n][1][1]
+        if records is not None:
+            res.extend(*[records.get(name) for name in results.record_order])
+        if fine[n][1][2] is not None:
+            break
+    res.steps = steps if out["error"] is None else len(res)*record_every
+    res.state = unpack(U[-1], rooms)
+    res.error = out["error"]
+    out["res"] = res
+    out["ideal_time"] = ideal
+    out["serial_time"] = first_pass             #estimate, replaced by the real one below
+    if compare:
+        V.record_interval, V.record_channels = record_every*dt, channels
+        try:
+            t1 = time.perf_counter()
+            serial = kernel.run()
+            out["serial_time"] = time.perf_counter() - t1
+        finally:
+            V.record_interval, V.record_channels = saved[2:]
+        n = min(len(serial), len(res))
+        out["deviation"] = {name: float(np.abs(res[name][:n] - serial[name][:n]).max()) for name in channels}
+    out["speedup"] = out["serial_time"]/out["time"]
+    out["ideal_speedup"] = out["serial_time"]/out["ideal_time"]
+    return out
+
+def report(out):
+    '''prints the iterations, speedup and deviation of a run()'''
+    state = "converged" if out["converged"] else "did not converge"
+    print(f"{state} in {out['iterations']} iterations, changes (x tol): "
+          + ", ".join(f"{c:.3g}" for c in out["changes"]))
+    if out["error"]:
+        print(f"  {out['error']}")
+    print(f"  {out['time']:.2f} s here, {out['ideal_time']:.2f} s with a core per slice, "
+          f"serial {out['serial_time']:.2f} s: speedup {out['speedup']:.2f} here, "
+          f"{out['ideal_speedup']:.2f} ideal")
+    if "deviation" in out:
+        print("  largest deviation from serial: "
+              + ", ".join(f"{name} {d:.2e}" for name, d in out["deviation"].items()))
+
+def main():
+    '''four weeks at dt = 1 s in 28 slices'''
+    V.steps = 2
+    kernel.run()                        #compile
+    V.steps = 28*24*3600
+    out = run(slices=28, compare=True)
+    report(out)
+
+if __name__ == "__main__":
+    main()
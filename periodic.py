@@ -0,0 +1,99 @@
+'''Periodic steady state: the settled diurnal cycle without a fixed spin-up.
+
+With periodic forcing (no weather file) the model settles onto a daily cycle.
+Instead of running steps and throwing the first day away, run_periodic() steps
+the model an hour at a time and compares the state with the one 24 hours
+earlier. Once they agree, the last 24 hours are one converged cycle, which is
+returned reordered to run from midnight to midnight.
+
+    import periodic
+    day, days = periodic.run_periodic()
+'''
+#imports
+from collections import deque
+import Ventilation as V
+from results import Results
+
+
+def state_distance(a, b):
+    '''largest difference between two states, as (temps in deg C, interface height in m)'''
+    k = (273+V.T_night)/V.g_real
+    g_a = list(a[0]) + [a[1], a[2]]
+    g_b = list(b[0]) + [b[1], b[2]]
+    return k*max(abs(x-y) for x, y in zip(g_a, g_b)), abs(a[3]-b[3])
+
+def join_day(chunks, day_steps):
+    '''puts the chunks of the last 24 hours in time of day order, t in hrs since midnight.
+    an empty store if there are none, when the model failed in the first check
+    '''
+    if not chunks:
+        return V.new_results(1)
+    chunks = sorted(chunks, key=lambda c: (c[0] % day_steps))
+    first = chunks[0][1]
+    day = Results(sum(len(res) for _, res in chunks), first.rooms, first.interval, first.names, first.dtype)
+    k = 0
+    for _, res in chunks:
+        for name in day.names:
+            day.data[name][k:k+len(res)] = res[name]
+        k += len(res)
+    day.size = k
+    day.data["t"] %= 24
+    return day
+
+def run_periodic(temp_tol=1e-3, h_tol=1e-3, check=3600, max_days=30):
+    '''runs until the state is within temp_tol (deg C) and h_tol (m) of the state
+    a day earlier, comparing every check seconds.
+    returns (day, days): the converged day as a result store, with day.steps the
+    total steps taken, and the number of days simulated. day.error is set if the
+    model failed or did not converge within max_days
+    '''
+    if V.weather_file is not None:
+        raise ValueError("periodic steady state needs periodic forcing, set weather_file to None")
+    day_steps = round(24*3600/V.dt)
+    every = round(check/V.dt)
+    if day_steps % every:
+        raise ValueError("check has to divide a day")
+    per_day = day_steps//every
+    record_every = max(1, round(V.record_interval/V.dt))
+
+    chunks = deque(maxlen=per_day)          #(start step, results) for the last day
+    history = deque(maxlen=per_day+1)       #states at the checks, a day apart at either end
+    state = V.initial_state()
+    history.append(state)
+    i = 0
+    error = None
+    while i < max_days*day_steps:
+        res = V.run(V.new_results((every-1)//record_every + 1), state, i, i+every)
+        if res.error is not None:
+            error = res.error
+            i += res.steps
+            state = res.state or state
+            break
+        chunks.append((i, res))
+        state = res.state
+        i += every
+        history.append(state)
+        if len(history) == per_day+1:
+            dT, dh = state_distance(history[0], state)
+            if dT < temp_tol and dh < h_tol:
+                break
+    else:
+        error = f"no periodic steady state within {max_days} days"
+
+    day = join_day(chunks, day_steps)
+    day.steps = i
+    day.state = state
+    day.error = error
+    return day, i/day_steps
+
+def main():
+    day, days = run_periodic()
+    spin_up = V.steps*V.dt/(24*3600)
+    if day.error:
+        print(day.error)
+    print(f"converged after {days:.2f} simulated days, "
+          f"saved {spin_up - days:.2f} of the {spin_up:.0f} day spin-up")
+    print(f"peak room temp {day['T'].max():.2f}, hot layer {day['T_h'].max():.2f} deg C")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+'''Plots of a run: room temps, chimney layer temps, throughflow and delta p.
+
+Only imported when plotting, so the model itself never loads matplotlib.
+Figures are drawn as one 2x2 figure per run. save() renders straight through
+the Agg canvas and never touches pyplot, so it works without a display and
+does not block.
+
+Long runs are downsampled before they reach matplotlib: each series is cut
+into about two buckets per pixel of its chart and only the smallest and
+largest value of each bucket are drawn (method "minmax"), which keeps every
+peak and trough, or one point per bucket is picked by largest triangle three
+buckets (method "lttb", Steinarsson 2013). Both read the data a block at a
+time, so a run on disk (stream.StoredResults) is plotted straight from its
+memory-mapped files.
+
+    import plotting
+    plotting.save(res, "run.png", ext)      #or .svg
+    plotting.save_stream("year_run", "year.png")
+'''
+#imports
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.ticker import MultipleLocator
+
+method = "minmax"                   #"minmax", "lttb", or None to draw every point
+per_pixel = 2                       #points drawn per pixel of chart width
+block = 2**20                       #records read at a time
+
+
+def minmax(y, points):
+    '''indices of the smallest and largest value of y in each of points//2 equal
+    buckets, in order, with the first and last point
+    '''
+    n = len(y)
+    if n <= points:
+        return np.arange(n)
+    size = -(-n//max(1, points//2))
+    per_block = size*max(1, block//size)
+    found = [np.array([0, n-1])]
+    for k0 in range(0, n, per_block):
+        chunk = np.asarray(y[k0:k0+per_block])
+        full = len(chunk)//size*size
+        parts = [chunk[:full].reshape(-1, size)] if full else []
+        starts = [k0 + np.arange(0, full, size)]
+        if full < len(chunk):
+            parts.append(chunk[full:][None,:])
+            starts.append(np.array([k0 + full]))
+        for part, start in zip(parts, starts):
+            found.append(start + part.argmin(axis=1))
+            found.append(start + part.argmax(axis=1))
+    return np.unique(np.concatenate(found))
+
+def lttb(t, y, points):
+    '''indices of points points of (t, y) picked by largest triangle three buckets:
+    the first and last point, and from each bucket in between the point making
+    the largest triangle with the point picked before it and the mean of the next bucket
+    '''
+    n = len(y)
+    if n <= points or points < 3:
+        return np.arange(n)
+    edges = np.linspace(1, n-1, points-1).astype(int)   #points-2 buckets between the ends
+    edges = np.unique(edges)
+    starts = edges[:-1]
+    counts = np.diff(edges)
+    #mean of each bucket, a block at a time, then the last point as one more bucket
+    t_mean = np.zeros(len(starts))
+    y_mean = np.zeros(len(starts))
+    for k0 in range(0, len(starts), max(1, block//max(1, int(counts.max())))):
+        k1 = min(k0 + max(1, block//max(1, int(counts.max()))), len(starts))
+        lo, hi = starts[k0], edges[k1]
+        t_mean[k0:k1] = np.add.reduceat(np.asarray(t[lo:hi], dtype=float), starts[k0:k1] - lo)/counts[k0:k1]
+        y_mean[k0:k1] = np.add.reduceat(np.asarray(y[lo:hi], dtype=float), starts[k0:k1] - lo)/counts[k0:k1]
+    t_mean = np.append(t_mean, t[n-1])
+    y_mean = np.append(y_mean, y[n-1])
+    picked = np.zeros(len(starts) + 2, dtype=int)
+    picked[-1] = n-1
+    a = 0
+    t_a, y_a = float(t[0]), float(y[0])
+    for i, (lo, hi) in enumerate(zip(starts, edges[1:])):
+        t_b = np.asarray(t[lo:hi], dtype=float)
+        y_b = np.asarray(y[lo:hi], dtype=float)
+        area = np.abs((t_a - t_mean[i+1])*(y_b - y_a) - (t_a - t_b)*(y_mean[i+1] - y_a))
+        a = lo + int(area.argmax())
+        picked[i+1] = a
+        t_a, y_a = float(t[a]), float(y[a])
+    return picked
+
+def downsample(t, y, points, how=None):
+    '''(t, y) cut to about points points by method (or how)'''
+    how = method if how is None else how
+    if how is None or len(y) <= points:
+        return np.asarray(t), np.asarray(y)
+    if how == "minmax":
+        index = minmax(y, points)
+    elif how == "lttb":
+        index = lttb(t, y, points)
+    else:
+        raise ValueError(f"unknown downsampling method: {how}")
+    return np.asarray(t[index]), np.asarray(y[index])
+
+def series(res, ext=None):
+    '''(chart, label, channel, column) of every line drawn for a run, in drawing order.
+    column is None for scalar channels
+    '''
+    out = []
+    if "T" in res:
+        out += [(0, f"Room {j}", "T", j) for j in range(res["T"].shape[1])]
+    if ext is not None:
+        out.append((0, "External", "ext", None))
+    if "T_h" in res:
+        out.append((1, "Hot layer", "T_h", None))
+    if "T_c" in res:
+        out.append((1, "Cold layer", "T_c", None))
+    if ext is not None:
+        out.append((1, "External", "ext", None))
+    if "throughflow" in res:
+        out.append((2, "chimney", "throughflow", None))
+    if "Q" in res:
+        out += [(2, f"room {j}", "Q", j) for j in reversed(range(res["Q"].shape[1]))]
+    if "dp" in res:
+        out += [(3, f"room {j}", "dp", j) for j in reversed(range(res["dp"].shape[1]))]
+    return out
+
+class Charts:
+    '''the four charts of a run on a figure. update() sets the lines' data in place,
+    so drawing another run (or more of a run still being written) into the same
+    figure does not rebuild the axes
+    '''
+    def __init__(self, fig):
+        self.fig = fig
+        self.axes = list(fig.subplots(2, 2, sharex=True).flat)
+        titles = [("Room temps.", "Temp (deg C)"), ("Chimney layer temps.", "Temp (deg C)"),
+                  ("Throughflow", "Throughflow (m^3/s)"), ("Delta p", "dp (pa)")]
+        for ax, (title, label) in zip(self.axes, titles):
+            ax.set_title(title)
+            ax.set_ylabel(label)
+            ax.xaxis.set_major_locator(MultipleLocator(24)) # makes x-axis tickers every 24 hrs
+        for ax in self.axes[2:]:
+            ax.set_xlabel("Time (hrs)")
+        self.lines = {}                 #(chart, label) -> Line2D
+
+    def points(self, ax):
+        '''points to draw per series on a chart'''
+        return max(100, int(per_pixel*ax.bbox.width))
+
+    def update(self, res, ext=None):
+        '''draws res, a result store (results.Results or stream.StoredResults).
+        ext is the external temps at res["t"] or a function of times in hrs, left
+        out if None. missing channels are skipped, and lines of an earlier run that
+        res has no channel for are taken off
+        '''
+        ts = res["t"]
+        drawn = series(res, ext)
+        changed = False
+        for key in set(self.lines) - {(chart, label) for chart, label, _, _ in drawn}:
+            self.lines.pop(key).remove()
+            changed = True
+        for chart, label, name, column in drawn:
+            ax = self.axes[chart]
+            points = self.points(ax)
+            if name == "ext" and callable(ext):
+                #worked out at up to block evenly spaced records, then cut down like the rest
+                t = np.asarray(ts if len(ts) <= block else ts[np.linspace(0, len(ts)-1, block).astype(int)])
+                t, y = downsample(t, ext(t), points)
+            else:
+                y = ext if name == "ext" else res[name] if column is None else res[name][:,column]
+                t, y = downsample(ts, y, points)
+            line = self.lines.get((chart, label))
+            if line is None:
+                self.lines[chart, label] = ax.plot(t, y, label=label)[0]
+                changed = True
+            else:
+                line.set_data(t, y)
+        for ax in self.axes:
+            ax.relim()
+            ax.autoscale_view()
+            if changed:
+                if ax.get_legend_handles_labels()[0]:
+                    ax.legend()
+                elif ax.get_legend() is not None:
+                    ax.get_legend().remove()
+        if changed:
+            self.fig.tight_layout()
+        return self
+
+def draw(fig, res, ext=None):
+    '''draws the four charts of a run onto fig, see Charts.update'''
+    Charts(fig).update(res, ext)
+    return fig
+
+def save(res, path, ext=None, size=(12, 8), dpi=100):
+    '''renders the charts to path, the format follows the extension (png, svg, pdf)'''
+    fig = Figure(figsize=size, dpi=dpi)
+    FigureCanvasAgg(fig)
+    draw(fig, res, ext)
+    fig.savefig(path)
+    return path
+
+def show(res, ext=None, size=(12, 8)):
+    '''draws the charts in a window, using whatever backend pyplot picks'''
+    from matplotlib import pyplot as plt
+    fig = plt.figure(figsize=size)
+    draw(fig, res, ext)
+    plt.show()
+
+def stream_ext(res):
+    '''external temps as a function of hrs for a run on disk, from the config in its header'''
+    import forcing
+    meta = res.header.get("meta", {})
+    config = meta.get("config")
+    if config is None:
+        return None
+    weather = None
+    if config["weather_file"] is not None:
+        hours = meta["steps"]*meta["dt"]/3600 + 1
+        weather = forcing.read_weather(config["weather_file"], config["weather_start"], hours)
+    return lambda t: forcing.ext_temp(config, np.asarray(t)*3600, weather)
+
+def save_stream(directory, path, size=(12, 8), dpi=100):
+    '''renders the charts of a run written by stream.run_to_disk() to path,
+    reading the channels from their memory-mapped files
+    '''
+    import stream
+    res = stream.read_stream(directory)
+    return save(res, path, stream_ext(res), size, dpi)
+
+def main():
+    import sys
+    if len(sys.argv) != 3:
+        print("usage: python plotting.py RUN_DIRECTORY OUTPUT.png")
+        return
+    print(save_stream(sys.argv[1], sys.argv[2]))
+
+if __name__ == "__main__":
+    main()
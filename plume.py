@@ -0,0 +1,117 @@
+'''Room plumes: virtual origin and entrainment.
+
+A room with hot air below the interface vents a plume into the cold layer of
+the atrium, which entrains cold layer air on its way up to the hot layer. The
+plume is treated as a lazy half line plume, with its virtual origin from Hunt
+and Kaye 2001. entrainment() works out the volume and buoyancy flux a plume
+entrains once per plume, the fluxes into and out of the layers follow from it.
+
+virtual_origin() is the model's correction for one plume, virtual_origin_array()
+the same over arrays, for the batched engines. Written in terms of
+
+    L_Q = 5Q/(6 alpha M^(1/2)),   gamma = 5Q^2B/(4 alpha M^(5/2))
+
+the correction is z = L_Q f(gamma), where f only depends on gamma. OriginTable
+tabulates f on a geometric grid and interpolates, so an engine only needs a
+square root and an interpolation per plume instead of five fractional powers,
+within the relative error reported in its error attribute.
+
+    import plume
+    table = plume.OriginTable()
+    z = table(M, Q, B, alpha)       #arrays, within table.error of virtual_origin_array
+'''
+#imports
+import numpy as np
+
+gamma_switch = 88                   #far field (very lazy) form above this
+
+
+def virtual_origin(M, Q, B, alpha):
+    '''takes momentum flux, volume flux, buoyancy flux,
+    returns plume vertical origin correct
+    method taken from Hunt and Kaye 2001
+    '''
+    gamma = 5*Q**2*B/(4*alpha*M**(5/2))
+    if gamma > gamma_switch:
+        return 0.853*gamma**(-0.2)*5*Q/(6*alpha*M**0.5)
+    L = 2**(-1.5)*alpha**(-0.5)*M**(0.75)/B**0.5
+    return 1.057*L
+
+def virtual_origin_array(M, Q, B, alpha):
+    '''virtual_origin() over arrays'''
+    gamma = 5*Q**2*B/(4*alpha*M**(5/2))
+    far = 0.853*gamma**(-0.2)*5*Q/(6*alpha*M**0.5)
+    near = 1.057*2**(-1.5)*alpha**(-0.5)*M**(0.75)/B**0.5
+    return np.where(gamma > gamma_switch, far, near)
+
+def _far(gamma):
+    return 0.853*gamma**(-0.2)
+
+def _near(gamma):
+    return 1.057*2**(-1.5)*(5/4)**0.5*(6/5)*gamma**(-0.5)
+
+def origin_factor(gamma):
+    '''f(gamma) = z/L_Q of virtual_origin(), floats or arrays'''
+    return np.where(gamma > gamma_switch, _far(gamma), _near(gamma))
+
+def entrainment(B, z, rise, alpha, g_c):
+    '''what a plume of buoyancy flux B, virtual origin z below the vent, takes from
+    a cold layer of effective gravity g_c rising rise to the interface.
+    returns (volume flux, buoyancy flux), the buoyancy flux g_c times the volume
+    flux in the model's order of operations. floats or arrays
+    '''
+    B_third = B**(1/3)
+    spread = (rise+z)**(5/3)-(z)**(5/3)
+    return alpha*B_third*spread, g_c*alpha*B_third*spread
+
+class OriginTable:
+    '''f(gamma) of virtual_origin() tabulated against log10(gamma) from lo to hi,
+    per_decade points a decade, with gamma_switch on a grid point so that the
+    jump there falls between two cells. looking up a value is a log, a floor
+    and a linear interpolation.
+    f is a power of gamma on either side of gamma_switch, so the relative error
+    is the same in every cell of a branch. error is the largest relative error
+    of z, measured at 32 points in every cell when the table is built: about
+    4e-5 at the default 64 points a decade, and it falls with per_decade**2.
+    gamma outside the table falls back to the exact correction
+    '''
+    def __init__(self, lo=1e-6, hi=1e8, per_decade=64):
+        below = int(np.ceil((np.log10(gamma_switch) - np.log10(lo))*per_decade))
+        above = int(np.ceil((np.log10(hi) - np.log10(gamma_switch))*per_decade))
+        self.per_decade = per_decade
+        self.log_lo = np.log10(gamma_switch) - below/per_decade
+        self.lo = 10**self.log_lo
+        self.hi = gamma_switch*10**(above/per_decade)
+        grid = gamma_switch*10**(np.arange(-below, above + 1)/per_decade)
+        grid[below] = gamma_switch
+        #each cell's values at its ends, from the branch the cell is in
+        far = np.arange(len(grid) - 1) >= below
+        self.lower = np.where(far, _far(grid[:-1]), _near(grid[:-1]))
+        self.upper = np.where(far, _far(grid[1:]), _near(grid[1:]))
+        self.error = self._measure(grid)
+
+    def factor(self, gamma):
+        '''interpolated f(gamma), nan outside the table'''
+        gamma = np.asarray(gamma, dtype=float)
+        inside = (gamma >= self.lo) & (gamma <= self.hi)
+        with np.errstate(all="ignore"):
+            u = (np.log10(np.where(inside, gamma, self.lo)) - self.log_lo)*self.per_decade
+        k = np.clip(np.ceil(u).astype(int) - 1, 0, len(self.lower) - 1)
+        frac = u - k
+        out = self.lower[k] + frac*(self.upper[k] - self.lower[k])
+        return np.where(inside, out, np.nan)
+
+    def __call__(self, M, Q, B, alpha):
+        '''virtual_origin_array() from the table'''
+        root_M = np.sqrt(M)
+        gamma = 5*Q*Q*B/(4*alpha*M*M*root_M)
+        z = 5*Q/(6*alpha*root_M)*self.factor(gamma)
+        outside = np.isnan(z)
+        if outside.any():
+            z[outside] = virtual_origin_array(M[outside], Q[outside], B[outside], alpha)
+        return z
+
+    def _measure(self, grid):
+        t = np.linspace(0, 1, 33)[1:-1]
+        gamma = (grid[:-1,None]*(grid[1:,None]/grid[:-1,None])**t).ravel()
+        return float(np.abs(self.factor(gamma)/origin_factor(gamma) - 1).max())
@@ -0,0 +1,112 @@
+'''Preallocated columnar store for recorded model output.
+
+Each channel is one NumPy array, allocated once for the whole run. Room
+channels have a column per room, "flow" has one per room plus the chimney.
+
+    res["T"][:,0]       #room 0 temps
+    res["t"]            #record times, hrs
+'''
+#imports
+import numpy as np
+
+#channel: (columns, unit). columns is None for scalars, "rooms" or "flow"
+channels = {
+    "t": (None, "hrs"),
+    "T": ("rooms", "deg C"),
+    "T_h": (None, "deg C"),
+    "T_c": (None, "deg C"),
+    "h": (None, "m"),
+    "dp": ("rooms", "m^2/s^2"),
+    "Q": ("rooms", "m^3/s"),
+    "flow": ("flow", "code"),
+    "delta": (None, "m/s^2"),
+    "throughflow": (None, "m^3/s"),
+}
+#order of the arguments to record()
+record_order = list(channels)
+
+
+def get_shape(name, rooms):
+    '''shape of one record of a channel'''
+    columns = channels[name][0]
+    if columns == "rooms":
+        return (rooms,)
+    if columns == "flow":
+        return (rooms+1,)
+    return ()
+
+def get_dtype(name, dtype):
+    '''storage type of a channel: flow codes are small ints, time is always float64'''
+    if name == "flow":
+        return np.int8
+    if name == "t":
+        return np.float64
+    return np.dtype(dtype)
+
+class Results:
+    '''recorded channels of one run.
+    capacity is the number of records to allocate for, interval the time between
+    records in seconds, names the channels to keep (None for all) and dtype the
+    storage type of the float channels, e.g. "float32" to halve the memory.
+    steps is the number of model steps taken, state the model state at the end
+    of the run, flow the flow codes of the last step, and if the run stops
+    early error holds the reason
+    '''
+    def __init__(self, capacity, rooms, interval=1, names=None, dtype="float64"):
+        names = list(channels) if names is None else ["t"] + [c for c in names if c != "t"]
+        for name in names:
+            if name not in channels:
+                raise KeyError(f"unknown channel: {name}")
+        self.rooms = rooms
+        self.interval = interval
+        self.dtype = dtype
+        self.names = names
+        self.size = 0
+        self.steps = 0
+        self.state = None
+        self.flow = None
+        self.error = None
+        self.data = {name: np.zeros((capacity,)+get_shape(name, rooms), get_dtype(name, dtype))
+                     for name in names}
+        self._slots = [(record_order.index(name), self.data[name]) for name in names]
+
+    def record(self, t, T, T_h, T_c, h, dp, Q, flow, delta, throughflow):
+        '''stores one record, growing the store if the capacity was underestimated'''
+        k = self.size
+        if k == len(self.data["t"]):
+            self._grow()
+        values = (t, T, T_h, T_c, h, dp, Q, flow, delta, throughflow)
+        for i, array in self._slots:
+            array[k] = values[i]
+        self.size = k+1
+
+    def extend(self, t, T, T_h, T_c, h, dp, Q, flow, delta, throughflow):
+        '''stores a block of records, each argument an array with a row per record'''
+        n = len(t)
+        while self.size + n > len(self.data["t"]):
+            self._grow()
+        values = (t, T, T_h, T_c, h, dp, Q, flow, delta, throughflow)
+        for i, array in self._slots:
+            array[self.size:self.size+n] = values[i]
+        self.size += n
+
+    def _grow(self):
+        for name, array in self.data.items():
+            new = np.zeros((max(1, 2*len(array)),)+array.shape[1:], array.dtype)
+            new[:len(array)] = array
+            self.data[name] = new
+        self._slots = [(record_order.index(name), self.data[name]) for name in self.names]
+
+    def __getitem__(self, name):
+        return self.data[name][:self.size]
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def nbytes(self):
+        '''memory held by the store'''
+        return sum(array.nbytes for array in self.data.values())
@@ -0,0 +1,365 @@
+'''Local job server: one long running process that queues model runs for everyone.
+
+Scenarios are posted as JSON and run on a pool of worker processes that import
+the model (and load the compiled kernel) once when they start, instead of once
+per run. A scenario that is already queued, running or recently done is not run
+again: posting it returns the job that is already there. Plain HTTP, on
+localhost or on a Unix socket.
+
+    POST /runs              {"scenario": {...} or "Ventilation precooled.py",
+                             "dt": 1, "steps": 172800, "record_every": 60}
+                            -> {"id": ..., "status": ..., "duplicate": ...}
+    GET  /runs/<id>         status, progress and, when done, the summary metrics
+    GET  /runs/<id>?arrays=1    the same with the recorded arrays
+    GET  /runs/<id>/progress    progress as one JSON line per update, until the run ends
+    GET  /status            queue, workers and throughput
+
+Runs are the fixed step model run through kernel.run() (the same numbers as
+Ventilation.run()), in legs of progress_every simulated seconds. Script paths
+are read from the directory of this file (script_dir) and nowhere else.
+
+    python server.py --port 8765                    #or --socket /tmp/ventilation.sock
+    python server.py --submit "Ventilation precooled.py" --port 8765
+'''
+#imports
+import argparse
+import asyncio
+import hashlib
+import http.client
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+import numpy as np
+import parallel
+import Ventilation as V
+
+host = "127.0.0.1"
+port = 8765
+progress_every = 3600               #simulated seconds between progress updates
+keep_jobs = 256                     #finished jobs kept for duplicates and lookups
+script_dir = os.path.dirname(os.path.abspath(__file__))     #scenario scripts are read from here only
+reasons = {200: "OK", 202: "Accepted", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed"}
+
+
+#worker processes
+_progress = None
+
+def _init(progress):
+    '''runs once in each worker: keeps the progress queue and compiles the kernel.
+    ctrl-c is left to the server, which shuts the pool down
+    '''
+    global _progress
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _progress = progress
+    import kernel
+    V.steps = 2
+    kernel.run()
+
+def _work(job_id, config, dt, steps, record_every):
+    '''runs one job, sending (id, fraction done) after each leg.
+    returns the summary metrics, the steps run, the error, the recorded arrays and
+    the seconds it took
+    '''
+    t0 = time.perf_counter()
+    V.configure(**config)
+    V.steps = steps
+    _progress.put((job_id, 0.0))
+    summary, res, steps_run, error = parallel.run_legs(
+        dt, steps, record_every, legs=max(1, round(progress_every/dt)),
+        on_leg=lambda i: _progress.put((job_id, i/steps)))
+    arrays = {name: res[name] for name in res.names}
+    return summary, steps_run, error, arrays, time.perf_counter() - t0
+
+
+#jobs
+class Job:
+    '''one requested run, and what is known about it so far'''
+    def __init__(self, job_id, config, dt, steps, record_every):
+        self.id = job_id
+        self.config = config
+        self.dt = dt
+        self.steps = steps
+        self.record_every = record_every
+        self.status = "queued"
+        self.progress = 0.0
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.summary = None
+        self.steps_run = None
+        self.error = None
+        self.arrays = None
+        self.requests = 1
+
+    def describe(self, arrays=False):
+        out = {"id": self.id, "status": self.status, "progress": self.progress,
+               "requests": self.requests, "steps": self.steps, "dt": self.dt,
+               "submitted": self.submitted, "started": self.started, "finished": self.finished}
+        if self.status == "done":
+            out["summary"] = {m: _float(v) for m, v in zip(parallel.metrics, self.summary)}
+            out["steps_run"] = self.steps_run
+            out["error"] = self.error
+            if arrays:
+                out["arrays"] = {name: np.where(np.isfinite(a), a, None).tolist()
+                                 for name, a in self.arrays.items()}
+        elif self.status == "failed":
+            out["error"] = self.error
+        return out
+
+def _float(x):
+    return None if np.isnan(x) else float(x)
+
+def job_key(config, dt, steps, record_every):
+    '''id of a job: the same for identical requests'''
+    text = json.dumps({"config": config, "dt": dt, "steps": steps, "record_every": record_every},
+                      sort_keys=True)
+    return hashlib.sha256(text.encode()).hexdigest()[:16]
+
+class Server:
+    '''the job table, the worker pool and the HTTP front end'''
+    def __init__(self, workers=None):
+        self.workers = workers or os.cpu_count()
+        self.jobs = OrderedDict()       #id -> Job, oldest first
+        self.started = time.time()
+        self.completed = 0
+        self.duplicates = 0
+        self.busy_seconds = 0.0         #worker time spent on finished runs
+        self.simulated_hours = 0.0
+        self._progress = multiprocessing.Queue()
+        self._pool = None
+
+    #jobs
+    def submit(self, body):
+        '''queues the run a request body asks for, returns (job, duplicate). a script
+        path is taken relative to script_dir and must be inside it
+        '''
+        scenario = body.get("scenario", {})
+        if isinstance(scenario, str):
+            path = os.path.realpath(os.path.join(script_dir, scenario))
+            if os.path.commonpath([path, os.path.realpath(script_dir)]) != os.path.realpath(script_dir):
+                raise ValueError(f"scenario scripts must be in {script_dir}")
+            scenario = path
+        config = parallel.get_scenario(scenario)
+        dt = float(body.get("dt", V.dt))
+        steps = int(body.get("steps", V.steps))
+        record_every = int(body.get("record_every", 60))
+        if dt <= 0 or steps < 1 or record_every < 1:
+            raise ValueError("dt, steps and record_every must be positive")
+        job_id = job_key(config, dt, steps, record_every)
+        job = self.jobs.get(job_id)
+        if job is not None and job.status != "failed":
+            job.requests += 1
+            self.duplicates += 1
+            return job, True
+        job = Job(job_id, config, dt, steps, record_every)
+        self.jobs[job_id] = job
+        self.jobs.move_to_end(job_id)
+        asyncio.get_running_loop().create_task(self._run(job))
+        return job, False
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        try:
+            summary, steps_run, error, arrays, seconds = await loop.run_in_executor(
+                self._pool, _work, job.id, job.config, job.dt, job.steps, job.record_every)
+        except Exception as e:
+            job.status = "failed"
+            job.error = f"{type(e).__name__}: {e}"
+        else:
+            job.summary, job.steps_run, job.error, job.arrays = summary, steps_run, error, arrays
+            job.status = "done"
+            job.progress = 1.0
+            self.completed += 1
+            self.simulated_hours += steps_run*job.dt/3600
+            self.busy_seconds += seconds
+        job.finished = time.time()
+        if job.started is None and job.status == "done":
+            job.started = job.finished - seconds
+        self._forget()
+
+    def _forget(self):
+        '''drops the oldest finished jobs beyond keep_jobs'''
+        finished = [k for k, j in self.jobs.items() if j.status in ("done", "failed")]
+        for k in finished[:max(0, len(finished) - keep_jobs)]:
+            del self.jobs[k]
+
+    async def _read_progress(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self._progress.get)
+            if item is None:
+                return
+            job = self.jobs.get(item[0])
+            if job is not None and job.status in ("queued", "running"):
+                if job.status == "queued":
+                    job.status = "running"
+                    job.started = time.time()
+                job.progress = item[1]
+
+    def status(self):
+        count = {s: 0 for s in ("queued", "running", "done", "failed")}
+        for job in self.jobs.values():
+            count[job.status] += 1
+        uptime = time.time() - self.started
+        return {"workers": self.workers, "uptime": uptime, "jobs": count,
+                "completed": self.completed, "duplicates": self.duplicates,
+                "runs_per_hour": self.completed/uptime*3600,
+                "mean_run_seconds": self.busy_seconds/self.completed if self.completed else None,
+                "simulated_hours_per_second": self.simulated_hours/self.busy_seconds if self.busy_seconds else None}
+
+    #http
+    async def handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            method, target, _ = request.decode("latin-1").split(" ", 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode("latin-1").strip()
+                if not line:
+                    break
+                name, _, value = line.partition(":")
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get("content-length", 0)))
+            url = urlsplit(target)
+            parts = [p for p in url.path.split("/") if p]
+            query = parse_qs(url.query)
+            if parts == ["runs"] and method == "POST":
+                try:
+                    job, duplicate = self.submit(json.loads(body or b"{}"))
+                except (ValueError, KeyError, TypeError, OSError, SyntaxError) as e:
+                    await self._reply(writer, 400, {"error": f"{type(e).__name__}: {e}"})
+                else:
+                    await self._reply(writer, 202, {"id": job.id, "status": job.status,
+                                                    "duplicate": duplicate})
+            elif method != "GET":
+                await self._reply(writer, 405, {"error": "method not allowed"})
+            elif parts == ["status"]:
+                await self._reply(writer, 200, self.status())
+            elif len(parts) >= 2 and parts[0] == "runs" and parts[1] in self.jobs:
+                job = self.jobs[parts[1]]
+                if parts[2:] == ["progress"]:
+                    await self._stream(writer, job)
+                elif not parts[2:]:
+                    await self._reply(writer, 200, job.describe(query.get("arrays", ["0"])[0] == "1"))
+                else:
+                    await self._reply(writer, 404, {"error": "not found"})
+            else:
+                await self._reply(writer, 404, {"error": "not found"})
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _reply(self, writer, code, payload):
+        body = json.dumps(payload).encode()
+        writer.write(f"HTTP/1.1 {code} {reasons[code]}\r\nContent-Type: application/json\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+
+    async def _stream(self, writer, job):
+        '''one JSON line per change of progress, ending with the finished job'''
+        writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n")
+        last = None
+        while job.status in ("queued", "running"):
+            if (job.status, job.progress) != last:
+                last = job.status, job.progress
+                writer.write(json.dumps({"status": job.status, "progress": job.progress}).encode() + b"\n")
+                await writer.drain()
+            await asyncio.sleep(0.2)
+        writer.write(json.dumps(job.describe()).encode() + b"\n")
+        await writer.drain()
+
+    async def serve(self, address=(host, port)):
+        '''serves until cancelled, address is (host, port) or the path of a Unix socket'''
+        self._pool = ProcessPoolExecutor(self.workers, initializer=_init, initargs=(self._progress,))
+        reader = asyncio.get_running_loop().create_task(self._read_progress())
+        if isinstance(address, str):
+            server = await asyncio.start_unix_server(self.handle, address)
+        else:
+            server = await asyncio.start_server(self.handle, *address)
+        print(f"serving on {address} with {self.workers} workers")
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self._progress.put(None)
+            await reader
+            self._pool.shutdown(cancel_futures=True)
+            if isinstance(address, str) and os.path.exists(address):
+                os.remove(address)
+
+
+#client
+class _UnixConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+def connect(address=(host, port)):
+    if isinstance(address, str):
+        return _UnixConnection(address)
+    return http.client.HTTPConnection(*address)
+
+def request(method, path, body=None, address=(host, port)):
+    '''one request to a running server, returns the decoded JSON reply'''
+    conn = connect(address)
+    try:
+        conn.request(method, path, None if body is None else json.dumps(body),
+                     {"Content-Type": "application/json"})
+        return json.loads(conn.getresponse().read())
+    finally:
+        conn.close()
+
+def submit(scenario, address=(host, port), progress=True, **options):
+    '''posts a scenario (dict of overrides or a script path) and waits for it,
+    printing progress. options are dt, steps and record_every. returns the finished job
+    '''
+    job = request("POST", "/runs", {"scenario": scenario, **options}, address)
+    if "id" not in job:
+        raise ValueError(job["error"])
+    conn = connect(address)
+    try:
+        conn.request("GET", f"/runs/{job['id']}/progress")
+        for line in conn.getresponse():
+            update = json.loads(line)
+            if progress and "id" not in update:
+                print(f"\r{update['status']} {update['progress']:.0%}", end="", flush=True)
+    finally:
+        conn.close()
+    if progress:
+        print()
+    return update
+
+def main():
+    parser = argparse.ArgumentParser(description="local job server for model runs")
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--socket", help="serve on (or connect to) this Unix socket instead")
+    parser.add_argument("--workers", type=int, help="worker processes (default: one per core)")
+    parser.add_argument("--submit", metavar="SCENARIO",
+                        help="submit a script path or JSON overrides to a running server and wait")
+    parser.add_argument("--steps", type=int)
+    args = parser.parse_args()
+    address = args.socket or (host, args.port)
+    if args.submit is None:
+        try:
+            asyncio.run(Server(args.workers).serve(address))
+        except KeyboardInterrupt:
+            pass
+        return
+    scenario = json.loads(args.submit) if args.submit.lstrip().startswith("{") else args.submit
+    options = {} if args.steps is None else {"steps": args.steps}
+    job = submit(scenario, address, **options)
+    print(json.dumps(job, indent=1))
+
+if __name__ == "__main__":
+    main()
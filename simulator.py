@@ -0,0 +1,262 @@
+'''Step-wise simulator, for driving the model from a controller.
+
+A Simulator holds one building: its config, the state as small float arrays
+and the step count, and advances with the compiled block loop of kernel.py
+(the same numbers as Ventilation.run()). It keeps its own copy of the config,
+so several simulators can run side by side and none of them touches the
+module variables of Ventilation. Vent openings and occupancy can be changed
+between calls; the next step uses them.
+
+    import simulator
+    sim = simulator.Simulator()
+    while sim.t < 2*24*3600:
+        sim.vents_a = [8, 8] if sim.T.max() > 25 else [4, 3]   #a controller
+        sim.step(60)
+'''
+#imports
+import numpy as np
+import forcing
+import kernel
+import results
+import Ventilation as V
+
+
+class Simulator:
+    '''one building, advanced a number of steps of dt at a time.
+    config is a dict of user defined variables (default: as set in Ventilation),
+    overrides are applied on top. record_every > 0 records every record_every
+    steps into res, a results.Results; None records nothing.
+    after one of the model's failure checks, error holds the reason and the
+    simulator does not step any further until reset()
+    '''
+    __slots__ = ("config", "dt", "i", "g", "chimney", "last_flow", "error", "res", "record_every",
+                 "_params", "_weather", "_weather_key", "_block", "_scratch")
+
+    def __init__(self, config=None, dt=None, record_every=None, **overrides):
+        dt = V.dt if dt is None else dt
+        self.config = V.get_config(**{**(config or {}), **overrides})
+        self.dt = dt
+        self.record_every = record_every
+        self._weather = None
+        self._weather_key = None
+        self._params = None
+        self._block = None
+        self._scratch = None
+        self._configure()
+        self.reset()
+
+    def _configure(self):
+        '''parameter arrays of the kernel, and the weather, from config'''
+        c = self.config
+        key = None if c["weather_file"] is None else (c["weather_file"], c["weather_start"])
+        if key != self._weather_key:
+            self._weather = None if key is None else forcing.read_weather(*key)
+            self._weather_key = key
+        T_night = c["T_night"]
+        inlet = c["inlet_temp"] is not None
+        self._params = [np.array(c["H"], dtype=float), float(c["H_a"]),
+                        np.array([v[1] for v in c["vents"]], dtype=float), np.array(c["h_v"], dtype=float),
+                        np.array(c["S"], dtype=float), float(c["S_a"]),
+                        np.array([V.get_A_eff(v[0], v[1]) for v in c["vents"]], dtype=float),
+                        float(V.get_A_eff(*c["vents_a"])), float(V.w_to_B(c["w"])),
+                        np.array([V.w_to_B(p) for p in c["peak_solar"]], dtype=float), inlet,
+                        float(V.g_real*(c["inlet_temp"]-T_night)/(273+T_night)) if inlet else 0.0,
+                        float(V.alpha), float(V.rho), kernel.z_powers, float(V.g_real), float(T_night)]
+        self._block = None              #forcing depends on the config too
+
+    def reset(self, state=None, t=0):
+        '''back to state (default: Ventilation.initial_state() for this building) at time t (s)'''
+        if state is None:
+            state = [0]*len(self.config["H"]), 0, 0, 0.99*self.config["H_a"], 0
+        self.state = state
+        self.i = round(t/self.dt)
+        self.last_flow = np.ones(len(self.config["H"]) + 1, dtype=np.int8)
+        self.error = None
+        if self.record_every:
+            self.res = results.Results(1024, len(self.config["H"]), self.record_every*self.dt)
+        else:
+            self.res = None
+
+    def _forcing(self, i):
+        '''(first step, g_ext, sun, people) of the forcing block holding step i'''
+        block = self._block
+        if block is None or not block[0] <= i < block[0] + len(block[1]):
+            k0 = i//forcing.block*forcing.block
+            T_ext, sun, people = forcing.tables(self.config, self.dt, k0, k0 + forcing.block, self._weather)
+            T_night = self.config["T_night"]
+            block = self._block = (k0, V.g_real*(T_ext-T_night)/(273+T_night),
+                                   np.ascontiguousarray(sun, dtype=float),
+                                   np.ascontiguousarray(people, dtype=float))
+        return block
+
+    def _records(self, n):
+        '''scratch arrays for the records of n steps, in results.record_order'''
+        rooms = len(self.config["H"])
+        if self._scratch is None or len(self._scratch[0]) < n:
+            self._scratch = [np.empty((n,) + results.get_shape(name, rooms),
+                                      np.int8 if name == "flow" else float)
+                             for name in results.record_order]
+        return self._scratch
+
+    def step(self, n=1):
+        '''advances up to n steps, returns the number taken (fewer if the model fails)'''
+        if self.error is not None:
+            return 0
+        every = self.record_every or 2**62       #with no recording, only step 0 writes to the scratch
+        taken = 0
+        while taken < n:
+            k0, g_ext, sun, people = self._forcing(self.i)
+            a = self.i - k0
+            m = min(n - taken, len(g_ext) - a)
+            rec = self._records(m//every + 2 if self.record_every else 1)
+            done, k, error, fail = kernel._run_block(self.i, self.i + m, float(self.dt), every,
+                                                     self.g, self.chimney, g_ext[a:a+m], sun[a:a+m],
+                                                     people[a:a+m], *self._params, *rec, self.last_flow)
+            self.i += done
+            taken += done
+            if self.res is not None and k:
+                self.res.extend(*[r[:k] for r in rec])
+            if error:
+                h, g_h, g_c, bad = fail
+                self.error = kernel.errors[error].format(t=self.i*self.dt, B_out=bad)
+                if self.res is not None:
+                    self.res.error = self.error
+                break
+        if self.res is not None:
+            self.res.steps += taken
+            self.res.state = self.state
+            self.res.flow = self.last_flow.tolist()
+        return taken
+
+    def advance_to(self, t):
+        '''steps until time t (s), returns the number of steps taken'''
+        return self.step(max(0, round(t/self.dt) - self.i))
+
+    #state
+    @property
+    def t(self):
+        '''time, s'''
+        return self.i*self.dt
+
+    @property
+    def state(self):
+        '''(g, g_h, g_c, h, throughflow) as in Ventilation.step()'''
+        return (self.g.tolist(),) + tuple(self.chimney.tolist())
+
+    @state.setter
+    def state(self, state):
+        self.g = np.array(state[0], dtype=float)
+        self.chimney = np.array(state[1:], dtype=float)
+
+    def _temp(self, g):
+        T_night = self.config["T_night"]
+        return T_night+(g/V.g_real)*(273+T_night)
+
+    @property
+    def T(self):
+        '''room temps, deg C'''
+        return self._temp(self.g)
+
+    @property
+    def T_h(self):
+        '''hot layer temp, deg C'''
+        return float(self._temp(self.chimney[0]))
+
+    @property
+    def T_c(self):
+        '''cold layer temp, deg C'''
+        return float(self._temp(self.chimney[1]))
+
+    @property
+    def h(self):
+        '''interface height, m'''
+        return float(self.chimney[2])
+
+    @property
+    def throughflow(self):
+        '''chimney throughflow, m^3/s'''
+        return float(self.chimney[3])
+
+    @property
+    def T_ext(self):
+        '''external temp now, deg C'''
+        return float(forcing.ext_temp(self.config, self.t, self._weather))
+
+    #controls
+    def set(self, **overrides):
+        '''changes user defined variables from the next step on'''
+        self.config = V.get_config(**{**self.config, **overrides})
+        self._configure()
+
+    @property
+    def vents(self):
+        '''room vent areas, [[low, high], ...]'''
+        return [list(v) for v in self.config["vents"]]
+
+    @vents.setter
+    def vents(self, vents):
+        vents = [[float(a), float(b)] for a, b in vents]
+        self.config["vents"] = vents
+        self._params[2][:] = [v[1] for v in vents]
+        self._params[6][:] = [V.get_A_eff(a, b) for a, b in vents]
+
+    @property
+    def vents_a(self):
+        '''atrium vent areas, [low, high]'''
+        return list(self.config["vents_a"])
+
+    @vents_a.setter
+    def vents_a(self, vents_a):
+        self.config["vents_a"] = [float(v) for v in vents_a]
+        self._params[7] = float(V.get_A_eff(*vents_a))
+
+    @property
+    def n(self):
+        '''people per room while occupied'''
+        return list(self.config["n"])
+
+    @n.setter
+    def n(self, n):
+        self.config["n"] = list(n)
+        self._block = None
+
+def open_when_hot(sim, threshold=25, open_a=(8, 8), shut_a=(4, 3), open_rooms=2):
+    '''example controller: opens the atrium vents and scales the room vents up by
+    open_rooms while any room is above threshold deg C, else the design areas
+    '''
+    hot = sim.T.max() > threshold
+    if hot != (sim.vents_a == list(open_a)):
+        sim.vents_a = open_a if hot else shut_a
+        sim.vents = [[a*open_rooms, b*open_rooms] if hot else [a/open_rooms, b/open_rooms]
+                     for a, b in sim.vents]
+
+def episode(controller, hours=48, every=60, **overrides):
+    '''one closed loop run: controller(sim) every every steps. returns the simulator'''
+    sim = Simulator(**overrides)
+    stop = round(hours*3600/sim.dt)
+    while sim.i < stop and sim.error is None:
+        controller(sim)
+        sim.step(min(every, stop - sim.i))
+    return sim
+
+def main():
+    '''opening up when hot against the fixed design, over a range of occupancies'''
+    import time
+    episode(open_when_hot, hours=1)     #compile
+    peak = {}
+    t0 = time.perf_counter()
+    runs = 0
+    for people in range(10, 51, 10):
+        for name, controller in [("fixed", lambda sim: None), ("controlled", open_when_hot)]:
+            sim = episode(controller, hours=72, n=[people, people], record_every=60)
+            day_3 = sim.res["t"] >= 48
+            peak[people, name] = sim.res["T"][day_3].max()
+            runs += 1
+    elapsed = time.perf_counter() - t0
+    for people in range(10, 51, 10):
+        print(f"{people} people: peak day 3 room temp fixed {peak[people, 'fixed']:.2f}, "
+              f"controlled {peak[people, 'controlled']:.2f} deg C")
+    print(f"{runs} three day episodes with a control call a minute in {elapsed:.2f} s")
+
+if __name__ == "__main__":
+    main()
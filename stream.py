@@ -0,0 +1,180 @@
+'''Streaming trajectory output for long runs.
+
+StreamWriter takes records like results.Results, but buffers them in a chunk
+of fixed size and flushes each full chunk into one memory-mapped .npy file per
+channel. A small header.json describes the channels, their units and how many
+records are on disk, so a finished, failed or killed run can be opened with
+read_stream() and sliced without loading the rest.
+
+    import Ventilation as V, stream
+    V.steps = 365*24*3600
+    V.record_interval = 60
+    res = stream.run_to_disk("year_run")
+    day_100 = res.window(99*24, 100*24)     #hrs
+'''
+#imports
+import json
+import os
+import numpy as np
+import results
+import Ventilation as V
+
+header_name = "header.json"
+
+
+class StreamWriter:
+    '''writes records to path (a directory) in chunks of chunk records.
+    capacity is the most records the run can produce, the .npy files are
+    allocated at that length and filled as chunks are flushed.
+    meta is stored in the header as is, e.g. the config of the run.
+    use as a context manager, or call close() at the end of the run
+    '''
+    def __init__(self, path, capacity, rooms, interval=1, names=None, dtype="float64",
+                 chunk=65536, meta=None):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.capacity = capacity
+        self.buffer = results.Results(chunk, rooms, interval, names, dtype)
+        self.chunk = chunk
+        self.names = self.buffer.names
+        self.size = 0                   #records on disk
+        self.steps = 0
+        self.state = None               #kept in memory only
+        self.flow = None
+        self.error = None
+        self.complete = False
+        self.meta = meta or {}
+        self.files = {}
+        for name in self.names:
+            shape = (capacity,) + results.get_shape(name, rooms)
+            self.files[name] = np.lib.format.open_memmap(os.path.join(path, name + ".npy"), mode="w+",
+                                                         dtype=results.get_dtype(name, dtype), shape=shape)
+        self.header = {"rooms": rooms, "interval": interval, "capacity": capacity, "chunk": chunk,
+                       "channels": {name: {"unit": results.channels[name][1],
+                                           "shape": list(self.files[name].shape[1:]),
+                                           "dtype": str(self.files[name].dtype)}
+                                    for name in self.names}}
+        self._write_header()
+
+    def record(self, *values):
+        '''same arguments as results.Results.record'''
+        self.buffer.record(*values)
+        if self.buffer.size == self.chunk:
+            self.flush()
+
+    def extend(self, *columns):
+        '''same arguments as results.Results.extend'''
+        n = len(columns[0])
+        k = 0
+        while k < n:
+            m = min(n - k, self.chunk - self.buffer.size)
+            self.buffer.extend(*[c[k:k+m] for c in columns])
+            k += m
+            if self.buffer.size == self.chunk:
+                self.flush()
+
+    def flush(self):
+        '''writes the buffered records to disk and updates the header'''
+        n = self.buffer.size
+        if self.size + n > self.capacity:
+            raise ValueError(f"stream capacity of {self.capacity} records exceeded")
+        for name in self.names:
+            self.files[name][self.size:self.size+n] = self.buffer[name]
+            self.files[name].flush()
+        self.size += n
+        self.buffer.size = 0
+        self._write_header()
+
+    def close(self, complete=True):
+        '''flushes the last records. complete is False for a run that was cut short'''
+        self.complete = complete
+        self.flush()
+        self.files = {}
+
+    def __len__(self):
+        return self.size + self.buffer.size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, kind, value, traceback):
+        #an exception (a model error, ctrl-c) leaves the records so far, marked incomplete
+        if kind is not None and self.error is None:
+            self.error = f"{kind.__name__}: {value}"
+        self.close(complete=kind is None)
+
+    def _write_header(self):
+        self.header.update(size=self.size, steps=self.steps, error=self.error,
+                           complete=self.complete, meta=self.meta)
+        tmp = os.path.join(self.path, header_name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.header, f, indent=1)
+        os.replace(tmp, os.path.join(self.path, header_name))
+
+class StoredResults:
+    '''a run on disk, channels are memory-mapped and cut to the records written.
+    indexes like results.Results: res["T"][:,0]
+    '''
+    def __init__(self, path):
+        with open(os.path.join(path, header_name)) as f:
+            self.header = json.load(f)
+        self.path = path
+        self.size = self.header["size"]
+        self.steps = self.header["steps"]
+        self.error = self.header["error"]
+        self.complete = self.header["complete"]
+        self.interval = self.header["interval"]
+        self.rooms = self.header["rooms"]
+        self.names = list(self.header["channels"])
+        self.data = {name: np.load(os.path.join(path, name + ".npy"), mmap_mode="r")[:self.size]
+                     for name in self.names}
+
+    def window(self, start, end):
+        '''dict of the channels for records with start <= t < end, in hrs'''
+        i, j = np.searchsorted(self.data["t"], [start, end])
+        return {name: array[i:j] for name, array in self.data.items()}
+
+    def units(self, name):
+        return self.header["channels"][name]["unit"]
+
+    def __getitem__(self, name):
+        return self.data[name]
+
+    def __contains__(self, name):
+        return name in self.data
+
+    def __len__(self):
+        return self.size
+
+def read_stream(path):
+    '''opens a run written by StreamWriter, finished or not'''
+    return StoredResults(path)
+
+def run_to_disk(path, chunk=65536, adaptive=False):
+    '''runs the model as configured in Ventilation, streaming to path.
+    uses the record_* setup variables, returns the run opened with read_stream
+    '''
+    if adaptive:
+        capacity = int(V.steps*V.dt/V.record_interval) + 2
+    else:
+        capacity = (V.steps-1)//max(1, round(V.record_interval/V.dt)) + 1
+    meta = {"config": V.get_config(), "dt": V.dt, "steps": V.steps, "adaptive": adaptive}
+    with StreamWriter(path, capacity, len(V.H), V.record_interval, V.record_channels,
+                      V.record_dtype, chunk, meta) as sink:
+        if adaptive:
+            V.run_adaptive(sink)
+        else:
+            V.run(sink)
+    return read_stream(path)
+
+def main():
+    '''a year at dt=1, recording every minute'''
+    V.steps = 365*24*3600
+    V.record_interval = 60
+    res = run_to_disk("year_run")
+    print(f"{res.steps} steps, {len(res)} records in year_run/")
+    june = res.window(151*24, 181*24)
+    print(f"June: peak room temp {june['T'].max():.2f}, mean {june['T'].mean():.2f} deg C")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+'''Surrogate emulator of the model, for instant answers while exploring designs.
+
+train() samples the user defined variables within bounds (keys as in
+optimise.py, e.g. "S_a", "vents_a[0]", "n[1]") by Latin hypercube, runs the
+model at every sample, keeps part of the samples back for validation and fits
+an Emulator of a few scalar outputs of a run to the rest. Two NumPy-only
+emulators are available:
+
+    "rbf"   cubic radial basis functions plus a linear trend, interpolating
+    "pce"   polynomial chaos: a least squares fit of Legendre polynomials up to
+            a total degree
+
+Inputs are scaled to the unit box of the bounds. A query outside the box is
+extrapolation and is flagged. An Emulator is saved to and loaded from a single
+.npz file, and one prediction takes tens of microseconds.
+
+    import surrogate
+    em = surrogate.train({"S_a": (20, 60), "vents_a[0]": (2, 6), "n[0]": (10, 50)})
+    em.report()                     #held-out errors
+    em.save("atrium.npz")
+    em = surrogate.load("atrium.npz")
+    em.predict({"S_a": 40, "vents_a[0]": 4, "n[0]": 30})    #{"peak_room_temp": ..., ..., "inside": True}
+'''
+#imports
+import json
+from itertools import product
+import numpy as np
+import montecarlo
+import optimise
+import parallel
+import Ventilation as V
+
+
+def mean_throughflow(run):
+    '''mean chimney throughflow, m^3/s'''
+    return float(np.nanmean(run["throughflow"]))
+
+#scalar outputs of a run to emulate, functions of a run as in optimise.py
+outputs = {"peak_room_temp": optimise.peak_room_temp, "mean_throughflow": mean_throughflow,
+           "hours_above_25": optimise.hours_above(25)}
+
+
+def legendre(z, degree):
+    '''Legendre polynomials 0..degree at z in [-1, 1], shape z.shape + (degree+1,)'''
+    out = [np.ones_like(z), z]
+    for k in range(1, degree):
+        out.append(((2*k + 1)*z*out[k] - k*out[k-1])/(k + 1))
+    return np.stack(out[:degree+1], axis=-1)
+
+def multi_indices(dims, degree):
+    '''exponents of every product of polynomials of total degree up to degree'''
+    return np.array([a for a in product(range(degree + 1), repeat=dims) if sum(a) <= degree])
+
+def pce_terms(basis, indices):
+    '''products of the polynomials in basis (..., dims, degree+1) with the exponents
+    of each row of indices (terms, dims), shape (..., terms)
+    '''
+    return basis[..., np.arange(indices.shape[1]), indices].prod(axis=-1)
+
+class Emulator:
+    '''a fitted emulator of outputs (names) over keys within lo..hi.
+    the parameters of the fit are arrays in params, see fit_rbf and fit_pce
+    '''
+    def __init__(self, method, keys, lo, hi, names, params, validation=None, meta=None):
+        self.method = method
+        self.keys = list(keys)
+        self.lo = np.asarray(lo, dtype=float)
+        self.hi = np.asarray(hi, dtype=float)
+        self.scale = 1/(self.hi - self.lo)
+        self.names = list(names)
+        self.params = params
+        self.validation = validation or {}
+        self.meta = meta or {}
+        if method == "rbf":
+            #squared distances to the centres as |c|^2 - 2c.u + |u|^2
+            self._norms = (params["centres"]**2).sum(axis=1)
+            self._centres_t = np.ascontiguousarray(params["centres"].T)
+
+    def unit(self, x):
+        '''inputs scaled to the unit box'''
+        return (np.asarray(x, dtype=float) - self.lo)*self.scale
+
+    def __call__(self, x):
+        '''outputs at x, an array of inputs in the order of keys (one point or (points, keys)),
+        shape (..., outputs)
+        '''
+        u = self.unit(x)
+        p = self.params
+        if self.method == "rbf":
+            r = np.sqrt(np.maximum(self._norms - 2*(u @ self._centres_t) + (u*u).sum(axis=-1)[...,None], 0))
+            return (r*r*r) @ p["weights"] + u @ p["linear"] + p["constant"]
+        basis = legendre(2*u - 1, int(p["degree"]))         #(..., keys, degree+1)
+        return pce_terms(basis, p["indices"]) @ p["coefs"]
+
+    def inside(self, x):
+        '''True where x is within the trained box'''
+        u = self.unit(x)
+        return ((u >= 0) & (u <= 1)).all(axis=-1)
+
+    def vector(self, design):
+        '''a design dict as an input array'''
+        missing = [k for k in self.keys if k not in design]
+        if missing:
+            raise KeyError(f"design is missing {missing}")
+        return np.array([design[k] for k in self.keys], dtype=float)
+
+    def predict(self, design):
+        '''outputs at a design dict, with "inside" False if it is outside the trained box'''
+        x = self.vector(design)
+        out = dict(zip(self.names, self(x).tolist()))
+        out["inside"] = bool(self.inside(x))
+        return out
+
+    def report(self):
+        '''prints the held-out errors'''
+        n = self.validation.get("samples", 0)
+        print(f"{self.method} emulator of {len(self.keys)} inputs, trained on "
+              f"{self.meta.get('samples', '?')} runs, validated on {n}")
+        for name in self.names:
+            v = self.validation.get(name)
+            if v:
+                print(f"  {name:>18}: rmse {v['rmse']:.4g}, max {v['max']:.4g}, r^2 {v['r2']:.4f}")
+
+    def save(self, path):
+        '''writes the emulator to path (.npz)'''
+        meta = {"method": self.method, "keys": self.keys, "names": self.names,
+                "validation": self.validation, "meta": self.meta}
+        np.savez(path, lo=self.lo, hi=self.hi, header=json.dumps(meta),
+                 **{"p_" + k: v for k, v in self.params.items()})
+        return path
+
+def load(path):
+    '''an Emulator written by Emulator.save'''
+    with np.load(path) as f:
+        meta = json.loads(str(f["header"]))
+        params = {k[2:]: f[k] for k in f.files if k.startswith("p_")}
+        return Emulator(meta["method"], meta["keys"], f["lo"], f["hi"], meta["names"], params,
+                        meta["validation"], meta["meta"])
+
+def fit_rbf(u, y, smoothing=0.0):
+    '''cubic radial basis functions with a linear trend through the points u (unit box).
+    smoothing > 0 trades interpolation for a smoother fit
+    '''
+    n, d = u.shape
+    r = np.sqrt(((u[:,None,:] - u[None,:,:])**2).sum(axis=-1))
+    P = np.hstack([np.ones((n, 1)), u])
+    A = np.zeros((n + d + 1, n + d + 1))
+    A[:n,:n] = r**3 + smoothing*np.eye(n)
+    A[:n,n:] = P
+    A[n:,:n] = P.T
+    b = np.vstack([y, np.zeros((d + 1, y.shape[1]))])
+    sol = np.linalg.lstsq(A, b, rcond=None)[0]
+    return {"centres": u, "weights": sol[:n], "constant": sol[n], "linear": sol[n+1:]}
+
+def fit_pce(u, y, degree=3):
+    '''Legendre polynomial chaos of total degree up to degree, least squares'''
+    indices = multi_indices(u.shape[1], degree)
+    psi = pce_terms(legendre(2*u - 1, degree), indices)
+    coefs = np.linalg.lstsq(psi, y, rcond=None)[0]
+    return {"degree": np.array(degree), "indices": indices, "coefs": coefs}
+
+def errors(predicted, actual, names):
+    '''rmse, max abs error and r^2 per output'''
+    out = {"samples": len(actual)}
+    for k, name in enumerate(names):
+        e = predicted[:,k] - actual[:,k]
+        var = np.var(actual[:,k])
+        out[name] = {"rmse": float(np.sqrt(np.mean(e**2))), "max": float(np.abs(e).max()),
+                     "r2": float(1 - np.mean(e**2)/var) if var > 0 else float("nan")}
+    return out
+
+def sample(bounds, samples, base=None, seed=0, engine="kernel", batch=64, record_every=60,
+           workers=None, dt=None, steps=None):
+    '''runs the model at samples Latin hypercube points within bounds ({key: (lo, hi)})
+    around base (a scenario as for parallel.get_scenario, default the current config).
+    engine as in montecarlo.run. returns (inputs (samples, keys), outputs (samples, outputs),
+    ok: False for runs that failed)
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    base = parallel.get_scenario(V.get_config() if base is None else base)
+    keys = list(bounds)
+    lo = np.array([bounds[k][0] for k in keys], dtype=float)
+    hi = np.array([bounds[k][1] for k in keys], dtype=float)
+    x = optimise.latin_hypercube(samples, lo, hi, np.random.default_rng(seed))
+    y = np.zeros((samples, len(outputs)))
+    ok = np.zeros(samples, dtype=bool)
+    for k0 in range(0, samples, batch):
+        configs = [optimise.apply(base, dict(zip(keys, map(float, p)))) for p in x[k0:k0+batch]]
+        _, runs = montecarlo.run_batch(configs, engine, record_every, workers, dt, steps)
+        for k, run in enumerate(runs, k0):
+            y[k] = [f(run) for f in outputs.values()]
+            ok[k] = run["steps_run"] == run["steps"]
+    return x, y, ok
+
+def fit(bounds, x, y, method="rbf", holdout=0.2, degree=3, smoothing=0.0, seed=0, meta=None):
+    '''fits an Emulator of outputs to samples x (samples, keys) with outputs y
+    (samples, outputs), all but holdout of them, which are kept back to measure its error
+    '''
+    keys = list(bounds)
+    lo = np.array([bounds[k][0] for k in keys], dtype=float)
+    hi = np.array([bounds[k][1] for k in keys], dtype=float)
+    held = np.random.default_rng(seed).random(len(x)) < holdout
+    u = (x - lo)/(hi - lo)
+    if method == "rbf":
+        params = fit_rbf(u[~held], y[~held], smoothing)
+    elif method == "pce":
+        params = fit_pce(u[~held], y[~held], degree)
+    else:
+        raise ValueError(f"unknown emulator: {method}")
+    em = Emulator(method, keys, lo, hi, list(outputs), params, meta={"samples": int((~held).sum()),
+                                                                    **(meta or {})})
+    if held.any():
+        em.validation = errors(em(x[held]), y[held], em.names)
+    return em
+
+def train(bounds, samples=200, method="rbf", holdout=0.2, degree=3, smoothing=0.0, base=None,
+          seed=0, engine="kernel", record_every=60, workers=None, dt=None, steps=None):
+    '''samples the model within bounds and fits an Emulator to the runs that did
+    not fail, see sample() and fit()
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    x, y, ok = sample(bounds, samples, base, seed, engine, record_every=record_every,
+                      workers=workers, dt=dt, steps=steps)
+    meta = {"failed": int((~ok).sum()), "dt": dt, "steps": steps,
+            "base": parallel.get_scenario(V.get_config() if base is None else base)}
+    return fit(bounds, x[ok], y[ok], method, holdout, degree, smoothing, seed, meta)
+
+def main():
+    '''an atrium design space over a day, both emulators, and the cost of a query'''
+    import time
+    bounds = {"S_a": (20, 60), "H_a": (7, 12), "vents_a[0]": (2, 6), "vents_a[1]": (2, 6),
+              "n[0]": (10, 50), "n[1]": (10, 50)}
+    x, y, ok = sample(bounds, 160, steps=24*3600)
+    design = {"S_a": 40, "H_a": 9, "vents_a[0]": 4, "vents_a[1]": 3, "n[0]": 30, "n[1]": 30}
+    for method in ("rbf", "pce"):
+        em = fit(bounds, x[ok], y[ok], method)
+        em.report()
+        point = em.vector(design)
+        em(point)
+        t0 = time.perf_counter()
+        for _ in range(10000):
+            em(point)
+        print(f"  one query: {(time.perf_counter() - t0)/10000*1e6:.1f} us")
+        if method == "rbf":
+            em.save("surrogate.npz")
+    em = load("surrogate.npz")
+    print(em.predict(design))
+    print(em.predict({**design, "S_a": 100}))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+'''Tall buildings: any number of storeys on one atrium.
+
+Ventilation.step() loops over the rooms in Python, so each extra storey adds
+interpreter work to every step. run() here advances one building with
+kernel.run(), the compiled model, whose loops over the rooms cost a storey
+little more than its arithmetic (Ventilation.run() without Numba). run_array()
+is the same building on the ensemble engine with a single member, the room
+state as arrays: a storey costs array elements rather than Python loop
+iterations, but it has a large fixed cost per step, so it only beats the
+interpreted loop for very tall buildings. benchmark() times all three.
+
+    import tower
+    res = tower.run(tower.get_config(50), steps=24*3600)
+'''
+#imports
+import time
+import ensemble
+import kernel
+import Ventilation as V
+from results import Results
+
+
+def get_config(storeys, storey_height=3, **overrides):
+    '''config dict for a stack of identical storeys like the default building,
+    with the atrium one storey taller and its vents and area scaled up with the
+    number of storeys
+    '''
+    scale = storeys/2
+    config = {"H": [storey_height]*storeys,
+              "H_a": storey_height*(storeys+1),
+              "vents": [[1, 1]]*storeys,
+              "h_v": [storey_height*(j+1) for j in range(storeys)],
+              "S": [60]*storeys,
+              "n": [30]*storeys,
+              "peak_solar": [20000]*storeys,
+              "vents_a": [4*scale, 3*scale],
+              "S_a": 36*scale}
+    config.update(overrides)
+    return config
+
+def run(config=None, dt=None, steps=None, res=None, state=None, start=0):
+    '''runs one building (default: Ventilation's config) for steps timesteps of dt
+    from step start with kernel.run(), leaving Ventilation as it was. returns a
+    result store using the record_* setup variables. state is as for
+    Ventilation.run(), initial if None
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    saved = V.get_config(), V.dt
+    try:
+        V.configure(**(config or {}))
+        V.dt = dt
+        return kernel.run(res, state, start, start+steps)
+    finally:
+        config, V.dt = saved
+        V.configure(**config)
+
+def run_array(config=None, dt=None, steps=None, res=None, state=None, start=0):
+    '''run() on the ensemble engine with a single member. state is an ensemble
+    state of one member, initial if None
+    '''
+    dt = V.dt if dt is None else dt
+    steps = V.steps if steps is None else steps
+    p = ensemble.get_params([config or {}], (start+steps)*dt/3600 + 1)
+    rooms = p["H"].shape[1]
+    every = max(1, round(V.record_interval/dt))
+    if res is None:
+        res = Results((steps-1)//every + 1, rooms, V.record_interval, V.record_channels, V.record_dtype)
+    if state is None:
+        state = ensemble.initial_state(p)
+    k = (273+p["T_night"][0])/V.g_real
+    T_night = p["T_night"][0]
+    for i in range(start, start+steps):
+        t = i*dt
+        new_state, Q, dp, flow, err = ensemble.step(p, t, dt, state)
+        if err[0]:
+            res.error = ensemble.errors[err[0]]
+            print(res.error)
+            break
+        delta = new_state[2][0] - state[2][0]
+        state = new_state
+        res.steps += 1
+
+        #gather data
+        if i % every == 0:
+            g, g_h, g_c, h, throughflow = state
+            res.record(t/3600, T_night + g[0]*k, T_night + g_h[0]*k, T_night + g_c[0]*k, h[0],
+                       dp[0], Q[0], flow[0], delta, throughflow[0])
+    res.state = state
+    return res
+
+def time_scalar(config, steps, start):
+    '''steps per second of Ventilation.run() on config'''
+    saved = V.get_config()
+    V.configure(**config)
+    try:
+        t0 = time.perf_counter()
+        res = V.run(V.new_results(steps), start=start, stop=start+steps)
+        return res.steps/(time.perf_counter()-t0)
+    finally:
+        V.configure(**saved)
+
+def time_array(config, steps, start):
+    '''steps per second of run_array() on config'''
+    t0 = time.perf_counter()
+    res = run_array(config, steps=steps, start=start)
+    return res.steps/(time.perf_counter()-t0)
+
+def time_kernel(config, steps, start):
+    '''steps per second of run() on config, compiled first'''
+    run(config, steps=2, start=start)
+    t0 = time.perf_counter()
+    res = run(config, steps=steps, start=start)
+    return res.steps/(time.perf_counter()-t0)
+
+def benchmark(storeys=(2, 10, 30, 50, 200, 500), steps=3600, start=12*3600):
+    '''steps per second of the three engines for buildings of each height, and
+    their speedups over the interpreted loop, timed over steps steps from start
+    (midday, when every regime is active)
+    '''
+    print(f"{'storeys':>8}{'scalar':>12}{'array':>12}{'kernel':>12}{'array x':>10}{'kernel x':>10}   (steps/s)")
+    for n in storeys:
+        config = get_config(n)
+        scalar = time_scalar(config, steps, start)
+        array = time_array(config, steps, start)
+        compiled = time_kernel(config, steps, start)
+        print(f"{n:>8}{scalar:>12.0f}{array:>12.0f}{compiled:>12.0f}{array/scalar:>10.2f}{compiled/scalar:>10.2f}")
+
+def main():
+    benchmark()
+
+if __name__ == "__main__":
+    main()